@@ -0,0 +1,250 @@
+## Benchmarks of the design pipeline with machine-readable baselines
+# Every stage is timed (best of `repeat` runs) and its peak traced memory recorded (one extra run under
+# tracemalloc, which counts numpy buffers) for synthetic specs of growing size and the two real specs:
+#   full_factorial   - all level combinations (profile generation)
+#   profile_rules    - profile rule masks over the full factorial (previously valid_alternative)
+#   pair_enumeration - streaming every valid pair in chunks (previously the double loop with valid_choice)
+#   long_csv         - LongCsvSink for the first n_convert_sets pairs (the idefix candidates)
+#   ngene_sample     - NgeneSampleSink sampling ngene_sample of the first n_convert_sets pairs
+#   design_to_ngene  - converters.convert of the first n_convert_sets pairs from a coded design file (as written by
+#                      modfederov.R / modfed.py) to the Ngene format (convert_des_to_ngene_format)
+#   db_error         - DB-error of one design of n_sets random valid sets (efficiency.py)
+#   swap_db_errors   - DB-errors of every (candidate, position) swap for n_candidates candidates (exchange.py)
+# Results are written as json with the machine they ran on. compare() lists the stages that got slower (or used
+# more memory) than a saved baseline by more than a tolerance, e.g. after a change to the enumeration, and the
+# per-spec numbers show how the cost of each stage grows with the size of the attribute space.
+#
+#   python benchmark.py --save               run everything and save benchmark_baseline.json
+#   python benchmark.py --specs small base   run some specs and compare them with the saved baseline
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from candidate_sinks import LongCsvSink, NgeneSampleSink, write_choice_sets
+from coding import ASC, Continuous, DesignCoding
+from constraints import AllOrNone, DesignSpec, Dominance, GroupOverlap
+from converters import DesignChunk, convert, design_table
+from design_specs import SPECS
+from efficiency import db_error
+from exchange import ExchangeState
+from modfed import MODFEDEROV_CODING
+from pair_enumeration import iter_valid_pair_chunks
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+## Synthetic spec shaped like the real ones
+# n_single one-attribute groups and n_triple (accuracy, frequency, coverage) groups whose first levels mean
+# 'absent' together (AllOrNone), n_levels levels per information attribute, four cost levels; exactly half of
+# the groups overlap between the alternatives, and the cost follows Dominance
+def synthetic_spec(n_single, n_triple, n_levels):
+    levels = list(range(n_levels))
+    attributes = {}
+    groups = {}
+    for g in range(n_single):
+        attributes[f'S{g + 1}_A'] = levels
+        groups[f'single_{g + 1}'] = [f'S{g + 1}_A']
+    profile_rules = []
+    for g in range(n_triple):
+        names = [f'T{g + 1}_{part}' for part in 'AFC']
+        attributes.update({name: levels for name in names})
+        groups[f'triple_{g + 1}'] = names
+        profile_rules.append(AllOrNone({name: 0 for name in names}))
+    attributes['C'] = [50, 250, 1250, 3500]
+    return DesignSpec(attributes, profile_rules=profile_rules,
+                      pair_rules=[GroupOverlap(groups, n_equal=max(len(groups) // 2, 1)), Dominance('C')])
+
+
+# specs in increasing size; the real specs use the modfederov.R coding, the synthetic ones code every attribute as
+# a continuous column
+SYNTHETIC_SPECS = {
+    'small': synthetic_spec(1, 1, 3),
+    'medium': synthetic_spec(2, 1, 4),
+    'large': synthetic_spec(2, 2, 4),
+}
+BENCHMARK_SPECS = {
+    'small': SYNTHETIC_SPECS['small'],
+    'medium': SYNTHETIC_SPECS['medium'],
+    'additional_cost_constraints': SPECS['additional_cost_constraints'],
+    'base': SPECS['base'],
+    'large': SYNTHETIC_SPECS['large'],
+}
+
+
+def _coding(name, spec, profiles):
+    if name in SPECS:
+        return MODFEDEROV_CODING.full_rank(spec, profiles)
+    return DesignCoding([ASC('asc', alternative=2)] + [Continuous(att, att.lower()) for att in spec.attribute_names])
+
+
+## Best wall-clock time of repeat calls of fn, and the peak traced memory (MB) of one more call
+def measure(fn, repeat=1, memory=True):
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return seconds, peak_mb
+
+
+## Benchmark every stage for one spec - returns a list of result records
+def benchmark_spec(name, spec, n_convert_sets=200000, ngene_sample=50000, n_sets=48, n_draws=25, n_candidates=100,
+                   repeat=3, memory=True, seed=0, report=print):
+    rng = np.random.default_rng(seed)
+    rules = spec.compile()
+    results = []
+
+    def run(stage, fn, n, stage_repeat=repeat):
+        seconds, peak_mb = measure(fn, stage_repeat, memory)
+        record = {'spec': name, 'stage': stage, 'n': int(n), 'seconds': seconds,
+                  'per_second': n / seconds if seconds > 0 else None, 'peak_mb': peak_mb}
+        results.append(record)
+        if report is not None:
+            peak = '' if peak_mb is None else f', peak {peak_mb:.1f} MB'
+            report(f"{name:>28} {stage:<17} {seconds:9.4f} s for {n:,}{peak}")
+
+    full = spec.full_factorial()
+    run('full_factorial', spec.full_factorial, len(full))
+    run('profile_rules', lambda: rules.profile_mask(full), len(full))
+    profiles = full[rules.profile_mask(full)]
+
+    def count_pairs():
+        return sum(len(chunk.left) for chunk in iter_valid_pair_chunks(profiles, rules, chunk_size=100000))
+    n_pairs = count_pairs()
+    run('pair_enumeration', count_pairs, n_pairs, stage_repeat=1)
+
+    # the first n_convert_sets pairs, held in memory so the writers are timed on their own
+    chunks = []
+    n_kept = 0
+    for chunk in iter_valid_pair_chunks(profiles, rules, chunk_size=min(n_convert_sets, 100000)):
+        if n_kept >= n_convert_sets:
+            break
+        chunks.append(chunk)
+        n_kept += len(chunk.left)
+    df_design = spec.profile_table(profiles)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def long_csv():
+            write_choice_sets(chunks, [LongCsvSink(os.path.join(tmp, 'long.csv'), df_design)])
+
+        def ngene():
+            with contextlib.redirect_stdout(io.StringIO()):
+                write_choice_sets(chunks, [NgeneSampleSink(os.path.join(tmp, 'ngene.csv'), df_design,
+                                                          max_choices=ngene_sample, seed=seed)])
+        run('long_csv', long_csv, n_kept, stage_repeat=1)
+        run('ngene_sample', ngene, n_kept, stage_repeat=1)
+
+        # the kept pairs as a coded design file, in the coding the design files of the spec are written in
+        if n_kept:
+            design_coding = MODFEDEROV_CODING if name in SPECS else _coding(name, spec, profiles)
+            codes = profiles[np.concatenate([np.stack([chunk.left, chunk.right], axis=1) for chunk in chunks])]
+            coded_path = os.path.join(tmp, 'design.csv')
+            design_table(DesignChunk(np.arange(1, n_kept + 1), codes), spec, 'coded', design_coding).to_csv(
+                coded_path, index=False)
+
+            def design_to_ngene():
+                convert(coded_path, os.path.join(tmp, 'design_ngene.csv'), spec, 'coded', 'ngene',
+                        coding=design_coding)
+            run('design_to_ngene', design_to_ngene, n_kept, stage_repeat=1)
+
+    # random designs of valid sets from the kept pairs, with draws scaled to the spread of each coded column
+    if n_kept < n_sets + n_candidates:
+        return results
+    left = np.concatenate([chunk.left for chunk in chunks])
+    right = np.concatenate([chunk.right for chunk in chunks])
+    coding = _coding(name, spec, profiles)
+    coded_profiles = coding.code_profiles(spec, profiles)
+    picked = rng.choice(n_kept, size=n_sets + n_candidates, replace=False)
+    sets = coding.stack(coded_profiles, np.stack([left[picked], right[picked]], axis=1))
+    design, candidates = sets[:n_sets], sets[n_sets:]
+    draws = rng.normal(size=(n_draws, len(coding.names))) / (coded_profiles.std(axis=0) + 1.0)
+    state = ExchangeState(design, draws)
+    run('db_error', lambda: db_error(design, draws), 1, stage_repeat=max(repeat, 10))
+    run('swap_db_errors', lambda: state.swap_db_errors(candidates), n_candidates * n_sets)
+    return results
+
+
+## Run the benchmarks for the named specs (all of BENCHMARK_SPECS by default)
+def run_benchmarks(names=None, report=print, **settings):
+    results = []
+    for name in names or BENCHMARK_SPECS:
+        results += benchmark_spec(name, BENCHMARK_SPECS[name], report=report, **settings)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+                    'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__},
+        'settings': settings,
+        'results': results,
+    }
+
+
+def save_results(path, run):
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=1)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+## Stages of run that are slower (or use more memory) than in baseline by more than a factor tolerance
+# differences under min_seconds / min_mb are ignored - they are timer and allocator noise
+def compare(run, baseline, tolerance=1.5, min_seconds=0.05, min_mb=8.0):
+    previous = {(r['spec'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for record in run['results']:
+        old = previous.get((record['spec'], record['stage']))
+        if old is None:
+            continue
+        for key, floor in (('seconds', min_seconds), ('peak_mb', min_mb)):
+            new_value, old_value = record[key], old[key]
+            if new_value is None or old_value is None:
+                continue
+            if new_value > tolerance * old_value and new_value - old_value > floor:
+                regressions.append({'spec': record['spec'], 'stage': record['stage'], 'measure': key,
+                                    'baseline': old_value, 'value': new_value, 'ratio': new_value / old_value})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the design pipeline")
+    parser.add_argument('--specs', nargs='+', choices=list(BENCHMARK_SPECS), help="specs to run (default: all)")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline json to compare with or save to")
+    parser.add_argument('--save', action='store_true', help="save the results as the baseline")
+    parser.add_argument('--output', help="also write the results to this json file")
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc runs")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.specs, memory=not args.no_memory)
+    if args.output:
+        save_results(args.output, results)
+    if args.save:
+        save_results(args.baseline, results)
+        print(f"Saved baseline {args.baseline}")
+    elif os.path.exists(args.baseline):
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['spec']} {r['stage']} {r['measure']}: {r['baseline']:.4g} -> {r['value']:.4g} "
+                  f"({r['ratio']:.2f}x)")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        raise SystemExit(1 if regressions else 0)
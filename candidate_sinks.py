@@ -0,0 +1,298 @@
+## Incremental writers (sinks) for streamed candidate choice sets
+# Each sink consumes ChoiceSetChunks from pair_enumeration.iter_valid_pair_chunks one at a time, so peak memory
+# is bounded by the chunk size rather than by the number of candidate sets.
+# A sink has two methods: write(chunk) and close(), and may have abort(), called instead of close() when the stream
+# fails. write_choice_sets feeds one stream of chunks to several sinks.
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from constraints import GroupOverlap
+
+
+## Wide table - id column then 'alt1.<att>' and 'alt2.<att>' columns, as in the full factorial scripts
+def wide_table(df_design, ids, left, right, id_column='ChoiceSetID'):
+    matrix = df_design.to_numpy(dtype=np.int64)
+    columns = list(df_design.columns)
+    wide = pd.DataFrame(
+        np.hstack([matrix[left], matrix[right]]),
+        columns=[f'alt1.{col}' for col in columns] + [f'alt2.{col}' for col in columns],
+    )
+    wide.insert(0, id_column, ids)
+    return wide
+
+
+## Wide table for a chunk
+def wide_chunk(df_design, chunk, id_column='ChoiceSetID'):
+    ids = np.arange(chunk.start_id, chunk.start_id + len(chunk.left))
+    return wide_table(df_design, ids, chunk.left, chunk.right, id_column)
+
+
+## Long (idefix) table for a chunk - rows alt1, alt2 and an all-zero no choice row per choice set
+def long_chunk(df_design, chunk):
+    matrix = df_design.to_numpy(dtype=np.int64)
+    long = np.zeros((3 * len(chunk.left), matrix.shape[1]), dtype=np.int64)
+    long[0::3] = matrix[chunk.left]
+    long[1::3] = matrix[chunk.right]
+    return pd.DataFrame(long, columns=df_design.columns)
+
+
+## Append chunks to one csv file, writing the header with the first chunk
+# subclasses define write(chunk) and empty_frame(), the (header only) table written for an empty candidate set
+class _CsvSink:
+    def __init__(self, path):
+        self.path = path
+        self.n_written = 0
+
+    def _append(self, frame):
+        frame.to_csv(self.path, mode='w' if self.n_written == 0 else 'a', header=self.n_written == 0, index=False)
+        self.n_written += len(frame)
+
+    def close(self):
+        # make sure the file (with header) exists even for an empty candidate set
+        if self.n_written == 0:
+            self.empty_frame().to_csv(self.path, index=False)
+
+
+## Wide csv of choice sets (one row per choice set)
+class WideCsvSink(_CsvSink):
+    def __init__(self, path, df_design, id_column='ChoiceSetID'):
+        super().__init__(path)
+        self.df_design = df_design
+        self.id_column = id_column
+
+    def write(self, chunk):
+        self._append(wide_chunk(self.df_design, chunk, self.id_column))
+
+    def empty_frame(self):
+        empty = np.empty(0, dtype=np.int64)
+        return wide_table(self.df_design, empty, empty, empty, self.id_column)
+
+
+## Long csv in the idefix format (three rows per choice set: alt1, alt2, no choice)
+class LongCsvSink(_CsvSink):
+    def __init__(self, path, df_design):
+        super().__init__(path)
+        self.df_design = df_design
+
+    def write(self, chunk):
+        self._append(long_chunk(self.df_design, chunk))
+
+    def empty_frame(self):
+        return pd.DataFrame(columns=self.df_design.columns)
+
+
+## Pickle of the wide choice sets as one DataFrame, read back with pd.read_pickle
+# The chunks are spooled to <path>.chunks while streaming, but close() joins them into the one table a pickle has
+# to be built from, so its memory grows with the number of choice sets - for small candidate sets only. Use
+# ParquetSink (or the candidate store) to keep memory bounded throughout.
+class PickleSink:
+    def __init__(self, path, df_design, id_column='ChoiceSetID'):
+        self.path = path
+        self.df_design = df_design
+        self.id_column = id_column
+        self.spool_path = path + '.chunks'
+        self.spool = open(self.spool_path, 'wb')
+
+    def write(self, chunk):
+        pickle.dump(wide_chunk(self.df_design, chunk, self.id_column), self.spool, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        self.spool.close()
+        frames = []
+        with open(self.spool_path, 'rb') as f:
+            while True:
+                try:
+                    frames.append(pickle.load(f))
+                except EOFError:
+                    break
+        os.remove(self.spool_path)
+        if frames:
+            wide = pd.concat(frames, ignore_index=True)
+        else:
+            empty = np.empty(0, dtype=np.int64)
+            wide = wide_table(self.df_design, empty, empty, empty, self.id_column)
+        wide.to_pickle(self.path)
+
+
+## Parquet file of the wide choice sets, one row group per chunk (requires pyarrow)
+class ParquetSink:
+    def __init__(self, path, df_design, id_column='ChoiceSetID'):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("ParquetSink requires pyarrow - install it or use PickleSink instead") from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.df_design = df_design
+        self.id_column = id_column
+        self.writer = None
+
+    def write(self, chunk):
+        table = self._pa.Table.from_pandas(wide_chunk(self.df_design, chunk, self.id_column), preserve_index=False)
+        if self.writer is None:
+            self.writer = self._pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+## Vectorised reservoir sampling (algorithm R) of a stream arriving in chunks
+# For a chunk of n_items items following n_seen earlier ones, returns the reservoir slots to overwrite and the
+# chunk positions of the items that go there: the reservoir is filled first, then item t (0-based position in
+# the stream) replaces a random slot with probability capacity / (t + 1). When several items hit the same slot
+# in one chunk the last one wins, as in the sequential algorithm, so slots are unique.
+def reservoir_slots(rng, n_seen, capacity, n_items):
+    n_fill = max(0, min(capacity - n_seen, n_items))
+    slots = [np.arange(n_seen, n_seen + n_fill)]
+    items = [np.arange(n_fill)]
+    t = n_seen + np.arange(n_fill, n_items)
+    if len(t):
+        slot = (rng.random(len(t)) * (t + 1)).astype(np.int64)
+        replace = np.flatnonzero(slot < capacity)
+        slots.append(slot[replace])
+        items.append(replace + n_fill)
+    slots = np.concatenate(slots)
+    items = np.concatenate(items)
+    _, last = np.unique(slots[::-1], return_index=True)
+    keep = len(slots) - 1 - last
+    return slots[keep], items[keep]
+
+
+## Strata for stratified samples of choice sets - the overlap pattern (one bit per attribute group of the spec's
+# GroupOverlap rule, set when the group is the same in both alternatives; per non-cost attribute without one) and
+# the pair of cost levels of alternative 1 and 2
+# Returns strata(chunk) -> int64 stratum of every choice set in a ChoiceSetChunk over these profiles.
+def overlap_cost_strata(spec, profiles):
+    cost = spec.cost_attribute
+    overlap = next((rule for rule in spec.pair_rules if isinstance(rule, GroupOverlap)), None)
+    groups = list(overlap.groups.values()) if overlap is not None else [[att] for att in spec.attribute_names
+                                                                         if att != cost]
+    group_keys = [np.unique(profiles[:, [spec.column(att) for att in atts]], axis=0, return_inverse=True)[1].ravel()
+                  for atts in groups]
+    cost_codes = profiles[:, spec.column(cost)].astype(np.int64)
+    n_costs = len(spec.attributes[cost])
+
+    def strata(chunk):
+        pattern = np.zeros(len(chunk.left), dtype=np.int64)
+        for g, key in enumerate(group_keys):
+            pattern |= (key[chunk.left] == key[chunk.right]).astype(np.int64) << g
+        return (pattern * n_costs + cost_codes[chunk.left]) * n_costs + cost_codes[chunk.right]
+    return strata
+
+
+## Sample sizes per stratum for a balanced sample of total items from strata of the given sizes
+# every stratum gets the same number where it can (water filling): strata smaller than the common size are taken
+# whole and the rest is shared by the larger ones, the remainder going to the lowest-numbered larger strata
+def balanced_allocation(counts, total):
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() <= total:
+        return counts.copy()
+    low, high = 0, int(counts.max())
+    # largest level with sum(min(counts, level)) <= total
+    while low < high:
+        mid = (low + high + 1) // 2
+        if np.minimum(counts, mid).sum() <= total:
+            low = mid
+        else:
+            high = mid - 1
+    allocation = np.minimum(counts, low)
+    extra = np.flatnonzero(counts > low)[:total - allocation.sum()]
+    allocation[extra] += 1
+    return allocation
+
+
+## Random sample of choice sets for Ngene (which can only load a limited number of rows)
+# Keeps a uniform reservoir sample of at most max_choices sets while the chunks stream past (only set ids and
+# profile positions are held), then writes them as a wide csv ordered by id. If there are fewer than
+# max_choices candidate sets, all of them are written.
+# With strata (e.g. overlap_cost_strata) the sample is stratified instead: every stratum gets the same share
+# (balanced_allocation), sampled uniformly within the stratum, so rare overlap patterns and cost pairs are as well
+# represented as common ones. Each set gets a random key and a stratum keeps the sets with the smallest keys; the
+# common share can only shrink as more sets arrive, so sets beyond it are dropped as the chunks stream past and at
+# most about max_choices sets (plus one chunk) are held at any time.
+class NgeneSampleSink:
+    def __init__(self, path, df_design, max_choices=500000, seed=None, id_column='choice situation', strata=None):
+        self.path = path
+        self.df_design = df_design
+        self.max_choices = max_choices
+        self.id_column = id_column
+        self.strata = strata
+        self.rng = np.random.default_rng(seed)
+        self.n_seen = 0
+        if strata is None:
+            self.ids = np.empty(max_choices, dtype=np.int64)
+            self.left = np.empty(max_choices, dtype=np.int64)
+            self.right = np.empty(max_choices, dtype=np.int64)
+        else:
+            self.ids = self.left = self.right = self.stratum = np.empty(0, dtype=np.int64)
+            self.keys = np.empty(0)
+            self.stratum_counts = np.zeros(0, dtype=np.int64)
+
+    def write(self, chunk):
+        ids = np.arange(chunk.start_id, chunk.start_id + len(chunk.left))
+        self.n_seen += len(ids)
+        if self.strata is not None:
+            self._write_stratified(ids, chunk)
+            return
+        slots, items = reservoir_slots(self.rng, self.n_seen - len(ids), self.max_choices, len(ids))
+        self.ids[slots] = ids[items]
+        self.left[slots] = chunk.left[items]
+        self.right[slots] = chunk.right[items]
+
+    def _write_stratified(self, ids, chunk):
+        stratum = self.strata(chunk)
+        counts = np.bincount(stratum)
+        if len(counts) > len(self.stratum_counts):
+            self.stratum_counts = np.concatenate([self.stratum_counts,
+                                                  np.zeros(len(counts) - len(self.stratum_counts), dtype=np.int64)])
+        self.stratum_counts[:len(counts)] += counts
+        self.ids = np.concatenate([self.ids, ids])
+        self.left = np.concatenate([self.left, chunk.left])
+        self.right = np.concatenate([self.right, chunk.right])
+        self.keys = np.concatenate([self.keys, self.rng.random(len(ids))])
+        self.stratum = np.concatenate([self.stratum, stratum])
+        # no stratum's final share can exceed its share of the sets seen so far
+        self._keep_smallest_keys(balanced_allocation(self.stratum_counts, self.max_choices))
+
+    def _keep_smallest_keys(self, allocation):
+        order = np.lexsort((self.keys, self.stratum))
+        stratum = self.stratum[order]
+        rank = np.arange(len(order)) - np.searchsorted(stratum, stratum)
+        keep = np.sort(order[rank < allocation[stratum]])
+        self.ids, self.left, self.right = self.ids[keep], self.left[keep], self.right[keep]
+        self.keys, self.stratum = self.keys[keep], self.stratum[keep]
+
+    def close(self):
+        n = len(self.ids) if self.strata is not None else min(self.n_seen, self.max_choices)
+        order = np.argsort(self.ids[:n])
+        sample = wide_table(self.df_design, self.ids[:n][order], self.left[:n][order], self.right[:n][order],
+                            self.id_column)
+        sample.to_csv(self.path, index=False)
+        if self.n_seen > self.max_choices:
+            print(f"Choice set size reduced to {self.max_choices} rows.")
+
+
+## Feed a stream of ChoiceSetChunks to every sink, closing them all at the end
+# if the stream or a sink fails, the sinks are aborted (closed if they have no abort()) and the error is re-raised
+# returns the number of choice sets written
+def write_choice_sets(chunks, sinks):
+    n_sets = 0
+    try:
+        for chunk in chunks:
+            for sink in sinks:
+                sink.write(chunk)
+            n_sets += len(chunk.left)
+    except BaseException:
+        for sink in sinks:
+            getattr(sink, 'abort', sink.close)()
+        raise
+    for sink in sinks:
+        sink.close()
+    return n_sets
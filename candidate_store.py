@@ -0,0 +1,135 @@
+## Compact binary store of candidate choice sets
+# A store is a directory with three files:
+#   store.json       - header: attributes and their level values, cost attribute, counts and dtypes
+#   profiles.npy     - (n_profiles, n_attributes) uint8 level codes of every valid profile
+#   choice_sets.npy  - (n_choice_sets, 2) int32 profile ids of alternative 1 and 2, row k is ChoiceSetID k + 1
+# choice_sets.npy is opened memory-mapped, so opening a store takes milliseconds and random access or sampling
+# by ChoiceSetID only reads the rows it touches - nothing is parsed.
+import json
+import os
+
+import numpy as np
+
+from constraints import DesignSpec
+from pair_enumeration import ChoiceSetChunk
+
+HEADER_FILE = 'store.json'
+PROFILES_FILE = 'profiles.npy'
+CHOICE_SETS_FILE = 'choice_sets.npy'
+CHOICE_SET_DTYPE = np.dtype(np.int32)
+
+
+## Write a .npy header for a (n_rows, 2) choice set array
+# numpy pads the header so the first axis can grow without changing its length, which lets the header be
+# written with n_rows = 0 before streaming and rewritten in place once the final count is known
+def _write_choice_set_header(f, n_rows):
+    header = {'descr': np.lib.format.dtype_to_descr(CHOICE_SET_DTYPE), 'fortran_order': False, 'shape': (n_rows, 2)}
+    np.lib.format.write_array_header_1_0(f, header)
+
+
+## Sink (see candidate_sinks.py) writing streamed ChoiceSetChunks to a candidate store
+# store.json is written last, by close(), so only a complete store can be opened: a store left behind by a failed
+# run (abort() or no close()) has no header, and neither has a store being overwritten until it is complete.
+class CandidateStoreWriter:
+    def __init__(self, path, spec, profiles):
+        if profiles.shape[0] > np.iinfo(CHOICE_SET_DTYPE).max:
+            raise ValueError("too many profiles for int32 profile ids")
+        self.path = path
+        self.spec = spec
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, HEADER_FILE)):
+            os.remove(os.path.join(path, HEADER_FILE))
+        np.save(os.path.join(path, PROFILES_FILE), np.ascontiguousarray(profiles, dtype=np.uint8))
+        self.file = open(os.path.join(path, CHOICE_SETS_FILE), 'wb')
+        _write_choice_set_header(self.file, 0)
+        self.header_size = self.file.tell()
+        self.n_profiles = profiles.shape[0]
+        self.n_written = 0
+
+    def write(self, chunk):
+        if chunk.start_id != self.n_written + 1:
+            raise ValueError(f"expected chunk starting at ChoiceSetID {self.n_written + 1}, got {chunk.start_id}")
+        pairs = np.empty((len(chunk.left), 2), dtype=CHOICE_SET_DTYPE)
+        pairs[:, 0] = chunk.left
+        pairs[:, 1] = chunk.right
+        self.file.write(pairs.tobytes())
+        self.n_written += len(pairs)
+
+    def close(self):
+        # rewrite the header with the final number of choice sets
+        self.file.seek(0)
+        _write_choice_set_header(self.file, self.n_written)
+        if self.file.tell() != self.header_size:
+            raise RuntimeError("choice set header changed size - store is corrupt")
+        self.file.close()
+
+        header = {
+            'attributes': self.spec.attributes,
+            'cost_attribute': self.spec.cost_attribute,
+            'n_profiles': self.n_profiles,
+            'n_choice_sets': self.n_written,
+            'profile_dtype': 'uint8',
+            'choice_set_dtype': CHOICE_SET_DTYPE.name,
+        }
+        with open(os.path.join(self.path, HEADER_FILE), 'w') as f:
+            json.dump(header, f, indent=2)
+
+    # the stream failed - close the choice set file without writing the header
+    def abort(self):
+        self.file.close()
+
+
+## Read-only access to a candidate store
+class CandidateStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        self.spec = DesignSpec(self.header['attributes'], cost_attribute=self.header['cost_attribute'])
+        self.profiles = np.load(os.path.join(path, PROFILES_FILE))
+        self.choice_sets = np.load(os.path.join(path, CHOICE_SETS_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return self.choice_sets.shape[0]
+
+    @property
+    def n_choice_sets(self):
+        return self.choice_sets.shape[0]
+
+    # profile ids (rows of self.profiles) of alternative 1 and 2 for the given ChoiceSetIDs (1-based)
+    def profile_ids(self, choice_set_ids):
+        index = np.asarray(choice_set_ids, dtype=np.int64) - 1
+        if index.size and (index.min() < 0 or index.max() >= len(self)):
+            raise IndexError(f"ChoiceSetIDs must be between 1 and {len(self)}")
+        return np.asarray(self.choice_sets[index])
+
+    # level codes, shape (n, 2, n_attributes)
+    def codes(self, choice_set_ids):
+        return self.profiles[self.profile_ids(choice_set_ids)]
+
+    # level values, shape (n, 2, n_attributes)
+    def values(self, choice_set_ids):
+        ids = self.profile_ids(choice_set_ids)
+        return self.spec.decode(self.profiles[ids.ravel()]).reshape(ids.shape + (-1,))
+
+    # profile table with level values (df_design in the full factorial scripts)
+    def profile_table(self):
+        return self.spec.profile_table(self.profiles)
+
+    # uniformly sample n distinct ChoiceSetIDs (sorted), without reading the choice sets
+    def sample_ids(self, n, rng=None):
+        rng = np.random.default_rng(rng)
+        if n > len(self):
+            raise ValueError(f"cannot sample {n} choice sets from a store with {len(self)}")
+        return np.sort(rng.choice(len(self), size=n, replace=False)) + 1
+
+    # ChoiceSetChunk for a set of ChoiceSetIDs - can be passed straight to the sinks in candidate_sinks.py
+    # (ids must be consecutive for the chunk ids to line up, as from iter_chunks)
+    def chunk(self, start_id, n):
+        ids = self.profile_ids(np.arange(start_id, start_id + n))
+        return ChoiceSetChunk(start_id, ids[:, 0].astype(np.int64), ids[:, 1].astype(np.int64))
+
+    # stream the whole store as ChoiceSetChunks, e.g. to rewrite it as csv with the candidate_sinks
+    def iter_chunks(self, chunk_size=100000):
+        for start in range(0, len(self), chunk_size):
+            yield self.chunk(start + 1, min(chunk_size, len(self) - start))
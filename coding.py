@@ -0,0 +1,289 @@
+## Attribute coding - from integer-coded profiles to optimizer-ready design matrices
+# A DesignCoding lists the design columns in order, each built from one attribute of the profile:
+#   Continuous(attribute, name)                 - the attribute's level value
+#   Dummy(attribute, {name: level, ...})        - 1 if the attribute is at that level, else 0
+#   Effects(attribute, {name: level, ...}, reference)
+#                                               - 1 at that level, -1 at the reference level, else 0
+#   ASC(name, alternative)                      - 1 for one alternative (e.g. the no choice alternative), else 0
+# Levels are level values as listed in the DesignSpec. Every profile of a candidate store is coded once into a
+# (n_profiles, K) float table, and the design matrix of any set of choice sets is one gather from it - an
+# (n_sets, n_alts, K) contiguous float64 array (alternatives within choice sets, reshape to (n_sets * n_alts, K)
+# for the long layout), as used by efficiency.py and exchange.py. No per-row Python objects are created.
+import numpy as np
+
+
+class Continuous:
+    def __init__(self, attribute, name):
+        self.attribute = attribute
+        self.names = [name]
+
+    # json-compatible description (see column_from_dict)
+    def to_dict(self):
+        return {'type': 'Continuous', 'attribute': self.attribute, 'name': self.names[0]}
+
+    def code(self, spec, codes):
+        levels = np.asarray(spec.attributes[self.attribute], dtype=np.float64)
+        return levels[codes[..., spec.column(self.attribute)]][..., None]
+
+    # level codes from the coded column, -1 where the value is not a level
+    def decode(self, spec, coded):
+        levels = np.asarray(spec.attributes[self.attribute], dtype=np.float64)
+        code = np.clip(np.searchsorted(levels, coded[..., 0]), 0, len(levels) - 1)
+        return np.where(levels[code] == coded[..., 0], code, -1)
+
+
+class Dummy:
+    def __init__(self, attribute, levels):
+        self.attribute = attribute
+        self.levels = dict(levels)
+        self.names = list(self.levels)
+
+    def to_dict(self):
+        return {'type': 'Dummy', 'attribute': self.attribute, 'levels': self.levels}
+
+    def code(self, spec, codes):
+        column = codes[..., spec.column(self.attribute)]
+        level_codes = np.array([spec.level_code(self.attribute, level) for level in self.levels.values()])
+        return (column[..., None] == level_codes).astype(np.float64)
+
+    # level codes from the dummy columns through a lookup table over the 0/1 patterns
+    def decode(self, spec, coded):
+        level_codes = [spec.level_code(self.attribute, level) for level in self.levels.values()]
+        table = _pattern_table(spec, self.attribute, level_codes, base=2, reference_code=None)
+        return _decode_patterns(table, coded, offset=0, base=2)
+
+
+class Effects:
+    def __init__(self, attribute, levels, reference):
+        self.attribute = attribute
+        self.levels = dict(levels)
+        self.reference = reference
+        self.names = list(self.levels)
+
+    def to_dict(self):
+        return {'type': 'Effects', 'attribute': self.attribute, 'levels': self.levels, 'reference': self.reference}
+
+    def code(self, spec, codes):
+        column = codes[..., spec.column(self.attribute)]
+        level_codes = np.array([spec.level_code(self.attribute, level) for level in self.levels.values()])
+        reference = spec.level_code(self.attribute, self.reference)
+        coded = (column[..., None] == level_codes).astype(np.float64)
+        coded[column == reference] = -1.0
+        return coded
+
+    # level codes from the effects columns through a lookup table over the -1/0/1 patterns
+    def decode(self, spec, coded):
+        level_codes = [spec.level_code(self.attribute, level) for level in self.levels.values()]
+        table = _pattern_table(spec, self.attribute, level_codes, base=3,
+                               reference_code=spec.level_code(self.attribute, self.reference))
+        return _decode_patterns(table, coded, offset=1, base=3)
+
+
+class ASC:
+    def __init__(self, name, alternative):
+        self.alternative = alternative
+        self.names = [name]
+
+    def to_dict(self):
+        return {'type': 'ASC', 'name': self.names[0], 'alternative': self.alternative}
+
+    def code(self, spec, codes):
+        return np.zeros(codes.shape[:-1] + (1,))
+
+
+COLUMN_TYPES = {column.__name__: column for column in (Continuous, Dummy, Effects, ASC)}
+
+
+## Column from its to_dict() description, e.g. {'type': 'Continuous', 'attribute': 'C', 'name': 'cost'}
+def column_from_dict(data):
+    data = dict(data)
+    column_type = data.pop('type')
+    if column_type not in COLUMN_TYPES:
+        raise ValueError(f"unknown column type {column_type!r} - use one of {list(COLUMN_TYPES)}")
+    return COLUMN_TYPES[column_type](**data)
+
+
+## Lookup table from a dummy / effects pattern (digits 0/1, or -1/0/1 shifted to 0/1/2) to a level code
+# pattern key = sum(digit_k * base^k); unknown patterns map to -1. The all-zero pattern is the one level that has
+# no column (the dummy reference, or a level left out of effects coding), if there is exactly one such level;
+# with effects coding the all -1 pattern is the reference level.
+def _pattern_table(spec, attribute, level_codes, base, reference_code):
+    m = len(level_codes)
+    offset = 1 if base == 3 else 0
+    table = np.full(base ** m, -1, dtype=np.int64)
+    unlisted = [code for code in range(len(spec.attributes[attribute]))
+                if code not in level_codes and code != reference_code]
+    if len(unlisted) == 1:
+        table[sum(offset * base ** k for k in range(m))] = unlisted[0]
+    for k, code in enumerate(level_codes):
+        table[sum((offset + (i == k)) * base ** i for i in range(m))] = code
+    if reference_code is not None:
+        table[0] = reference_code
+    return table
+
+
+def _decode_patterns(table, coded, offset, base):
+    digits = np.rint(coded).astype(np.int64) + offset
+    valid = ((digits >= 0) & (digits < base)).all(axis=-1)
+    key = (np.clip(digits, 0, base - 1) * base ** np.arange(coded.shape[-1])).sum(axis=-1)
+    return np.where(valid, table[key], -1)
+
+
+# one hashable (void) key per row of a float table, with -0.0 and 0.0 alike
+def _row_keys(rows):
+    rows = np.ascontiguousarray(np.asarray(rows, dtype=np.float64) + 0.0)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1])))[:, 0]
+
+
+## Design coding for choice sets of n_alts alternatives; with no_choice the last alternative is the no choice
+# option (all columns zero apart from its ASC) and choice sets hold n_alts - 1 profiles
+class DesignCoding:
+    def __init__(self, columns, n_alts=3, no_choice=True):
+        self.columns = list(columns)
+        self.n_alts = n_alts
+        self.no_choice = no_choice
+
+    @property
+    def names(self):
+        return [name for column in self.columns for name in column.names]
+
+    ## json-compatible description of the coding, e.g. for a design-spec file (see pipeline.py)
+    def to_dict(self):
+        return {'columns': [column.to_dict() for column in self.columns], 'n_alts': self.n_alts,
+                'no_choice': self.no_choice}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([column_from_dict(column) for column in data['columns']], data.get('n_alts', 3),
+                   data.get('no_choice', True))
+
+    @property
+    def n_profile_alts(self):
+        return self.n_alts - 1 if self.no_choice else self.n_alts
+
+    ## Coded profiles - level codes (..., n_attributes) -> (..., K) float64, ASC columns left at zero
+    def code_profiles(self, spec, codes):
+        codes = np.asarray(codes)
+        return np.concatenate([column.code(spec, codes) for column in self.columns], axis=-1)
+
+    ## Design matrices (n_sets, n_alts, K) from a table of coded profiles and (n_sets, n_profile_alts) profile ids
+    def stack(self, coded_profiles, profile_ids):
+        profile_ids = np.asarray(profile_ids)
+        design = np.zeros((profile_ids.shape[0], self.n_alts, coded_profiles.shape[1]))
+        design[:, :self.n_profile_alts] = coded_profiles[profile_ids]
+        k = 0
+        for column in self.columns:
+            if isinstance(column, ASC):
+                design[:, column.alternative, k] = 1.0
+            k += len(column.names)
+        return design
+
+    ## Design matrices (n_sets, n_alts, K) for choice sets of level codes (n_sets, n_profile_alts, n_attributes)
+    def design(self, spec, codes):
+        codes = np.asarray(codes)
+        n_sets = codes.shape[0]
+        coded = self.code_profiles(spec, codes.reshape(-1, codes.shape[-1]))
+        return self.stack(coded, np.arange(n_sets * self.n_profile_alts).reshape(n_sets, self.n_profile_alts))
+
+    ## Level codes (..., n_attributes) of coded profiles (..., K) - the inverse of code_profiles
+    # Rows that are not the coding of a valid profile raise ValueError. See profile_decoder, and use it directly to
+    # decode many chunks with one decoder.
+    def decode_profiles(self, spec, coded, profiles=None):
+        return self.profile_decoder(spec, profiles)(coded)
+
+    ## Function from coded profiles (..., K) to level codes (..., n_attributes)
+    # Attributes whose own columns tell every level apart (a continuous column, complete dummy / effects columns) are
+    # decoded column by column through lookup tables. The others - e.g. a dummy column dropped by full_rank, which
+    # leaves two levels on the all-zero pattern - are decoded jointly, by matching the whole coded row against the
+    # coded valid profiles (profiles, spec.valid_profiles() by default): the profile rules tell such levels apart,
+    # as an all-or-none rule does for the 'absent' level.
+    def profile_decoder(self, spec, profiles=None):
+        n_attributes = len(spec.attributes)
+        decoded_alone = np.zeros(n_attributes, dtype=bool)
+        k = 0
+        column_slices = []
+        for column in self.columns:
+            width = len(column.names)
+            if not isinstance(column, ASC):
+                a = spec.column(column.attribute)
+                column_slices.append((column, a, slice(k, k + width)))
+                levels = np.zeros((len(spec.attributes[column.attribute]), n_attributes), dtype=np.int64)
+                levels[:, a] = np.arange(len(levels))
+                decoded_alone[a] = (column.decode(spec, column.code(spec, levels)) == levels[:, a]).all()
+            k += width
+        profile_columns = [k for k, name in enumerate(self.names)
+                           if not any(isinstance(column, ASC) and name in column.names for column in self.columns)]
+
+        lookup = None
+        if not decoded_alone.all():
+            profiles = spec.valid_profiles() if profiles is None else np.asarray(profiles)
+            keys, first, counts = np.unique(_row_keys(self.code_profiles(spec, profiles)[:, profile_columns]),
+                                            return_index=True, return_counts=True)
+            # a coded row shared by several valid profiles cannot be decoded
+            lookup = (keys, np.where(counts == 1, first, -1), profiles)
+
+        def decode(coded):
+            coded = np.asarray(coded, dtype=np.float64)
+            codes = np.full(coded.shape[:-1] + (n_attributes,), -1, dtype=np.int64)
+            for column, a, columns in column_slices:
+                if decoded_alone[a]:
+                    codes[..., a] = column.decode(spec, coded[..., columns])
+            if lookup is not None:
+                keys, rows, table = lookup
+                wanted = _row_keys(coded.reshape(-1, coded.shape[-1])[:, profile_columns])
+                position = np.clip(np.searchsorted(keys, wanted), 0, len(keys) - 1)
+                row = np.where(keys[position] == wanted, rows[position], -1)
+                joint = np.where(row[:, None] >= 0, table[row], -1).reshape(codes.shape)
+                codes[..., ~decoded_alone] = joint[..., ~decoded_alone]
+            if (codes < 0).any():
+                raise ValueError("rows that are not a valid coding of a profile (or attributes without a column)")
+            return codes.astype(np.uint8)
+        return decode
+
+    ## Design matrices for ChoiceSetIDs of a candidate store (or pair_sampler.PairSampler) in one gather;
+    # pass coded_profiles = code_profiles(store.spec, store.profiles) to reuse the profile table across calls
+    def store_design(self, store, choice_set_ids, coded_profiles=None):
+        if coded_profiles is None:
+            coded_profiles = self.code_profiles(store.spec, store.profiles)
+        return self.stack(coded_profiles, store.profile_ids(choice_set_ids))
+
+    ## The same coding without the columns that are linear combinations of earlier ones for these profiles
+    # A design only identifies the parameters whose columns are linearly independent over the possible rows
+    # (profiles, and the no choice row), e.g. with all-or-none rules two complete sets of dummies for one group
+    # of attributes always sum to the same thing and the information matrix is singular whatever the design.
+    def full_rank(self, spec, profiles):
+        rows = self.design(spec, np.asarray(profiles)[:, None, :].repeat(self.n_profile_alts, axis=1))
+        # utilities are only identified relative to another alternative - the no choice row when there is one
+        reference = rows[0, -1] if self.no_choice else rows[0, 0]
+        rows = rows.reshape(-1, rows.shape[-1]) - reference
+        keep = []
+        kept_columns = []
+        k = 0
+        for column in self.columns:
+            names = []
+            for name in column.names:
+                if np.linalg.matrix_rank(rows[:, keep + [k]]) > len(keep):
+                    keep.append(k)
+                    names.append(name)
+                k += 1
+            if names:
+                kept_columns.append(_subset(column, names))
+        return DesignCoding(kept_columns, self.n_alts, self.no_choice)
+
+    ## Raise ValueError if some columns are linear combinations of others for these profiles (see full_rank) - the
+    # information matrix of every design in such a coding is singular, whatever the priors
+    def check_full_rank(self, spec, profiles):
+        kept = self.full_rank(spec, profiles).names
+        dependent = [name for name in self.names if name not in kept]
+        if dependent:
+            raise ValueError(f"design columns {dependent} are linear combinations of the other columns for these "
+                             f"profiles, so every information matrix is singular - use full_rank(spec, profiles)")
+
+
+# a column with only some of its names (dummy / effects levels)
+def _subset(column, names):
+    if len(names) == len(column.names):
+        return column
+    if isinstance(column, Effects):
+        return Effects(column.attribute, {name: column.levels[name] for name in names}, column.reference)
+    return Dummy(column.attribute, {name: column.levels[name] for name in names})
@@ -0,0 +1,370 @@
+## Declarative constraints for profiles (single alternatives) and choice sets (pairs of alternatives)
+# Rules are plain Python objects describing the constraint. A DesignSpec compiles them once against its
+# attribute levels into vectorised boolean masks over integer-coded profiles (level indices), so adding
+# a rule never drops enumeration back to per-row Python calls.
+#
+# Profile rules: AllOrNone, Requires
+# Pair rules:    GroupEqual, GroupOverlap, Dominance
+import itertools
+
+import numpy as np
+import pandas as pd
+
+
+## Profile rule - if any of the attributes is at its listed level then all of them must be
+# e.g. soil moisture attributes are all 'absent' when any one of them is absent
+class AllOrNone:
+    def __init__(self, levels):
+        self.levels = dict(levels)
+
+    # short name for counters and reports
+    @property
+    def label(self):
+        return f"AllOrNone({','.join(self.levels)})"
+
+    # json-compatible description (see rule_from_dict)
+    def to_dict(self):
+        return {'type': 'AllOrNone', 'levels': self.levels}
+
+    def compile(self, spec):
+        cols = [spec.column(att) for att in self.levels]
+        codes = [spec.level_code(att, level) for att, level in self.levels.items()]
+
+        def mask(profiles):
+            at_level = profiles[:, cols] == np.asarray(codes, dtype=profiles.dtype)
+            return at_level.all(axis=1) | ~at_level.any(axis=1)
+        return mask
+
+
+## Profile rule - conditional level restriction
+# a profile matching every level in when_levels must have at least one attribute at its level in any_of
+# e.g. the highest cost level needs at least one information attribute at its highest level
+class Requires:
+    def __init__(self, when_levels, any_of):
+        self.when_levels = dict(when_levels)
+        self.any_of = dict(any_of)
+
+    @property
+    def label(self):
+        return f"Requires({','.join(self.when_levels)})"
+
+    def to_dict(self):
+        return {'type': 'Requires', 'when_levels': self.when_levels, 'any_of': self.any_of}
+
+    def compile(self, spec):
+        when_cols = [spec.column(att) for att in self.when_levels]
+        when_codes = [spec.level_code(att, level) for att, level in self.when_levels.items()]
+        any_cols = [spec.column(att) for att in self.any_of]
+        any_codes = [spec.level_code(att, level) for att, level in self.any_of.items()]
+
+        def mask(profiles):
+            triggered = (profiles[:, when_cols] == np.asarray(when_codes, dtype=profiles.dtype)).all(axis=1)
+            satisfied = (profiles[:, any_cols] == np.asarray(any_codes, dtype=profiles.dtype)).any(axis=1)
+            return ~triggered | satisfied
+        return mask
+
+
+## Pair rules
+# A compiled pair rule has two parts:
+#   features(profiles) -> (n_profiles, n_features) integer array computed once per profile table
+#   mask(left, right)  -> boolean mask for feature arrays that broadcast against each other,
+#                         either (block, 1, f) x (1, n, f) for a block of pairs or (m, f) x (m, f) for gathered pairs
+# and optionally an index that lists the pairs meeting the rule without testing every pair:
+#   join(features)     -> function pairs(row_start, row_stop) returning the (left, right) pairs i < j with
+#                         i in [row_start, row_stop) that satisfy the rule, in (i, j) order
+class CompiledPairRule:
+    def __init__(self, features, mask, join=None):
+        self.features = features
+        self.mask = mask
+        self.join = join
+
+
+## Encode a group of attribute columns as one integer key per profile (mixed radix over the level counts)
+def _group_key(profiles, cols, radices):
+    key = np.zeros(profiles.shape[0], dtype=np.int64)
+    for col, radix in zip(cols, radices):
+        key = key * radix + profiles[:, col]
+    return key
+
+
+## Pair rule - every attribute in the group is identical between the two alternatives (or differs, if equal=False)
+class GroupEqual:
+    def __init__(self, attributes, equal=True):
+        self.attributes = list(attributes)
+        self.equal = equal
+
+    @property
+    def label(self):
+        return f"GroupEqual({','.join(self.attributes)})"
+
+    def to_dict(self):
+        return {'type': 'GroupEqual', 'attributes': self.attributes, 'equal': self.equal}
+
+    def compile(self, spec):
+        cols = [spec.column(att) for att in self.attributes]
+        radices = [len(spec.attributes[att]) for att in self.attributes]
+
+        def features(profiles):
+            return _group_key(profiles, cols, radices)[:, None]
+
+        def mask(left, right):
+            return (left[..., 0] == right[..., 0]) == self.equal
+        return CompiledPairRule(features, mask)
+
+
+## Pair rule - exactly n_equal of the attribute groups are identical between the two alternatives
+class GroupOverlap:
+    def __init__(self, groups, n_equal):
+        self.groups = {name: list(atts) for name, atts in groups.items()}
+        self.n_equal = n_equal
+
+    @property
+    def label(self):
+        return f"GroupOverlap({self.n_equal})"
+
+    def to_dict(self):
+        return {'type': 'GroupOverlap', 'groups': self.groups, 'n_equal': self.n_equal}
+
+    def compile(self, spec):
+        group_cols = [[spec.column(att) for att in atts] for atts in self.groups.values()]
+        group_radices = [[len(spec.attributes[att]) for att in atts] for atts in self.groups.values()]
+
+        def features(profiles):
+            return np.stack([_group_key(profiles, cols, radices)
+                             for cols, radices in zip(group_cols, group_radices)], axis=1)
+
+        def mask(left, right):
+            n_same = np.zeros(np.broadcast_shapes(left.shape, right.shape)[:-1], dtype=np.uint8)
+            for g in range(left.shape[-1]):
+                n_same += left[..., g] == right[..., g]
+            return n_same == self.n_equal
+
+        # overlap index: for every combination of n_equal groups, bucket the profiles by their combined key for
+        # those groups. Pairs within a bucket share (at least) those groups, so the valid pairs are the bucket
+        # pairs that differ in every other group, and each valid pair is in exactly one combination's bucket.
+        # Work scales with the pairs sharing n_equal groups rather than with all n^2 pairs.
+        def join(features):
+            n = features.shape[0]
+            n_groups = features.shape[1]
+            group_keys = [np.ascontiguousarray(features[:, g]) for g in range(n_groups)]
+            tables = []
+            for combination in itertools.combinations(range(n_groups), self.n_equal):
+                _, key = np.unique(features[:, list(combination)], axis=0, return_inverse=True)
+                key = key.ravel()
+                # stable sort keeps profiles in row order within a bucket, so the partners j > i of profile i
+                # are the rest of its bucket after its own position
+                order = np.argsort(key, kind='stable')
+                position = np.empty(n, dtype=np.int64)
+                position[order] = np.arange(n)
+                bucket_end = np.searchsorted(key[order], key, side='right')
+                others = [g for g in range(n_groups) if g not in combination]
+                tables.append((order, position, bucket_end, others))
+
+            def pairs(row_start, row_stop):
+                rows = np.arange(row_start, row_stop)
+                keys = []
+                for order, position, bucket_end, others in tables:
+                    begin = position[rows] + 1
+                    counts = bucket_end[rows] - begin
+                    left = np.repeat(rows, counts)
+                    # positions begin[i] .. bucket_end[i] - 1 for every row, concatenated
+                    starts = np.cumsum(counts) - counts
+                    right = order[np.repeat(begin - starts, counts) + np.arange(counts.sum())]
+                    keep = np.ones(len(left), dtype=bool)
+                    for g in others:
+                        keep &= group_keys[g][left] != group_keys[g][right]
+                    keys.append(left[keep] * n + right[keep])
+                # each combination's pairs are already in (i, j) order - sort the merged pair keys once
+                key = np.sort(np.concatenate(keys))
+                return key // n, key % n
+            return pairs
+        return CompiledPairRule(features, mask, join)
+
+
+## Pair rule - dominance
+# if every non-cost attribute of one alternative is >= the other, its cost must be strictly higher (and vice versa)
+# levels are coded in ascending order so comparing level codes is the same as comparing level values
+class Dominance:
+    def __init__(self, cost_attribute):
+        self.cost_attribute = cost_attribute
+
+    @property
+    def label(self):
+        return f"Dominance({self.cost_attribute})"
+
+    def to_dict(self):
+        return {'type': 'Dominance', 'cost_attribute': self.cost_attribute}
+
+    def compile(self, spec):
+        cost_col = spec.column(self.cost_attribute)
+        info_cols = [c for c in range(len(spec.attributes)) if c != cost_col]
+
+        def features(profiles):
+            return np.ascontiguousarray(profiles[:, info_cols + [cost_col]])
+
+        def mask(left, right):
+            info_ge = (left[..., :-1] >= right[..., :-1]).all(axis=-1)
+            info_le = (left[..., :-1] <= right[..., :-1]).all(axis=-1)
+            cost_left = left[..., -1]
+            cost_right = right[..., -1]
+            return ~(info_ge & ~(cost_left > cost_right)) & ~(info_le & ~(cost_left < cost_right))
+        return CompiledPairRule(features, mask)
+
+
+RULE_TYPES = {rule.__name__: rule for rule in (AllOrNone, Requires, GroupEqual, GroupOverlap, Dominance)}
+
+
+## Rule from its to_dict() description, e.g. {'type': 'Dominance', 'cost_attribute': 'C'}
+def rule_from_dict(data):
+    data = dict(data)
+    rule_type = data.pop('type')
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"unknown rule type {rule_type!r} - use one of {list(RULE_TYPES)}")
+    return RULE_TYPES[rule_type](**data)
+
+
+## Rules compiled against a DesignSpec
+# base_rules are the pair rules without the cost attribute compiled against the non-cost attributes, set when
+# cost only enters the pair rules through Dominance - pair_enumeration then enumerates pairs of non-cost profiles
+# and expands them by cost level instead of checking every pair of full profiles
+# profile_labels / pair_labels name the rules in telemetry counters (see telemetry.py)
+class CompiledRules:
+    def __init__(self, profile_masks, pair_rules, base_rules=None, profile_labels=None, pair_labels=None):
+        self.profile_masks = profile_masks
+        self.pair_rules = pair_rules
+        self.base_rules = base_rules
+        self.profile_labels = profile_labels or [f'profile_rule_{k}' for k in range(len(profile_masks))]
+        self.pair_labels = pair_labels or [f'pair_rule_{k}' for k in range(len(pair_rules))]
+
+    # boolean mask of profiles (rows of level codes) that satisfy every profile rule
+    # with telemetry, counts the profiles checked, valid and rejected by each rule (the first rule, in order,
+    # that a profile fails)
+    def profile_mask(self, profiles, telemetry=None):
+        mask = np.ones(profiles.shape[0], dtype=bool)
+        for label, rule_mask in zip(self.profile_labels, self.profile_masks):
+            if telemetry is None:
+                mask &= rule_mask(profiles)
+                continue
+            keep = rule_mask(profiles)
+            telemetry.count(f'profiles.rejected.{label}', np.count_nonzero(mask & ~keep))
+            mask &= keep
+        if telemetry is not None:
+            telemetry.count('profiles.checked', len(mask))
+            telemetry.count('profiles.valid', np.count_nonzero(mask))
+        return mask
+
+    # per-profile feature arrays for each pair rule
+    def pair_features(self, profiles):
+        return [rule.features(profiles) for rule in self.pair_rules]
+
+    # boolean mask of pairs that satisfy every pair rule, given the features of the left and right profiles
+    def pair_mask(self, left_features, right_features):
+        mask = None
+        for rule, left, right in zip(self.pair_rules, left_features, right_features):
+            rule_mask = rule.mask(left, right)
+            mask = rule_mask if mask is None else mask & rule_mask
+        return mask
+
+
+## A design specification - attributes with their (ascending) levels plus profile and pair rules
+class DesignSpec:
+    def __init__(self, attributes, profile_rules=(), pair_rules=(), cost_attribute='C'):
+        self.attributes = {att: list(levels) for att, levels in attributes.items()}
+        self.profile_rules = list(profile_rules)
+        self.pair_rules = list(pair_rules)
+        self.cost_attribute = cost_attribute
+
+        for att, levels in self.attributes.items():
+            if any(a >= b for a, b in zip(levels, levels[1:])):
+                raise ValueError(f"levels of attribute '{att}' must be strictly ascending: {levels}")
+            if len(levels) > 255:
+                raise ValueError(f"attribute '{att}' has too many levels to code as uint8")
+
+    ## json-compatible description of the spec, e.g. for a design-spec file (see pipeline.py)
+    def to_dict(self):
+        return {
+            'attributes': self.attributes,
+            'profile_rules': [rule.to_dict() for rule in self.profile_rules],
+            'pair_rules': [rule.to_dict() for rule in self.pair_rules],
+            'cost_attribute': self.cost_attribute,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['attributes'], [rule_from_dict(rule) for rule in data.get('profile_rules', [])],
+                   [rule_from_dict(rule) for rule in data.get('pair_rules', [])], data.get('cost_attribute', 'C'))
+
+    @property
+    def attribute_names(self):
+        return list(self.attributes)
+
+    def column(self, attribute):
+        return self.attribute_names.index(attribute)
+
+    def level_code(self, attribute, level):
+        return self.attributes[attribute].index(level)
+
+    # all combinations of level codes, in the same order as itertools.product(*attributes.values())
+    def full_factorial(self):
+        shape = [len(levels) for levels in self.attributes.values()]
+        return np.indices(shape, dtype=np.uint8).reshape(len(shape), -1).T.copy()
+
+    # convert a matrix of level codes to a matrix of level values
+    def decode(self, profiles):
+        values = np.empty(profiles.shape, dtype=np.int64)
+        for c, levels in enumerate(self.attributes.values()):
+            values[:, c] = np.asarray(levels, dtype=np.int64)[profiles[:, c]]
+        return values
+
+    # convert a matrix of level values to a matrix of level codes (ValueError for values that are not levels)
+    def encode(self, values):
+        values = np.asarray(values)
+        codes = np.empty(values.shape, dtype=np.uint8)
+        for c, (att, levels) in enumerate(self.attributes.items()):
+            levels = np.asarray(levels)
+            code = np.clip(np.searchsorted(levels, values[:, c]), 0, len(levels) - 1)
+            bad = levels[code] != values[:, c]
+            if bad.any():
+                raise ValueError(f"attribute '{att}' has values that are not levels: {np.unique(values[:, c][bad])}")
+            codes[:, c] = code
+        return codes
+
+    # profile table with level values, as used by the full factorial scripts (df_design)
+    def profile_table(self, profiles):
+        return pd.DataFrame(self.decode(profiles), columns=self.attribute_names)
+
+    def compile(self):
+        return CompiledRules(
+            [rule.compile(self) for rule in self.profile_rules],
+            [rule.compile(self) for rule in self.pair_rules],
+            self._compile_base_rules(),
+            [rule.label for rule in self.profile_rules],
+            [rule.label for rule in self.pair_rules],
+        )
+
+    # non-cost pair rules compiled against the attributes without cost (CompiledRules.base_rules), or None unless
+    # the cost attribute is the last attribute (so profiles are ordered by their non-cost part, then cost) and the
+    # pair rules only use it through Dominance
+    def _compile_base_rules(self):
+        cost = self.cost_attribute
+        if not self.attributes or self.attribute_names[-1] != cost:
+            return None
+        dominance = [rule for rule in self.pair_rules if isinstance(rule, Dominance)]
+        others = [rule for rule in self.pair_rules if not isinstance(rule, Dominance)]
+        if not dominance or any(rule.cost_attribute != cost for rule in dominance):
+            return None
+        for rule in others:
+            if isinstance(rule, GroupEqual) and cost not in rule.attributes:
+                continue
+            if isinstance(rule, GroupOverlap) and all(cost not in atts for atts in rule.groups.values()):
+                continue
+            return None
+        base = DesignSpec({att: levels for att, levels in self.attributes.items() if att != cost},
+                          pair_rules=others, cost_attribute=None)
+        return CompiledRules([], [rule.compile(base) for rule in others], pair_labels=[rule.label for rule in others])
+
+    # level codes of every profile that meets the profile rules
+    def valid_profiles(self, compiled=None, telemetry=None):
+        compiled = compiled or self.compile()
+        profiles = self.full_factorial()
+        return profiles[compiled.profile_mask(profiles, telemetry)]
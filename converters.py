@@ -0,0 +1,205 @@
+## Conversions between the design and candidate file formats, streamed in chunks
+# Formats:
+#   'wide'  - one row per choice set: id column, then 'alt1.<att>', 'alt2.<att>' level values
+#             (the candidate csv / pickle of the full factorial scripts)
+#   'long'  - idefix layout with attribute level values: rows alt1, alt2 and an all-zero no choice row per set
+#             (LongCsvSink, the candidates read by modfederov.R)
+#   'coded' - long design matrix coded with a DesignCoding (latest_design.csv from modfederov.R / modfed.py)
+#   'ngene' - 'choice situation' then 'alt1.<name>', 'alt2.<name>' with the coded attributes as level values and
+#             no no choice option (Ngene adds it); names are the coding's names for continuous attributes and the
+#             lower-case attribute name otherwise, e.g. 'alt1.wa', 'alt1.sm_f'
+# Every reader yields DesignChunks of level codes, so any format converts to any other. Files are read with
+# pandas in chunks of whole choice sets and written by appending, so memory is bounded by chunk_sets whatever
+# the file size, and dummy / effects columns are decoded through a lookup table (coding.py), not per row.
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from candidate_sinks import reservoir_slots
+from coding import Continuous
+from modfed import MODFEDEROV_CODING
+
+FORMATS = ('wide', 'long', 'coded', 'ngene')
+
+DEFAULT_ID_COLUMNS = {'wide': 'ChoiceSetID', 'ngene': 'choice situation'}
+
+# ids: (n,) choice set ids, codes: (n, 2, n_attributes) level codes of alternative 1 and 2
+DesignChunk = namedtuple('DesignChunk', ['ids', 'codes'])
+
+N_PROFILE_ALTS = 2
+
+
+## Ngene column name of every attribute
+def ngene_names(spec, coding=None):
+    continuous = {column.attribute: column.names[0] for column in (coding or MODFEDEROV_CODING).columns
+                  if isinstance(column, Continuous)}
+    return [continuous.get(att, att.lower()) for att in spec.attribute_names]
+
+
+def _wide_columns(names):
+    return [f'alt{a + 1}.{name}' for a in range(N_PROFILE_ALTS) for name in names]
+
+
+## Stream a design file as DesignChunks of at most chunk_sets choice sets
+# the long and coded formats have no ids - sets are numbered from 1 in file order
+def read_design(path, spec, fmt, coding=None, id_column=None, chunk_sets=100000):
+    coding = coding or MODFEDEROV_CODING
+    id_column = id_column or DEFAULT_ID_COLUMNS.get(fmt)
+    if fmt in ('wide', 'ngene'):
+        names = spec.attribute_names if fmt == 'wide' else ngene_names(spec, coding)
+        columns = _wide_columns(names)
+        for frame in pd.read_csv(path, usecols=[id_column] + columns, chunksize=chunk_sets):
+            values = frame[columns].to_numpy().reshape(len(frame) * N_PROFILE_ALTS, -1)
+            codes = spec.encode(values).reshape(len(frame), N_PROFILE_ALTS, -1)
+            yield DesignChunk(frame[id_column].to_numpy(dtype=np.int64), codes)
+    elif fmt in ('long', 'coded'):
+        columns = spec.attribute_names if fmt == 'long' else coding.names
+        n_rows = coding.n_alts
+        decode = coding.profile_decoder(spec) if fmt == 'coded' else None
+        next_id = 1
+        for frame in pd.read_csv(path, usecols=columns, chunksize=chunk_sets * n_rows):
+            if len(frame) % n_rows:
+                raise ValueError(f"{path} has a choice set with fewer than {n_rows} rows")
+            rows = frame[columns].to_numpy().reshape(len(frame) // n_rows, n_rows, -1)[:, :N_PROFILE_ALTS]
+            if fmt == 'long':
+                codes = spec.encode(rows.reshape(-1, rows.shape[-1])).reshape(rows.shape)
+            else:
+                codes = decode(rows)
+            yield DesignChunk(np.arange(next_id, next_id + len(codes)), codes)
+            next_id += len(codes)
+    else:
+        raise ValueError(f"unknown format {fmt!r} - use one of {FORMATS}")
+
+
+## Table of a DesignChunk in the given format
+def design_table(chunk, spec, fmt, coding=None, id_column=None):
+    coding = coding or MODFEDEROV_CODING
+    id_column = id_column or DEFAULT_ID_COLUMNS.get(fmt)
+    n = len(chunk.ids)
+    n_attributes = len(spec.attributes)
+    if fmt in ('wide', 'ngene'):
+        names = spec.attribute_names if fmt == 'wide' else ngene_names(spec, coding)
+        values = spec.decode(chunk.codes.reshape(n * N_PROFILE_ALTS, n_attributes)).reshape(n, N_PROFILE_ALTS * n_attributes)
+        table = pd.DataFrame(values, columns=_wide_columns(names))
+        table.insert(0, id_column, chunk.ids)
+        return table
+    if fmt == 'long':
+        values = spec.decode(chunk.codes.reshape(n * N_PROFILE_ALTS, n_attributes))
+        long = np.zeros((n, coding.n_alts, n_attributes), dtype=np.int64)
+        long[:, :N_PROFILE_ALTS] = values.reshape(n, N_PROFILE_ALTS, n_attributes)
+        return pd.DataFrame(long.reshape(n * coding.n_alts, n_attributes), columns=spec.attribute_names)
+    if fmt == 'coded':
+        design = coding.design(spec, chunk.codes)
+        return pd.DataFrame(design.reshape(n * coding.n_alts, len(coding.names)), columns=coding.names)
+    raise ValueError(f"unknown format {fmt!r} - use one of {FORMATS}")
+
+
+## Text of one csv row fragment per distinct profile, built once and reused for every choice set it appears in
+# Writing millions of rows through DataFrame.to_csv formats every number again; here each distinct
+# (alternative, profile) row is formatted once (looked up by a mixed radix key of its level codes) and a chunk is
+# written by joining the cached fragments.
+class _CsvWriter:
+    def __init__(self, path, spec, fmt, coding, id_column):
+        self.spec = spec
+        self.fmt = fmt
+        self.coding = coding
+        self.id_column = id_column
+        self.radix = np.cumprod([1] + [len(levels) for levels in spec.attributes.values()][:0:-1])[::-1]
+        self.fragments = [{} for _ in range(N_PROFILE_ALTS)]
+        header = design_table(_empty_chunk(spec), spec, fmt, coding, id_column).columns
+        self.file = open(path, 'w', newline='')
+        self.file.write(','.join(_quote(name) for name in header) + '\n')
+        if fmt == 'long':
+            self.no_choice = _format_row(np.zeros(len(spec.attributes)))
+        elif fmt == 'coded':
+            self.no_choice = _format_row(coding.design(spec, _empty_chunk(spec, 1).codes)[0, -1])
+
+    # the csv text of alternative a for each profile of codes (n, n_attributes)
+    def _alternative_text(self, a, codes):
+        keys = codes.astype(np.int64) @ self.radix
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        cache = self.fragments[a]
+        missing = [k for k, key in enumerate(unique) if key not in cache]
+        if missing:
+            rows = codes[first[missing]]
+            if self.fmt == 'coded':
+                placed = np.repeat(rows[:, None, :], N_PROFILE_ALTS, axis=1)
+                values = self.coding.design(self.spec, placed)[:, a]
+            else:
+                values = self.spec.decode(rows)
+            for k, row in zip(missing, values):
+                cache[unique[k]] = _format_row(row)
+        return np.array([cache[key] for key in unique], dtype=object)[inverse.ravel()]
+
+    def write(self, chunk):
+        alternatives = [self._alternative_text(a, chunk.codes[:, a]) for a in range(N_PROFILE_ALTS)]
+        if self.fmt in ('wide', 'ngene'):
+            lines = [f'{i},{first},{second}\n' for i, first, second in zip(chunk.ids.tolist(), *alternatives)]
+        else:
+            lines = [f'{first}\n{second}\n{self.no_choice}\n' for first, second in zip(*alternatives)]
+        self.file.write(''.join(lines))
+
+    def close(self):
+        self.file.close()
+
+
+# column names are quoted as pandas does, only when they contain a delimiter, quote or line break
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"' if any(c in name for c in ',"\r\n') else name
+
+
+# a chunk of n choice sets of all-zero level codes
+def _empty_chunk(spec, n=0):
+    return DesignChunk(np.arange(1, n + 1), np.zeros((n, N_PROFILE_ALTS, len(spec.attributes)), dtype=np.uint8))
+
+
+# numbers as pandas writes them: integers without a decimal point, other floats in their shortest repr
+def _format_row(values):
+    return ','.join(str(int(v)) if float(v).is_integer() else repr(float(v)) for v in values)
+
+
+## Convert a design file between formats, chunk by chunk; returns the number of choice sets written
+# With max_sets a uniform sample of at most max_sets choice sets is kept while streaming (reservoir sampling)
+# and written in id order - e.g. the 500,000 set subsample Ngene can load from the multi-million set candidate file.
+def convert(source, target, spec, source_format, target_format, coding=None, source_id_column=None,
+            target_id_column=None, chunk_sets=100000, max_sets=None, seed=None):
+    coding = coding or MODFEDEROV_CODING
+    target_id_column = target_id_column or DEFAULT_ID_COLUMNS.get(target_format)
+    if target_format not in FORMATS:
+        raise ValueError(f"unknown format {target_format!r} - use one of {FORMATS}")
+    chunks = read_design(source, spec, source_format, coding, source_id_column, chunk_sets)
+    if max_sets is not None:
+        chunks = _sample_chunks(chunks, max_sets, seed, chunk_sets)
+
+    n_written = 0
+    writer = _CsvWriter(target, spec, target_format, coding, target_id_column)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            n_written += len(chunk.ids)
+    finally:
+        writer.close()
+    return n_written
+
+
+## Uniform reservoir sample of a DesignChunk stream, yielded in id order
+def _sample_chunks(chunks, max_sets, seed, chunk_sets):
+    rng = np.random.default_rng(seed)
+    ids = None
+    n_seen = 0
+    for chunk in chunks:
+        if ids is None:
+            ids = np.empty(max_sets, dtype=np.int64)
+            codes = np.empty((max_sets,) + chunk.codes.shape[1:], dtype=chunk.codes.dtype)
+        slots, items = reservoir_slots(rng, n_seen, max_sets, len(chunk.ids))
+        ids[slots] = chunk.ids[items]
+        codes[slots] = chunk.codes[items]
+        n_seen += len(chunk.ids)
+    if ids is None:
+        return
+    n = min(n_seen, max_sets)
+    order = np.argsort(ids[:n], kind='stable')
+    for start in range(0, n, chunk_sets):
+        keep = order[start:start + chunk_sets]
+        yield DesignChunk(ids[keep], codes[keep])
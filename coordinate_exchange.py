@@ -0,0 +1,247 @@
+## Coordinate-exchange design search over attribute levels, without a candidate set
+# The modified Fedorov search (modfed.py) swaps whole choice sets in from an enumerated candidate store, so the
+# design space has to be enumerated first. Coordinate exchange instead changes the levels of one alternative
+# directly: for each choice set in turn every move - one attribute (or one group of attributes, see move_groups)
+# of one alternative set to another level - is generated, checked against the profile rules for the changed
+# profile and the pair rules for that one choice set, and every valid move is scored at once with the rank-k
+# determinant updates in exchange.py. The best improving move is accepted. Sweeps over the design repeat until
+# they stop lowering the DB-error.
+#
+# Only the design (level codes and the exchange state) is held, so designs can be optimised for attribute spaces
+# far too large to enumerate; memory grows with the design size and the number of moves per choice set.
+import itertools
+import time
+
+import numpy as np
+
+from constraints import AllOrNone, GroupOverlap
+from diagnostics import DesignDiagnostics
+from efficiency import db_error
+from exchange import ExchangeState, _nanmean_last, information_factors
+from modfed import MODFEDEROV_CODING
+
+
+## Attribute groups whose levels are changed together in one move
+# every attribute on its own, plus the attributes of each AllOrNone rule and each multi-attribute GroupOverlap
+# group - with all-or-none rules no single attribute of such a group can leave its 'absent' level on its own
+def move_groups(spec):
+    groups = [[att] for att in spec.attribute_names]
+    for rule in spec.profile_rules:
+        if isinstance(rule, AllOrNone):
+            groups.append(list(rule.levels))
+    for rule in spec.pair_rules:
+        if isinstance(rule, GroupOverlap):
+            groups += [list(atts) for atts in rule.groups.values() if len(atts) > 1]
+    unique = []
+    for group in groups:
+        if sorted(group) not in [sorted(g) for g in unique]:
+            unique.append(group)
+    return unique
+
+
+# n profiles drawn uniformly from the full factorial, kept if they meet the profile rules
+def _random_profiles(n_levels, n, rng, rules):
+    profiles = (rng.random((n, len(n_levels))) * n_levels).astype(np.uint8)
+    return profiles[rules.profile_mask(profiles)]
+
+
+## Valid choice sets drawn at random without enumeration - level codes (n_sets, 2, n_attributes)
+# profiles are drawn uniformly from the full factorial in batches and kept if they meet the profile rules, then
+# paired at random and kept if the pair meets the pair rules (rejection sampling)
+def random_choice_sets(spec, n_sets, rng, rules=None, batch_size=10000, max_batches=1000):
+    rules = rules or spec.compile()
+    n_levels = np.array([len(levels) for levels in spec.attributes.values()])
+    found = []
+    n_found = 0
+    for _ in range(max_batches):
+        profiles = _random_profiles(n_levels, 2 * batch_size, rng, rules)
+        profiles = profiles[:len(profiles) // 2 * 2].reshape(-1, 2, len(n_levels))
+        if rules.pair_rules:
+            keep = rules.pair_mask(rules.pair_features(profiles[:, 0]), rules.pair_features(profiles[:, 1]))
+            profiles = profiles[keep]
+        found.append(profiles)
+        n_found += len(profiles)
+        if n_found >= n_sets:
+            return np.concatenate(found)[:n_sets]
+    raise RuntimeError(f"found only {n_found} valid choice sets in {max_batches} batches of {batch_size}")
+
+
+## Design coding of a coordinate-exchange search over spec
+# by default MODFEDEROV_CODING without the columns the spec's valid profiles make collinear (see
+# DesignCoding.full_rank); an explicit coding must be full rank over them, or every information matrix is singular.
+# The profile space is not enumerated: the rank is taken over the distinct profiles among n_samples drawn from the
+# full factorial that meet the profile rules, which span every direction the valid profiles span unless some
+# direction is carried by a tiny share of them - raise n_samples for very sparse profile rules.
+def design_coding(spec, coding=None, n_samples=20000, seed=0):
+    rules = spec.compile()
+    n_levels = np.array([len(levels) for levels in spec.attributes.values()])
+    profiles = np.unique(_random_profiles(n_levels, n_samples, np.random.default_rng(seed), rules), axis=0)
+    if not len(profiles):
+        raise ValueError(f"none of {n_samples} sampled profiles meets the profile rules")
+    if coding is None:
+        return MODFEDEROV_CODING.full_rank(spec, profiles)
+    coding.check_full_rank(spec, profiles)
+    return coding
+
+
+## One coordinate-exchange search from a design of level codes (n_sets, 2, n_attributes)
+# coding is a full-rank coding as returned by design_coding (design_coding(spec) if None); draws are in the order
+# of its columns.
+# The design's diagnostics (diagnostics.py) are updated with every move; with max_imbalance, moves that would leave
+# the imbalance above max_imbalance (or above the current imbalance, if that is higher) are not considered.
+class CoordinateExchange:
+    def __init__(self, spec, draws, codes, coding=None, groups=None, max_imbalance=None):
+        self.spec = spec
+        self.rules = spec.compile()
+        self.coding = design_coding(spec) if coding is None else coding
+        if np.shape(draws)[-1] != len(self.coding.names):
+            raise ValueError(f"draws have {np.shape(draws)[-1]} columns, the coding {len(self.coding.names)} "
+                             f"({self.coding.names})")
+        self.codes = np.array(codes, dtype=np.uint8)
+        self.state = ExchangeState(self.coding.design(spec, self.codes), draws)
+        self.db_error = self.state.db_error
+        self.diagnostics = DesignDiagnostics(spec, self.codes)
+        self.max_imbalance = max_imbalance
+        self.n_sweeps = 0
+
+        # every level combination of each move group: (columns, (n_combinations, len(columns)) level codes)
+        self.moves = []
+        for group in groups or move_groups(spec):
+            cols = [spec.column(att) for att in group]
+            levels = itertools.product(*[range(len(spec.attributes[att])) for att in group])
+            self.moves.append((cols, np.array(list(levels), dtype=np.uint8)))
+
+    @property
+    def design(self):
+        return self.state.design
+
+    ## Choice sets (n_moves, 2, n_attributes) reached from the set at position by one move
+    def _neighbours(self, position):
+        current = self.codes[position]
+        neighbours = []
+        for alternative in range(current.shape[0]):
+            for cols, combinations in self.moves:
+                changed = (combinations != current[alternative, cols]).any(axis=1)
+                sets = np.repeat(current[None], changed.sum(), axis=0)
+                sets[:, alternative, cols] = combinations[changed]
+                neighbours.append(sets)
+        neighbours = np.concatenate(neighbours)
+        # single-attribute moves inside a group repeat some group moves
+        _, first = np.unique(neighbours.reshape(len(neighbours), -1), axis=0, return_index=True)
+        return neighbours[np.sort(first)]
+
+    ## Valid moves only - profile rules for both profiles, pair rules for the set, and not already in the design
+    def _valid(self, sets, telemetry=None):
+        n_attributes = sets.shape[-1]
+        profile_ok = self.rules.profile_mask(sets.reshape(-1, n_attributes)).reshape(-1, 2).all(axis=1)
+        pair_ok = np.ones(len(sets), dtype=bool)
+        if self.rules.pair_rules and profile_ok.any():
+            left = self.rules.pair_features(sets[profile_ok, 0])
+            right = self.rules.pair_features(sets[profile_ok, 1])
+            pair_ok[profile_ok] = self.rules.pair_mask(left, right)
+        new = ~(sets[:, None] == self.codes[None]).all(axis=(2, 3)).any(axis=1)
+        if telemetry is not None:
+            telemetry.count('coordinate.moves_checked', len(sets))
+            telemetry.count('coordinate.rejected.profile_rules', np.count_nonzero(~profile_ok))
+            telemetry.count('coordinate.rejected.pair_rules', np.count_nonzero(profile_ok & ~pair_ok))
+            telemetry.count('coordinate.rejected.in_design', np.count_nonzero(profile_ok & pair_ok & ~new))
+        return sets[profile_ok & pair_ok & new]
+
+    ## Try every valid move of the set at position - returns True if one was accepted
+    # The DB-error ignores draws whose D-error is undefined, so from a poorly identified start a move could lower it
+    # just by making more draws undefined; moves are ranked by the number of undefined draws first, then DB-error.
+    # The best move is only made if it still improves once the draws the exchange state scores directly have been
+    # recomputed from the moved design (ExchangeState.commit).
+    def improve(self, position, telemetry=None):
+        sets = self._valid(self._neighbours(position), telemetry)
+        if self.max_imbalance is not None and len(sets):
+            imbalance = self.diagnostics.swap_imbalance(sets, [position])[:, 0]
+            balanced = imbalance <= max(self.max_imbalance, self.diagnostics.imbalance())
+            if telemetry is not None:
+                telemetry.count('coordinate.rejected.unbalanced', np.count_nonzero(~balanced))
+            sets = sets[balanced]
+        if not len(sets):
+            return False
+        candidates = self.coding.design(self.spec, sets)
+        candidate_factors = information_factors(candidates, self.state.draws)
+        d_errors = self.state.swap_d_errors(candidates, candidate_factors, positions=[position])[:, 0]
+        if telemetry is not None:
+            telemetry.count('coordinate.moves_scored', len(sets))
+        n_undefined = np.isnan(d_errors).sum(axis=1)
+        errors = _nanmean_last(d_errors)
+        best = np.lexsort((np.where(np.isnan(errors), np.inf, errors), n_undefined))[0]
+        current_undefined = np.isnan(self.state.d_errors).sum()
+        if n_undefined[best] > current_undefined or np.isnan(errors[best]):
+            return False
+        if n_undefined[best] == current_undefined and not errors[best] < self.db_error:
+            return False
+        if not self.state.commit(position, candidates[best], candidate_factors[:, best],
+                                 accept=lambda d_errors: self._improves(d_errors, current_undefined)):
+            if telemetry is not None:
+                telemetry.count('coordinate.moves_unconfirmed')
+            return False
+        self.diagnostics.swap(position, sets[best])
+        self.codes[position] = sets[best]
+        self.db_error = self.state.db_error
+        if telemetry is not None:
+            telemetry.count('coordinate.moves_accepted')
+        return True
+
+    # fewer undefined draws, or as many and a lower DB-error
+    def _improves(self, d_errors, current_undefined):
+        n_undefined = np.isnan(d_errors).sum()
+        if n_undefined != current_undefined:
+            return n_undefined < current_undefined
+        return bool(_nanmean_last(d_errors) < self.db_error)
+
+    ## One pass over every choice set in the design - returns the number of accepted moves
+    # the exchange state is recomputed after every sweep, so the low-rank updates never drift far
+    def sweep(self, telemetry=None):
+        self.n_sweeps += 1
+        n_accepted = sum(self.improve(position, telemetry) for position in range(len(self.codes)))
+        self.state.refresh()
+        self.db_error = self.state.db_error
+        return n_accepted
+
+
+## Coordinate-exchange search from a random valid design (or start_codes)
+# coding defaults to design_coding(spec). The DB-error after every sweep is efficiency.db_error of the design and
+# the best design so far is kept. Stops after max_sweeps_without_improvement sweeps that do not lower it,
+# after max_sweeps sweeps or once max_seconds have passed. Returns a dict with the level codes of the best design
+# (n_sets, 2, n_attributes), its design matrix (n_sets, n_alts, K), DB-error and diagnostics report, and the trace
+# of (seconds, DB-error) after every sweep.
+def coordinate_exchange(spec, draws, n_sets=48, start_codes=None, rng=None, max_sweeps=None, max_seconds=None,
+                        max_sweeps_without_improvement=10, coding=None, groups=None, max_tries=100, report=print,
+                        telemetry=None, max_imbalance=None):
+    rng = np.random.default_rng(rng)
+    coding = design_coding(spec, coding)
+    codes = start_codes
+    if codes is None:
+        for _ in range(max_tries):
+            codes = random_choice_sets(spec, n_sets, rng)
+            if np.isfinite(db_error(coding.design(spec, codes), draws)):
+                break
+        else:
+            raise RuntimeError(f"no starting design with a finite DB-error in {max_tries} tries")
+    search = CoordinateExchange(spec, draws, codes, coding, groups, max_imbalance)
+
+    started = time.perf_counter()
+    trace = [(0.0, search.db_error)]
+    best = {'codes': search.codes.copy(), 'design': search.design.copy(), 'db_error': search.db_error}
+    improved_at = 0
+    while max_sweeps is None or search.n_sweeps < max_sweeps:
+        n_accepted = search.sweep(telemetry)
+        trace.append((time.perf_counter() - started, search.db_error))
+        if report is not None:
+            report(f"Sweep {search.n_sweeps}: {n_accepted} moves accepted, DB-error {search.db_error:.6g}")
+        if telemetry is not None:
+            telemetry.progress('coordinate_exchange', search.n_sweeps, max_sweeps, force=True,
+                               db_error=search.db_error, moves_accepted=n_accepted)
+        if search.db_error < best['db_error']:
+            best = {'codes': search.codes.copy(), 'design': search.design.copy(), 'db_error': search.db_error}
+            improved_at = search.n_sweeps
+        if not n_accepted or search.n_sweeps - improved_at >= max_sweeps_without_improvement:
+            break
+        if max_seconds is not None and time.perf_counter() - started >= max_seconds:
+            break
+    return {**best, 'diagnostics': DesignDiagnostics(spec, best['codes']).report(), 'trace': trace}
@@ -0,0 +1,77 @@
+## Design specifications for the cropping information choice experiment
+# Both variants of the full factorial script are defined here from the same rule objects (see constraints.py)
+from constraints import AllOrNone, DesignSpec, Dominance, GroupOverlap, Requires
+
+# attribute groups - at least two must overlap (and no more than two) between alternatives (not including cost)
+ATTRIBUTE_GROUPS = {
+    'weather': ['W_A'],
+    'climate': ['C_A'],
+    'soil_moisture': ['SM_A', 'SM_F', 'SM_C'],
+    'soil_nutrition': ['SN_A', 'SN_F', 'SN_C'],
+}
+
+
+## Base design - full_factorial_with_constraints.py
+# the 'absent' level is 0 for accuracy and 1 for frequency / coverage
+BASE_SPEC = DesignSpec(
+    attributes={
+        'W_A': [10, 30, 50, 80],
+        'C_A': [10, 30, 50, 80],
+        'SM_A': [0, 10, 30, 50, 80],
+        'SM_F': [1, 2, 3],
+        'SM_C': [1, 2, 3],
+        'SN_A': [0, 10, 30, 50, 80],
+        'SN_F': [1, 2, 3],
+        'SN_C': [1, 2, 3],
+        'C': [50, 250, 1250, 3500],
+    },
+    profile_rules=[
+        # Soil moisture attributes are all zero when any one is zero
+        AllOrNone({'SM_A': 0, 'SM_F': 1, 'SM_C': 1}),
+        # Soil nutrition attributes are all zero when any one is zero
+        AllOrNone({'SN_A': 0, 'SN_F': 1, 'SN_C': 1}),
+    ],
+    pair_rules=[
+        # exactly two attribute groups are set to the same level in each alternative
+        GroupOverlap(ATTRIBUTE_GROUPS, n_equal=2),
+        # if all information attributes in one alternative are greater than the other, cost should also be higher
+        Dominance('C'),
+    ],
+)
+
+
+## Design with additional cost constraints - full_factorial_with_constraints copy.py
+# fewer levels, the 'absent' level is coded 0 throughout, plus the highest cost level restriction
+ADDITIONAL_COST_CONSTRAINTS_SPEC = DesignSpec(
+    attributes={
+        'W_A': [30, 50, 80],
+        'C_A': [30, 50, 80],
+        'SM_A': [0, 30, 50, 80],
+        'SM_F': [0, 1, 2],
+        'SM_C': [0, 1, 2],
+        'SN_A': [0, 30, 50, 80],
+        'SN_F': [0, 1, 2],
+        'SN_C': [0, 1, 2],
+        'C': [100, 250, 1250, 3500],
+    },
+    profile_rules=[
+        AllOrNone({'SM_A': 0, 'SM_F': 0, 'SM_C': 0}),
+        AllOrNone({'SN_A': 0, 'SN_F': 0, 'SN_C': 0}),
+        # Don't allow the highest cost level to be present when alternatives include no attributes set at their highest level
+        # This is a very strict constraint and may be construed as risky
+        # It is justified on the basis that the highest cost level is set at a very high value.
+        Requires(
+            when_levels={'C': 3500},
+            any_of={'W_A': 80, 'C_A': 80, 'SM_A': 80, 'SM_F': 2, 'SM_C': 2, 'SN_A': 80, 'SN_F': 2, 'SN_C': 2},
+        ),
+    ],
+    pair_rules=[
+        GroupOverlap(ATTRIBUTE_GROUPS, n_equal=2),
+        Dominance('C'),
+    ],
+)
+
+SPECS = {
+    'base': BASE_SPEC,
+    'additional_cost_constraints': ADDITIONAL_COST_CONSTRAINTS_SPEC,
+}
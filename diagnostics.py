@@ -0,0 +1,90 @@
+## Design diagnostics kept up to date while a search swaps choice sets
+# Designs are judged by their DB-error, but level balance, attribute overlap and dominated choice sets are worth
+# watching too. DesignDiagnostics holds, for the level codes (n_sets, 2, n_attributes) of the current design,
+#   level_counts   (n_attributes, max levels)  how often each level appears over all alternatives
+#   overlap_counts (n_attributes,)             number of sets with the same level in both alternatives
+#   dominated      (n_sets,)                   sets where one alternative is at least as good on every information
+#                                              attribute and not dearer (the spec's cost attribute; what the
+#                                              Dominance rule excludes, see constraints.py)
+# and swap() updates them from the old and new set only, in O(n_attributes) whatever the design size.
+# Imbalance is the largest relative deviation of a level's count from an even spread over the levels of its
+# attribute (0 for a perfectly balanced design; the profile rules can make 0 unreachable).
+import numpy as np
+
+from constraints import Dominance
+
+
+class DesignDiagnostics:
+    def __init__(self, spec, codes):
+        self.spec = spec
+        self.codes = np.array(codes, dtype=np.uint8)
+        self.n_levels = np.array([len(levels) for levels in spec.attributes.values()])
+        self._columns = np.arange(len(self.n_levels))
+        self._dominance = None
+        if spec.cost_attribute in spec.attributes:
+            self._dominance = Dominance(spec.cost_attribute).compile(spec)
+
+        self.level_counts = self.set_level_counts(self.codes).sum(axis=0)
+        self.overlap_counts = (self.codes[:, 0] == self.codes[:, 1]).sum(axis=0)
+        self.dominated = self.is_dominated(self.codes)
+        self.n_dominated = int(self.dominated.sum())
+
+    @property
+    def n_sets(self):
+        return self.codes.shape[0]
+
+    ## Level counts of each set (n, n_attributes, max levels)
+    def set_level_counts(self, codes):
+        codes = np.asarray(codes)
+        counts = np.zeros((codes.shape[0], len(self.n_levels), self.n_levels.max()), dtype=np.int64)
+        for alternative in range(codes.shape[1]):
+            np.add.at(counts, (np.arange(codes.shape[0])[:, None], self._columns, codes[:, alternative]), 1)
+        return counts
+
+    ## True for sets (n, 2, n_attributes) where one alternative dominates the other
+    def is_dominated(self, codes):
+        codes = np.asarray(codes)
+        if self._dominance is None:
+            return np.zeros(codes.shape[0], dtype=bool)
+        left = self._dominance.features(codes[:, 0])
+        right = self._dominance.features(codes[:, 1])
+        return ~self._dominance.mask(left, right)
+
+    ## Imbalance of level counts (..., n_attributes, max levels) - shape (...)
+    def imbalance(self, level_counts=None):
+        counts = self.level_counts if level_counts is None else level_counts
+        expected = counts.sum(axis=-1, keepdims=True) / self.n_levels[:, None]
+        used = np.arange(counts.shape[-1]) < self.n_levels[:, None]
+        deviation = np.where(used, np.abs(counts - expected) / expected, 0.0)
+        return deviation.max(axis=(-2, -1))
+
+    ## Imbalance after swapping each of the sets (n_candidates, 2, n_attributes) into each position
+    # - shape (n_candidates, n_positions); positions defaults to every set of the design
+    def swap_imbalance(self, candidate_codes, positions=None):
+        positions = np.arange(self.n_sets) if positions is None else np.asarray(positions)
+        counts = (self.level_counts[None, None] - self.set_level_counts(self.codes[positions])[None]
+                  + self.set_level_counts(candidate_codes)[:, None])
+        return self.imbalance(counts)
+
+    ## Replace the set at position with new_codes (2, n_attributes)
+    def swap(self, position, new_codes):
+        new_codes = np.asarray(new_codes, dtype=np.uint8)
+        old_codes = self.codes[position]
+        for alternative in range(old_codes.shape[0]):
+            self.level_counts[self._columns, old_codes[alternative]] -= 1
+            self.level_counts[self._columns, new_codes[alternative]] += 1
+        self.overlap_counts += (new_codes[0] == new_codes[1]).astype(np.int64) - (old_codes[0] == old_codes[1])
+        dominated = bool(self.is_dominated(new_codes[None])[0])
+        self.n_dominated += int(dominated) - int(self.dominated[position])
+        self.dominated[position] = dominated
+        self.codes[position] = new_codes
+
+    ## Json-serialisable summary - counts by level value, overlap shares, dominated sets and imbalance
+    def report(self):
+        return {
+            'level_counts': {att: {str(value): int(self.level_counts[a, k]) for k, value in enumerate(levels)}
+                             for a, (att, levels) in enumerate(self.spec.attributes.items())},
+            'overlap': {att: float(self.overlap_counts[a] / self.n_sets) for a, att in enumerate(self.spec.attributes)},
+            'n_dominated': self.n_dominated,
+            'imbalance': float(self.imbalance()),
+        }
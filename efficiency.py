@@ -0,0 +1,89 @@
+## Bayesian D-error for MNL choice designs (two alternatives + no choice), evaluated for all prior draws at once
+# Follows idefix's EvaluateDesign (no.choice = TRUE): for each draw the MNL Fisher information is
+#   I(beta) = sum_s X_s' (diag(p_s) - p_s p_s') X_s
+# the D-error is det(I)^(-1/K) (NA when det(I) <= 0) and the DB-error is the mean D-error over draws, ignoring NAs.
+# Designs are (n_sets, n_alts, K) arrays and draws are (n_draws, K) arrays in the same parameter order as the
+# design columns, e.g. [no.choice.cte, wa, ca, sma, smfq, ..., cost] for latest_design.csv.
+# The full 14-column coding of latest_design.csv is not identified: its rows have rank 12 (smcc and sncc are
+# linear combinations of the other columns for these profiles), so every information matrix is singular and a
+# 14-column DB-error is rounding noise (about 1.9e8 over 25 prior draws, many of them NaN). Evaluate it in the full-rank
+# coding (DesignCoding.full_rank, which drops smcc and sncc) - tests/test_efficiency.py pins that reference value.
+import numpy as np
+
+
+## Reshape a long design (n_sets * n_alts rows, as in latest_design.csv) to (n_sets, n_alts, K)
+def design_array(design, n_alts=3):
+    design = np.asarray(design, dtype=np.float64)
+    if design.shape[0] % n_alts:
+        raise ValueError(f"design has {design.shape[0]} rows, not a multiple of n_alts = {n_alts}")
+    return design.reshape(-1, n_alts, design.shape[1])
+
+
+## MNL choice probabilities for every draw, set and alternative - shape (n_draws, n_sets, n_alts)
+def mnl_probabilities(design, draws):
+    return mnl_from_utilities(np.einsum('sjk,rk->rsj', design, draws))
+
+
+## MNL choice probabilities from utilities (..., n_alts) - a softmax over the last axis, in place for float64
+# utilities are shifted by their maximum within each set before exponentiating, which gives the same probabilities
+# as exp(u) / sum(exp(u)) wherever that is finite and avoids overflow for large cost coefficients. Shifted
+# utilities below -700 are clipped: their probabilities stay under 1e-304 (nothing, next to the others) and exp
+# does not fall into its much slower underflow path. The reductions run over the few alternatives one at a time,
+# which is far faster than numpy's reduction over a short last axis.
+def mnl_from_utilities(utility):
+    utility = np.asarray(utility, dtype=np.float64)
+    n_alts = utility.shape[-1]
+    largest = utility[..., 0].copy()
+    for j in range(1, n_alts):
+        np.maximum(largest, utility[..., j], out=largest)
+    utility -= largest[..., None]
+    np.maximum(utility, -700.0, out=utility)
+    np.exp(utility, out=utility)
+    total = utility[..., 0].copy()
+    for j in range(1, n_alts):
+        total += utility[..., j]
+    utility /= total[..., None]
+    return utility
+
+
+## Per-set Fisher information contributions X_s' (diag(p) - p p') X_s - shape (n_draws, n_sets, K, K)
+# computed in the centred form sum_j p_j (x_j - xbar)(x_j - xbar)' with xbar = sum_j p_j x_j, which is the same
+# matrix but does not lose precision to cancellation when one alternative takes almost all the probability
+def set_information(design, draws, probabilities=None):
+    p = mnl_probabilities(design, draws) if probabilities is None else probabilities
+    centred = design[None] - np.einsum('rsj,sjk->rsk', p, design)[:, :, None, :]
+    return np.einsum('rsj,rsjk,rsjl->rskl', p, centred, centred)
+
+
+## Design information matrix for every draw - shape (n_draws, K, K)
+def information_matrices(design, draws):
+    p = mnl_probabilities(design, draws)
+    centred = design[None] - np.einsum('rsj,sjk->rsk', p, design)[:, :, None, :]
+    return np.einsum('rsj,rsjk,rsjl->rkl', p, centred, centred)
+
+
+## D-error det(I)^(-1/K) for a stack of information matrices (..., K, K); NaN where det(I) <= 0
+# the matrices are scaled to unit diagonal before taking the determinant - attributes on very different scales
+# (cost in dollars next to 0/1 dummies) otherwise make the determinant of a well-identified design lose its sign
+def d_errors_from_information(information):
+    k = information.shape[-1]
+    diagonal = np.diagonal(information, axis1=-2, axis2=-1)
+    positive = (diagonal > 0).all(axis=-1)
+    scale = np.sqrt(np.where(diagonal > 0, diagonal, 1.0))
+    sign, logdet = np.linalg.slogdet(information / (scale[..., :, None] * scale[..., None, :]))
+    logdet = logdet + 2 * np.log(scale).sum(axis=-1)
+    with np.errstate(over='ignore'):
+        return np.where(positive & (sign > 0), np.exp(-logdet / k), np.nan)
+
+
+## D-error for every prior draw - shape (n_draws,)
+def d_errors(design, draws):
+    return d_errors_from_information(information_matrices(design, np.atleast_2d(draws)))
+
+
+## DB-error - mean D-error over the prior draws, ignoring NaNs (NaN if every draw is NaN)
+def db_error(design, draws):
+    errors = d_errors(design, draws)
+    if np.isnan(errors).all():
+        return np.nan
+    return float(np.nanmean(errors))
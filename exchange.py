@@ -0,0 +1,228 @@
+## Incremental information-matrix updates for exchange (swap) searches
+# Each choice set's information contribution is a rank-J term A_s = G_s G_s', with the K x J factor
+#   G_s = [sqrt(p_j) (x_j - xbar)]_j      (centred form, see efficiency.set_information)
+# so swapping set s for candidate c changes the information matrix by U C U' with U = [G_c, G_s] and
+# C = diag(I_J, -I_J). The matrix determinant lemma scores a swap from a 2J x 2J determinant
+#   det(M') = det(M) (-1)^J det(C + U' M^-1 U)
+# and an accepted swap updates M^-1 and log det(M) with the Woodbury identity in O(K^2 J) per draw instead of
+# re-evaluating the whole design. Both work on D^-1 M D^-1, M scaled to unit diagonal when the state was last
+# refreshed (and the factors scaled to D^-1 G), so cost in dollars next to 0/1 dummies does not cost precision.
+# Both lose about as many digits as the scaled M has condition number - no more than computing the D-error from M
+# directly does - and the lemma also loses the digits of 1 - leverage of the set swapped out. Draws whose scaled
+# information matrix has a condition number above max_condition (a design that barely identifies some parameter
+# under that draw, as when large cost coefficients make one alternative certain, so its D-error is mostly rounding)
+# are kept on the direct path instead: their swaps are scored from M - A_s + A_c and their information matrices
+# are recomputed from the design after every commit. Swaps out of sets that carry nearly all the information in
+# some direction are scored directly too, and committing one refreshes the state.
+# For the other draws the updated inverse and log-determinant are the state; everything is recomputed from the
+# design every refresh_every commits (and by refresh()), when the D-errors are again those of efficiency.d_errors.
+import numpy as np
+
+from efficiency import d_errors, d_errors_from_information, information_matrices, mnl_probabilities
+
+
+## Information factors G for every draw and set - shape (n_draws, n_sets, K, J)
+# probabilities: the sets' MNL probabilities (n_draws, n_sets, J) if already known, e.g. from a ProfileTable
+def information_factors(design, draws, probabilities=None):
+    p = mnl_probabilities(design, draws) if probabilities is None else probabilities
+    centred = design[None] - np.matmul(p[:, :, None, :], design[None])
+    centred *= np.sqrt(p)[..., None]
+    # a view in (J, K) memory order, which the einsums below read faster than a contiguous copy
+    return np.swapaxes(centred, -1, -2)
+
+
+## Mean over the last axis ignoring NaNs, NaN where every value is NaN
+def _nanmean_last(values):
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=-1)
+    total = np.where(valid, values, 0.0).sum(axis=-1)
+    return np.where(n_valid > 0, total / np.maximum(n_valid, 1), np.nan)
+
+
+## Current design of an exchange search with its per-draw information matrices, inverses and log-determinants
+class ExchangeState:
+    # largest condition number (of the scaled matrix) of the draws scored with low-rank updates - their D-errors
+    # are good to about max_condition times the machine epsilon
+    max_condition = 1e12
+    # swaps out of a set whose leverage (largest eigenvalue of G_s' M^-1 G_s) is within min_residual of 1 are
+    # scored directly
+    min_residual = 1e-2
+
+    def __init__(self, design, draws, refresh_every=50):
+        self.design = np.array(design, dtype=np.float64)
+        self.draws = np.atleast_2d(np.asarray(draws, dtype=np.float64))
+        self.refresh_every = refresh_every
+        self.refresh()
+
+    @property
+    def n_params(self):
+        return self.design.shape[-1]
+
+    @property
+    def n_alts(self):
+        return self.design.shape[1]
+
+    ## Recompute everything from the design (also run every refresh_every commits to stop rounding drift)
+    def refresh(self):
+        self.factors = information_factors(self.design, self.draws)
+        self._recompute()
+        self.n_updates = 0
+
+        diagonal = np.diagonal(self.information, axis1=-2, axis2=-1)
+        scale = np.sqrt(np.where(diagonal > 0, diagonal, 1.0))
+        scaled = self.information / (scale[:, :, None] * scale[:, None, :])
+        eigenvalues = np.linalg.eigvalsh(scaled)
+        self.low_rank = (diagonal > 0).all(axis=1) & (eigenvalues[:, 0] > eigenvalues[:, -1] / self.max_condition)
+
+        # inverses and log-determinants of the scaled matrices; log det(M) = logdet + 2 sum(log(scale))
+        self.scale = scale
+        self.inverse = np.full_like(self.information, np.nan)
+        self.logdet = np.full(len(self.draws), np.nan)
+        if self.low_rank.any():
+            good = self.low_rank
+            self.inverse[good] = np.linalg.inv(scaled[good])
+            self.logdet[good] = np.log(eigenvalues[good]).sum(axis=1)
+
+    # information matrices and D-errors recomputed from the design, as efficiency.d_errors computes them
+    def _recompute(self):
+        self.information = information_matrices(self.design, self.draws)
+        self.d_errors = d_errors_from_information(self.information)
+
+    @property
+    def db_error(self):
+        return float(_nanmean_last(self.d_errors))
+
+    # factors (n_draws, ..., K, J) of the draws draw_ids scaled to the refreshed unit diagonal
+    def _scaled(self, factors, draw_ids):
+        scale = self.scale[draw_ids]
+        return factors / scale.reshape(scale.shape[:1] + (1,) * (factors.ndim - 3) + scale.shape[1:] + (1,))
+
+    # D-errors of the draws draw_ids from log-determinants of their scaled matrices
+    def _d_errors_from_logdet(self, logdet, sign, draw_ids):
+        logdet = logdet + 2 * np.log(self.scale[draw_ids]).sum(axis=1).reshape((-1,) + (1,) * (logdet.ndim - 1))
+        with np.errstate(over='ignore'):
+            return np.where(sign > 0, np.exp(-logdet / self.n_params), np.nan)
+
+    ## Per-draw D-errors of every (candidate, position) swap - shape (n_candidates, n_positions, n_draws)
+    # candidates: (n_candidates, J, K) design matrices, candidate_factors: optional precomputed factors,
+    # positions: the design positions to try the candidates in (all of them by default)
+    def swap_d_errors(self, candidates, candidate_factors=None, positions=None):
+        candidates = np.asarray(candidates, dtype=np.float64)
+        if candidate_factors is None:
+            candidate_factors = information_factors(candidates, self.draws)
+        positions = np.arange(self.design.shape[0]) if positions is None else np.asarray(positions)
+        j = self.n_alts
+        n_candidates = candidates.shape[0]
+        n_sets = len(positions)
+        errors = np.full((n_candidates, n_sets, len(self.draws)), np.nan)
+
+        good = np.flatnonzero(self.low_rank)
+        if len(good):
+            inverse = self.inverse[good]
+            g_sets = self._scaled(self.factors[good][:, positions], good)
+            g_cands = self._scaled(candidate_factors[good], good)
+            h_sets = np.einsum('rkl,rslj->rskj', inverse, g_sets)
+            h_cands = np.einsum('rkl,rclj->rckj', inverse, g_cands)
+
+            # C + U' M^-1 U for every (draw, candidate, position), built block by block
+            small = np.empty((len(good), n_candidates, n_sets, 2 * j, 2 * j))
+            small[..., :j, :j] = (np.einsum('rcki,rckj->rcij', g_cands, h_cands) + np.eye(j))[:, :, None]
+            leverage = np.einsum('rski,rskj->rsij', g_sets, h_sets)
+            small[..., j:, j:] = (leverage - np.eye(j))[:, None]
+            cross = np.einsum('rcki,rskj->rcsij', g_cands, h_sets)
+            small[..., :j, j:] = cross
+            small[..., j:, :j] = np.swapaxes(cross, -1, -2)
+
+            sign, logdet_ratio = np.linalg.slogdet(small)
+            logdet = self.logdet[good][:, None, None] + logdet_ratio
+            errors[..., good] = np.moveaxis(self._d_errors_from_logdet(logdet, sign * (-1) ** j, good), 0, -1)
+
+            # a set holding nearly all the information in some direction (leverage close to 1) leaves the lower
+            # block nearly singular, and the lemma loses the digits of 1 - leverage - score those swaps directly
+            draw, set_ = np.nonzero(np.linalg.eigvalsh(leverage)[..., -1] > 1 - self.min_residual)
+            if len(draw):
+                g_sets = self.factors[good[draw], positions[set_]]
+                g_cands = candidate_factors[good[draw]]
+                trial = (self.information[good[draw]][:, None] - np.einsum('pki,pli->pkl', g_sets, g_sets)[:, None]
+                         + np.einsum('pcki,pcli->pckl', g_cands, g_cands))
+                errors[:, set_, good[draw]] = d_errors_from_information(trial).T
+
+        bad = np.flatnonzero(~self.low_rank)
+        if len(bad):
+            errors[..., bad] = np.moveaxis(self._direct_d_errors(bad, positions, candidate_factors), 0, -1)
+        return errors
+
+    # D-errors (n_draws, n_candidates, n_positions) of the draws draw_ids from M - A_s + A_c
+    def _direct_d_errors(self, draw_ids, positions, candidate_factors):
+        g_sets = self.factors[draw_ids][:, positions]
+        g_cands = candidate_factors[draw_ids]
+        a_sets = np.einsum('rski,rsli->rskl', g_sets, g_sets)
+        a_cands = np.einsum('rcki,rcli->rckl', g_cands, g_cands)
+        trial = self.information[draw_ids][:, None, None] - a_sets[:, None] + a_cands[:, :, None]
+        return d_errors_from_information(trial)
+
+    ## DB-error of every (candidate, position) swap - shape (n_candidates, n_positions)
+    def swap_db_errors(self, candidates, candidate_factors=None, positions=None):
+        return _nanmean_last(self.swap_d_errors(candidates, candidate_factors, positions))
+
+    ## Exact per-draw D-errors (n_draws,) of the design with candidate (J, K) at position, from the whole design
+    def exact_swap_d_errors(self, position, candidate):
+        design = self.design.copy()
+        design[position] = candidate
+        return d_errors(design, self.draws)
+
+    ## Replace the set at position with candidate (J, K) - returns True if the swap was made
+    # The inverses and log-determinants of the low-rank draws are updated with the Woodbury identity and the
+    # information matrices of the direct-path draws recomputed from the swapped design. accept, if given, is called
+    # with the per-draw D-errors (n_draws,) the swap would leave, and the state is left unchanged unless it returns
+    # True - a search can confirm its best-scored swap at the cost of the direct-path draws alone.
+    def commit(self, position, candidate, candidate_factors=None, accept=None):
+        candidate = np.asarray(candidate, dtype=np.float64)
+        if candidate_factors is None:
+            candidate_factors = information_factors(candidate[None], self.draws)[:, 0]
+        j = self.n_alts
+        design = self.design.copy()
+        design[position] = candidate
+        d_errors = self.d_errors.copy()
+
+        bad = np.flatnonzero(~self.low_rank)
+        if len(bad):
+            information = information_matrices(design, self.draws[bad])
+            d_errors[bad] = d_errors_from_information(information)
+
+        good = np.flatnonzero(self.low_rank)
+        unstable = False
+        if len(good):
+            g_new, g_old = candidate_factors[good], self.factors[good, position]
+            u = self._scaled(np.concatenate([g_new, g_old], axis=-1), good)
+            c = np.diag(np.r_[np.ones(j), -np.ones(j)])
+            mu = self.inverse[good] @ u
+            small = c + np.swapaxes(u, -1, -2) @ mu
+            sign, logdet_ratio = np.linalg.slogdet(small)
+            d_errors[good] = self._d_errors_from_logdet(self.logdet[good] + logdet_ratio, sign * (-1) ** j, good)
+            change = np.einsum('rki,rli->rkl', g_new, g_new) - np.einsum('rki,rli->rkl', g_old, g_old)
+            # the lemma loses the digits of 1 - leverage of the set swapped out, and a matrix that is no longer
+            # positive definite leaves the low-rank path - those draws are taken from M - A_s + A_c, and the state
+            # is refreshed after the swap
+            leverage = np.linalg.eigvalsh(small[:, j:, j:] + np.eye(j))[:, -1]
+            fragile = (leverage > 1 - self.min_residual) | (sign * (-1) ** j <= 0)
+            if fragile.any():
+                d_errors[good[fragile]] = d_errors_from_information(self.information[good[fragile]] + change[fragile])
+                unstable = True
+
+        if accept is not None and not accept(d_errors):
+            return False
+        if len(good):
+            self.inverse[good] -= mu @ np.linalg.solve(small, np.swapaxes(mu, -1, -2))
+            self.logdet[good] += logdet_ratio
+            self.information[good] += change
+        if len(bad):
+            self.information[bad] = information
+        self.d_errors = d_errors
+        self.factors[:, position] = candidate_factors
+        self.design = design
+
+        self.n_updates += 1
+        if unstable or self.n_updates >= self.refresh_every:
+            self.refresh()
+        return True
@@ -0,0 +1,84 @@
+## Bounded LRU cache of per-choice-set information contributions
+# A candidate set's contribution to the information matrix under every prior draw is kept as its information
+# factors G (n_draws, K, J) - A = G G', see exchange.py - keyed by (ChoiceSetID, draws version). The version is a
+# hash of the draws and the design columns, so chains with the same draws share entries and a cache is never read
+# with other draws. ChoiceSetIDs are positions in one candidate store (or pair sampler), so use one cache per
+# store. When the cached factors exceed max_bytes the least recently used sets are dropped.
+#
+# The exchange searches resample the same sets again and again - sets rejected earlier, and the sets of every
+# chain running in the same process - so a hit saves gathering and coding the set and recomputing its factors.
+import hashlib
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+
+## Version of a set of draws for the design columns names - part of every cache key
+def draws_version(draws, names):
+    digest = hashlib.sha256(np.ascontiguousarray(draws, dtype=np.float64).tobytes())
+    digest.update(json.dumps(list(names)).encode())
+    return digest.hexdigest()[:16]
+
+
+class InformationCache:
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    ## Information factors (n_draws, n_ids, K, J) of the choice sets ids
+    # compute(missing_ids) returns the factors of the sets that are not cached, in the same layout. With telemetry
+    # the lookups are also counted as 'search.cache_hits', 'search.cache_misses' and 'search.cache_evictions'.
+    def factors(self, ids, version, compute, telemetry=None):
+        keys = [(int(i), version) for i in np.asarray(ids, dtype=np.int64)]
+        cached = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            cached.append(entry)
+        missing = [k for k, entry in enumerate(cached) if entry is None]
+        n_evicted = self.evictions
+        if missing:
+            computed = compute(np.array([keys[k][0] for k in missing], dtype=np.int64))
+            # entries are kept in the (J, K) memory order of exchange.information_factors, so the factors come
+            # out laid out - and are scored - exactly as if they had been computed
+            for n, k in enumerate(missing):
+                cached[k] = np.ascontiguousarray(np.swapaxes(computed[:, n], -1, -2))
+                self._put(keys[k], cached[k])
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if telemetry is not None:
+            telemetry.count('search.cache_hits', len(keys) - len(missing))
+            telemetry.count('search.cache_misses', len(missing))
+            telemetry.count('search.cache_evictions', self.evictions - n_evicted)
+        return np.swapaxes(np.stack(cached, axis=1), -1, -2)
+
+    def _put(self, key, factors):
+        if factors.nbytes > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self._entries[key] = factors
+        self.nbytes += factors.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
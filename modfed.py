@@ -0,0 +1,245 @@
+## Modified Fedorov choice experiment design search in Python (port of modfederov.R)
+# Candidate choice sets come from a candidate store (candidate_store.py) and designs are scored with the
+# batched Bayesian D-error in efficiency.py and exchange.py, so there is no round trip through csv and idefix.
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from candidate_store import CandidateStore
+from coding import ASC, Continuous, DesignCoding, Dummy
+from efficiency import db_error
+from diagnostics import DesignDiagnostics
+from exchange import ExchangeState, _nanmean_last
+from information_cache import draws_version
+from priors import Normal, PriorSpec, Uniform
+from profile_table import ProfileTable
+
+# design matrix coding as in modfederov.R and latest_design.csv: the no choice constant, accuracy and cost as
+# level values, and dummies for the frequency / coverage levels (the 'absent' level 0 is the reference level)
+MODFEDEROV_CODING = DesignCoding([
+    ASC('no.choice.cte', alternative=2),
+    Continuous('W_A', 'wa'),
+    Continuous('C_A', 'ca'),
+    Continuous('SM_A', 'sma'),
+    Dummy('SM_F', {'smfq': 1, 'smfd': 2}),
+    Dummy('SM_C', {'smcr': 1, 'smcc': 2}),
+    Continuous('SN_A', 'sna'),
+    Dummy('SN_F', {'snfm': 1, 'snfd': 2}),
+    Dummy('SN_C', {'sncl': 1, 'sncc': 2}),
+    Continuous('C', 'cost'),
+], n_alts=3, no_choice=True)
+
+# design matrix columns, in the order used by modfederov.R and latest_design.csv
+DESIGN_COLUMNS = MODFEDEROV_CODING.names
+
+N_ALTS = MODFEDEROV_CODING.n_alts
+
+
+## Design matrices for choice sets of level codes (n, 2, n_attributes) -> (n, 3, K)
+# rows are alt1, alt2 and the no choice alternative (all zero apart from the no choice constant)
+# coding defaults to MODFEDEROV_CODING - e.g. MODFEDEROV_CODING.full_rank(spec, profiles) drops the columns the
+# all-or-none rules make collinear
+def candidate_design(spec, codes, coding=None):
+    return (coding or MODFEDEROV_CODING).design(spec, codes)
+
+
+## Long design table (one row per alternative) in the latest_design.csv layout
+def design_frame(design, coding=None):
+    return pd.DataFrame(design.reshape(-1, design.shape[-1]), columns=(coding or MODFEDEROV_CODING).names)
+
+
+## Priors as set in modfederov.R, by design column
+# note the R script overwrites the cost prior with runif(-1, 0) when building the priors matrix; that is kept here
+MODFEDEROV_PRIORS = PriorSpec({
+    'no.choice.cte': Normal(0, 5),
+    'wa': Uniform(0, 0.8),              # weather
+    'ca': Uniform(0, 0.8),              # climate
+    'sma': Uniform(0, 0.8),             # soil moisture accuracy
+    'smfq': Uniform(0, 10),             # soil moisture frequency quarterly
+    'smfd': Uniform(0, 30),             # soil moisture frequency daily
+    'smcr': Uniform(0, 10),             # soil moisture coverage regional
+    'smcc': Uniform(0, 30),             # soil moisture coverage continuous
+    'sna': Uniform(0, 0.8),             # soil nutrition accuracy
+    'snfm': Uniform(0, 10),             # soil nutrition frequency monthly
+    'snfd': Uniform(0, 30),             # soil nutrition frequency daily
+    'sncl': Uniform(0, 10),             # soil nutrition coverage low
+    'sncc': Uniform(0, 30),             # soil nutrition coverage continuous
+    'cost': Uniform(-1, 0),
+})
+
+
+## Prior draws (n_draws, K) for the design columns of coding (MODFEDEROV_CODING by default) - scrambled Halton by
+# default, method='pseudo' for runif draws
+def prior_draws(n_draws=25, rng=None, method='halton', coding=None):
+    return MODFEDEROV_PRIORS.draws(n_draws, method, rng, columns=(coding or MODFEDEROV_CODING).names)
+
+
+## Search coding for the profiles of a store - MODFEDEROV_CODING without the columns the store's profiles make
+# collinear by default; a coding whose information matrices are all singular raises ValueError
+def search_coding(store, coding=None):
+    if coding is None:
+        return MODFEDEROV_CODING.full_rank(store.spec, store.profiles)
+    coding.check_full_rank(store.spec, store.profiles)
+    return coding
+
+
+## Random starting design of n_sets ChoiceSetIDs with a finite DB-error
+def random_start(store, n_sets, draws, rng, max_tries=100, coding=None):
+    coding = search_coding(store, coding)
+    coded_profiles = coding.code_profiles(store.spec, store.profiles)
+    for _ in range(max_tries):
+        ids = store.sample_ids(n_sets, rng)
+        design = coding.store_design(store, ids, coded_profiles)
+        if np.isfinite(db_error(design, draws)):
+            return ids
+    raise RuntimeError(f"no starting design with a finite DB-error in {max_tries} tries")
+
+
+## One modified Fedorov exchange chain
+# Each step samples candidates_per_iteration candidate sets from the store (one, as in modfederov.R, by default;
+# store is a CandidateStore or a pair_sampler.PairSampler, which samples without enumerating the candidates)
+# and scores swapping each of them into every position of the current design in one batched pass with rank-k
+# determinant updates (see exchange.py). The best improving swap is accepted and committed with a Woodbury update.
+# Design matrices and information factors of the candidates are gathered from a ProfileTable (profile_table.py) of
+# the store's profiles, coded once with coding (see search_coding) and multiplied by the draws once; draws are in
+# the order of the coding's columns.
+# With an InformationCache (information_cache.py) the factors of sets already scored are reused - pass the same
+# cache to every chain on the same store.
+# The design's level balance, attribute overlap and dominated sets are kept in a DesignDiagnostics
+# (diagnostics.py) updated with every swap; with max_imbalance, swaps that would leave the design's imbalance above
+# max_imbalance (or above the current imbalance, if that is higher) are not considered.
+# The chain only holds the ChoiceSetIDs, the exchange state and the random generator, so it can be checkpointed
+# and rebuilt from the ids (see search.py).
+class FedorovChain:
+    def __init__(self, store, draws, ids, rng, candidates_per_iteration=1, coding=None, cache=None,
+                 max_imbalance=None):
+        self.store = store
+        self.ids = np.array(ids, dtype=np.int64)
+        self.rng = rng
+        self.candidates_per_iteration = candidates_per_iteration
+        self.coding = search_coding(store, coding)
+        if np.shape(draws)[-1] != len(self.coding.names):
+            raise ValueError(f"draws have {np.shape(draws)[-1]} columns, the coding {len(self.coding.names)} "
+                             f"({self.coding.names})")
+        self.table = ProfileTable(self.coding, store.spec, store.profiles, draws)
+        self.state = ExchangeState(self.table.design(store.profile_ids(self.ids)), draws)
+        self.cache = cache
+        self.draws_version = draws_version(self.state.draws, self.coding.names)
+        self.diagnostics = DesignDiagnostics(store.spec, store.codes(self.ids))
+        self.max_imbalance = max_imbalance
+        self.db_error = self.state.db_error
+        self.iteration = 0
+
+    @property
+    def design(self):
+        return self.state.design
+
+    ## Information factors (n_draws, n_candidates, K, J) of the candidate sets ids
+    def candidate_factors(self, ids, telemetry=None):
+        def compute(ids):
+            return self.table.factors(self.store.profile_ids(ids))
+        if self.cache is None:
+            return compute(ids)
+        return self.cache.factors(ids, self.draws_version, compute, telemetry)
+
+    ## Run one iteration - returns True if a swap was accepted
+    # with telemetry, counts the iterations, candidates sampled, candidates skipped because they are already in
+    # the design, candidates scored, swaps ruled out by max_imbalance, best swaps that did not lower the DB-error
+    # once the directly scored draws were recomputed, and swaps accepted ('search.*' counters)
+    def step(self, telemetry=None):
+        self.iteration += 1
+
+        # sample new candidate sets that are not already in the design
+        candidate_ids = self.store.sample_ids(self.candidates_per_iteration, self.rng)
+        n_sampled = len(candidate_ids)
+        candidate_ids = candidate_ids[~np.isin(candidate_ids, self.ids)]
+        if telemetry is not None:
+            telemetry.count('search.iterations')
+            telemetry.count('search.candidates_sampled', n_sampled)
+            telemetry.count('search.candidates_in_design', n_sampled - len(candidate_ids))
+            telemetry.count('search.candidates_scored', len(candidate_ids))
+        if not len(candidate_ids):
+            return False
+        candidates = self.table.design(self.store.profile_ids(candidate_ids))
+        candidate_factors = self.candidate_factors(candidate_ids, telemetry)
+
+        # DB-error of every candidate in every position - (n_candidates, n_sets)
+        trial_errors = self.state.swap_db_errors(candidates, candidate_factors)
+        if self.max_imbalance is not None:
+            imbalance = self.diagnostics.swap_imbalance(self.store.codes(candidate_ids))
+            too_unbalanced = imbalance > max(self.max_imbalance, self.diagnostics.imbalance())
+            trial_errors[too_unbalanced] = np.nan
+            if telemetry is not None:
+                telemetry.count('search.swaps_unbalanced', np.count_nonzero(too_unbalanced))
+        if np.isnan(trial_errors).all():
+            return False
+        candidate, position = np.unravel_index(np.nanargmin(trial_errors), trial_errors.shape)
+        if not trial_errors[candidate, position] < self.db_error:
+            return False
+        # the draws scored directly are recomputed from the swapped design before the swap is made, so the chain's
+        # DB-error only goes down
+        if not self.state.commit(position, candidates[candidate], candidate_factors[:, candidate],
+                                 accept=lambda d_errors: _nanmean_last(d_errors) < self.db_error):
+            if telemetry is not None:
+                telemetry.count('search.swaps_unconfirmed')
+            return False
+
+        self.ids[position] = candidate_ids[candidate]
+        self.diagnostics.swap(position, self.store.codes(candidate_ids[candidate:candidate + 1])[0])
+        self.db_error = self.state.db_error
+        if telemetry is not None:
+            telemetry.count('search.swaps')
+        return True
+
+
+## Modified Fedorov exchange search - a single FedorovChain from one random start
+# The search stops after max_seconds_without_improvement (20 hours in modfederov.R) or max_iterations.
+# on_improvement(ids, design, db_error) is called after every accepted swap. With telemetry (telemetry.Telemetry)
+# the chain's counters are kept and progress records (iterations per second, DB-error) are written periodically.
+# Returns a dict with the ChoiceSetIDs, the design matrix (n_sets, 3, K), its DB-error and the trace of
+# (seconds, DB-error) improvements.
+def modified_fedorov(store, draws, n_sets=48, start_ids=None, rng=None, max_seconds_without_improvement=60 * 1200,
+                     max_iterations=None, candidates_per_iteration=1, on_improvement=None, report=print, coding=None,
+                     telemetry=None):
+    rng = np.random.default_rng(rng)
+    coding = search_coding(store, coding)
+    ids = random_start(store, n_sets, draws, rng, coding=coding) if start_ids is None else start_ids
+    chain = FedorovChain(store, draws, ids, rng, candidates_per_iteration, coding)
+
+    started = time.perf_counter()
+    last_improvement = started
+    trace = [(0.0, chain.db_error)]
+    while time.perf_counter() - last_improvement < max_seconds_without_improvement:
+        if max_iterations is not None and chain.iteration >= max_iterations:
+            break
+        improved = chain.step(telemetry)
+        if telemetry is not None:
+            telemetry.progress('search', chain.iteration, max_iterations, db_error=chain.db_error)
+        if not improved:
+            continue
+        last_improvement = time.perf_counter()
+        trace.append((last_improvement - started, chain.db_error))
+        if report is not None:
+            report(f"New candidate found at iteration {chain.iteration} with DB-error {chain.db_error:.6g} "
+                   f"(D-efficiency {1 / chain.db_error:.6g})")
+        if on_improvement is not None:
+            on_improvement(chain.ids.copy(), chain.design.copy(), chain.db_error)
+
+    return {'ids': chain.ids, 'design': chain.design, 'db_error': chain.db_error, 'trace': trace}
+
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    store = CandidateStore(os.path.join(here, 'data', 'candidate_store_additional_conditions_met'))
+    coding = search_coding(store)
+    draws = prior_draws(25, coding=coding)
+
+    # save the latest design on every improvement, as modfederov.R does
+    def save_design(ids, design, error):
+        design_frame(design, coding).to_csv(os.path.join(here, 'latest_design_with_additional_cost_constraints.csv'),
+                                            index=False)
+
+    result = modified_fedorov(store, draws, n_sets=48, on_improvement=save_design, coding=coding)
+    print(f"Final DB-error {result['db_error']:.6g} after {len(result['trace']) - 1} improvements")
@@ -0,0 +1,370 @@
+## Vectorised enumeration of valid choice sets (pairs of profiles)
+# Replaces the df_design.iloc double loop in the full factorial scripts.
+# Profiles are held as an integer matrix of level codes and blocks of pairs are checked at once with the
+# compiled pair rules of a DesignSpec (see constraints.py), visiting pairs in exactly the same (i, j > i)
+# order as the original loop so ChoiceSetIDs are unchanged.
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+## Pair enumeration with the cost attribute factored out
+# Cost only enters the pair rules through Dominance (rules.base_rules is set), so a pair of profiles is valid when
+# its non-cost parts pass the other rules and its two cost levels are allowed by the dominance relation of the
+# non-cost parts (neither dominates: any costs; one dominates: it must cost strictly more; equal: none). Pairs of
+# non-cost profiles are enumerated once with the base rules and each one is expanded into its permitted
+# (cost1, cost2) combinations from a small table keyed by that relation - with 4 cost levels that is 16x fewer
+# pair checks. Profiles are ordered by non-cost part then cost, so the expanded pairs are put back in (i, j) order
+# arithmetically and the result is identical to checking every pair.
+class _CostFactoredPairs:
+    def __init__(self, profiles, rules, profile_mask):
+        self.rules = rules.base_rules
+        self.base_profiles, base_of = np.unique(profiles[:, :-1], axis=0, return_inverse=True)
+        self.base_of = base_of.ravel()
+        cost = profiles[:, -1].astype(np.int64)
+        self.n_costs = int(cost.max()) + 1 if len(cost) else 0
+
+        # profile row of every (non-cost profile, cost level), -1 where there is no (unmasked) profile
+        self.rows = np.full((len(self.base_profiles), self.n_costs), -1, dtype=np.int64)
+        self.rows[self.base_of, cost] = np.where(profile_mask, np.arange(len(profiles)), -1)
+        self.base_features = self.rules.pair_features(self.base_profiles)
+        # the rule that the cost expansion stands in for, in telemetry counters
+        self.cost_label = next((label for label in rules.pair_labels if label not in self.rules.pair_labels), 'cost')
+
+        # permitted (cost1, cost2) level codes by dominance relation: neither, left dominates, right dominates, equal
+        c1 = np.arange(self.n_costs)[:, None]
+        c2 = np.arange(self.n_costs)[None, :]
+        self.allowed = np.stack([
+            np.ones((self.n_costs, self.n_costs), dtype=bool),
+            c1 > c2,
+            c1 < c2,
+            np.zeros((self.n_costs, self.n_costs), dtype=bool),
+        ])
+
+    ## The factoring only applies when profiles are ordered by non-cost part then cost (as valid_profiles is)
+    @classmethod
+    def build(cls, profiles, rules, profile_mask):
+        if rules.base_rules is None or not len(profiles):
+            return None
+        factored = cls(profiles, rules, profile_mask)
+        order = factored.base_of * factored.n_costs + profiles[:, -1]
+        if (np.diff(order) <= 0).any():
+            return None
+        return factored
+
+    ## Expand pairs of non-cost profiles (sorted by left then right) into valid profile pairs in (i, j) order
+    def _expand(self, left, right):
+        k = self.n_costs
+        ge = (self.base_profiles[left] >= self.base_profiles[right]).all(axis=1)
+        le = (self.base_profiles[left] <= self.base_profiles[right]).all(axis=1)
+        rows_left = self.rows[left][:, :, None]
+        rows_right = self.rows[right][:, None, :]
+        ok = self.allowed[ge + 2 * le] & (rows_left >= 0) & (rows_right >= 0)
+
+        # target position of (pair p, cost1, cost2): pairs with the same left profile form a group that is
+        # written cost1-major, i.e. ordered by (left, cost1, right, cost2) = (i, j)
+        group_start = np.searchsorted(left, left)
+        group_size = np.searchsorted(left, left, side='right') - group_start
+        position = (group_start * k * k + (np.arange(len(left)) - group_start) * k)[:, None, None] \
+            + np.arange(k)[None, :, None] * (group_size * k)[:, None, None] + np.arange(k)[None, None, :]
+        i = np.empty(len(left) * k * k, dtype=np.int64)
+        j = np.empty(len(left) * k * k, dtype=np.int64)
+        keep = np.empty(len(left) * k * k, dtype=bool)
+        i[position] = rows_left
+        j[position] = rows_right
+        keep[position] = ok
+        return i[keep], j[keep]
+
+    ## Same as _iter_row_blocks over the full profile rows [row_start, row_stop), in blocks of non-cost rows
+    # With telemetry the non-cost rules' counts are weighted by the number of profiles of each non-cost profile, so
+    # they count full profile pairs; pairs with the same non-cost part (never enumerated) and the cost combinations
+    # the expansion leaves out count as rejected by the cost rule. Counts are exact for the full row range and
+    # approximate for shards whose first or last non-cost profile straddles the range.
+    def iter_row_blocks(self, row_start, row_stop, block_size, telemetry=None):
+        if row_stop <= row_start:
+            return
+        base_start = self.base_of[row_start]
+        base_stop = self.base_of[row_stop - 1] + 1
+        base_mask = np.ones(len(self.base_profiles), dtype=bool)
+        weights = None
+        if telemetry is not None:
+            weights = (self.rows >= 0).sum(axis=1)
+            self._count_same_base(base_start, base_stop, weights, telemetry)
+        for left, right in _iter_row_blocks(self.base_features, self.rules, base_mask, base_start, base_stop, block_size,
+                                            telemetry=telemetry, weights=weights):
+            i, j = self._expand(left, right)
+            if telemetry is not None:
+                telemetry.count(f'pairs.rejected.{self.cost_label}', int(weights[left] @ weights[right]) - len(i))
+            # the first and last non-cost profiles can straddle the row range
+            start, stop = np.searchsorted(i, [row_start, row_stop])
+            yield i[start:stop], j[start:stop]
+
+    # pairs of profiles that differ only in cost, counted against the rules in the order _iter_row_blocks applies them
+    def _count_same_base(self, base_start, base_stop, weights, telemetry):
+        base = np.arange(base_start, base_stop)
+        n_pairs = weights[base] * (weights[base] - 1) // 2
+        telemetry.count('pairs.checked', int(n_pairs.sum()))
+        alive = np.ones(len(base), dtype=bool)
+        for k in _rule_order(self.rules):
+            features = self.base_features[k][base]
+            keep = self.rules.pair_rules[k].mask(features, features)
+            telemetry.count(f'pairs.rejected.{self.rules.pair_labels[k]}', int(n_pairs[alive & ~keep].sum()))
+            alive &= keep
+        telemetry.count(f'pairs.rejected.{self.cost_label}', int(n_pairs[alive].sum()))
+
+
+## Order in which _iter_row_blocks applies the pair rules - the first rule with an index (join), if any, then the rest
+def _rule_order(rules):
+    indexed = next((k for k, rule in enumerate(rules.pair_rules) if rule.join is not None), None)
+    if indexed is None:
+        return list(range(len(rules.pair_rules)))
+    return [indexed] + [k for k in range(len(rules.pair_rules)) if k != indexed]
+
+
+## Enumerate the valid pairs whose first profile is in rows [row_start, row_stop), one block of rows at a time
+# features are the per-profile pair rule features from rules.pair_features(profiles)
+# If a pair rule has an index (a join, e.g. GroupOverlap) the candidate pairs of each block come straight from
+# the index, otherwise the first rule is tested against every later profile. Either way the remaining rules
+# are only applied to the surviving pairs.
+# factored (a _CostFactoredPairs for the same profiles, or None) takes over when cost can be factored out.
+# With telemetry, counts the pairs checked and the pairs rejected by each rule (the first rule, in the order they are
+# applied, that a pair fails), each pair counted weights[i] * weights[j] times (once without weights).
+# yields (left, right) arrays for each block, in loop order
+def _iter_row_blocks(features, rules, profile_mask, row_start, row_stop, block_size, factored=None, telemetry=None,
+                     weights=None):
+    if factored is not None:
+        yield from factored.iter_row_blocks(row_start, row_stop, block_size, telemetry)
+        return
+    n = len(profile_mask)
+    all_profiles = profile_mask.all()
+    order = _rule_order(rules)
+    indexed = order[0] if order and rules.pair_rules[order[0]].join is not None else None
+    if indexed is not None:
+        join_pairs = rules.pair_rules[indexed].join(features[indexed])
+    remaining = order[1:]
+    if telemetry is not None:
+        weights = np.where(profile_mask, 1 if weights is None else weights, 0).astype(np.int64)
+        # total weight of the profiles after each row, so a block checks weights[rows] @ later[rows] pairs
+        later = np.cumsum(weights[::-1])[::-1] - weights
+
+    for start in range(row_start, row_stop, block_size):
+        stop = min(start + block_size, row_stop)
+        if telemetry is not None:
+            n_checked = int(weights[start:stop] @ later[start:stop])
+            telemetry.count('pairs.checked', n_checked)
+
+        if indexed is not None:
+            left, right = join_pairs(start, stop)
+            if not all_profiles:
+                keep = profile_mask[left] & profile_mask[right]
+                left = left[keep]
+                right = right[keep]
+        else:
+            rows = np.arange(start, stop)
+            cols = np.arange(start + 1, n)
+
+            # first rule on the whole block, upper triangle (j > i) and profile-level restrictions
+            mask = cols[None, :] > rows[:, None]
+            if rules.pair_rules:
+                mask &= rules.pair_rules[0].mask(features[0][rows][:, None, :], features[0][cols][None, :, :])
+            mask &= profile_mask[rows][:, None]
+            mask &= profile_mask[cols][None, :]
+
+            # np.nonzero walks the block in row-major order, i.e. i ascending then j ascending
+            r, c = np.nonzero(mask)
+            left = rows[r]
+            right = cols[c]
+
+        if telemetry is not None and rules.pair_rules:
+            n_left = int(weights[left] @ weights[right])
+            telemetry.count(f'pairs.rejected.{rules.pair_labels[order[0]]}', n_checked - n_left)
+
+        # remaining rules on the surviving pairs only
+        for k in remaining:
+            keep = rules.pair_rules[k].mask(features[k][left], features[k][right])
+            if telemetry is not None:
+                n_kept = int(weights[left[keep]] @ weights[right[keep]])
+                telemetry.count(f'pairs.rejected.{rules.pair_labels[k]}', n_left - n_kept)
+                n_left = n_kept
+            left = left[keep]
+            right = right[keep]
+
+        yield left, right
+
+
+## Collect the valid pairs for rows [row_start, row_stop) into two arrays
+def _enumerate_rows(features, rules, profile_mask, row_start, row_stop, block_size, factored=None):
+    blocks = list(_iter_row_blocks(features, rules, profile_mask, row_start, row_stop, block_size, factored))
+    if not blocks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks])
+
+
+## Enumerate all valid (i, j) profile pairs, i < j, in the order of the original double loop
+# profiles: (n, n_attributes) matrix of level codes, rules: CompiledRules from DesignSpec.compile()
+# The first pair rule is evaluated for a whole block of rows against every later profile with broadcast masks
+# (or, if a rule has an index such as GroupOverlap's, only the pairs the index lists are visited), the remaining
+# rules only on the pairs that survive it - so the most selective rule should come first.
+# profile_mask (optional boolean array) excludes profiles from every pair.
+# Returns two int64 arrays (left, right) of row positions in the profile table.
+def enumerate_valid_pairs(profiles, rules, profile_mask=None, block_size=256):
+    n = profiles.shape[0]
+    if profile_mask is None:
+        profile_mask = np.ones(n, dtype=bool)
+    profile_mask = np.asarray(profile_mask, dtype=bool)
+    factored = _CostFactoredPairs.build(profiles, rules, profile_mask)
+    return _enumerate_rows(rules.pair_features(profiles), rules, profile_mask, 0, max(n - 1, 0), block_size, factored)
+
+
+## A fixed-size chunk of enumerated choice sets
+# start_id is the ChoiceSetID of the first set in the chunk (IDs run from 1 in enumeration order),
+# left / right are the row positions of alternative 1 and 2 in the profile table
+ChoiceSetChunk = namedtuple('ChoiceSetChunk', ['start_id', 'left', 'right'])
+
+
+## Stream the valid pairs as ChoiceSetChunks of chunk_size sets (the last chunk may be smaller)
+# Same pairs in the same order as enumerate_valid_pairs, but only one chunk (plus one block of rows) is held
+# in memory at a time, so downstream writers can consume candidate sets of any size.
+# With telemetry (telemetry.Telemetry) the pair counters per rule are kept and progress records of the pairs checked
+# (with throughput and ETA) are written as the enumeration goes.
+def iter_valid_pair_chunks(profiles, rules, profile_mask=None, chunk_size=100000, block_size=256, telemetry=None):
+    n = profiles.shape[0]
+    if profile_mask is None:
+        profile_mask = np.ones(n, dtype=bool)
+    profile_mask = np.asarray(profile_mask, dtype=bool)
+    features = rules.pair_features(profiles)
+    factored = _CostFactoredPairs.build(profiles, rules, profile_mask)
+    if telemetry is not None:
+        n_unmasked = int(np.count_nonzero(profile_mask))
+        total = n_unmasked * (n_unmasked - 1) // 2
+        checked_before = telemetry.counters['pairs.checked']
+
+    next_id = 1
+    pending_left = []
+    pending_right = []
+    n_pending = 0
+    for left, right in _iter_row_blocks(features, rules, profile_mask, 0, max(n - 1, 0), block_size, factored,
+                                        telemetry):
+        if telemetry is not None:
+            telemetry.count('pairs.valid', len(left))
+            telemetry.progress('pair_enumeration', telemetry.counters['pairs.checked'] - checked_before, total,
+                               valid=telemetry.counters['pairs.valid'])
+        pending_left.append(left)
+        pending_right.append(right)
+        n_pending += len(left)
+        if n_pending < chunk_size:
+            continue
+        left = np.concatenate(pending_left)
+        right = np.concatenate(pending_right)
+        n_full = (len(left) // chunk_size) * chunk_size
+        for offset in range(0, n_full, chunk_size):
+            yield ChoiceSetChunk(next_id, left[offset:offset + chunk_size], right[offset:offset + chunk_size])
+            next_id += chunk_size
+        pending_left = [left[n_full:]]
+        pending_right = [right[n_full:]]
+        n_pending = len(left) - n_full
+
+    if n_pending:
+        yield ChoiceSetChunk(next_id, np.concatenate(pending_left), np.concatenate(pending_right))
+    if telemetry is not None:
+        telemetry.progress('pair_enumeration', telemetry.counters['pairs.checked'] - checked_before, total,
+                           force=True, valid=telemetry.counters['pairs.valid'])
+
+
+## Number of pairs (i, j > i) with i in rows [0, k), for each k in row_bounds
+def _pairs_before(n, row_bounds):
+    k = np.asarray(row_bounds, dtype=np.int64)
+    return k * (n - 1) - k * (k - 1) // 2
+
+
+## Split the i range of an n-profile table into shards with (close to) equal numbers of pairs
+# row i pairs with n - i - 1 rows, so equal-sized slices of i would give the first shard far more work than the last
+# Returns a list of (row_start, row_stop) tuples covering [0, n - 1) in order.
+def balanced_shards(n, n_shards):
+    n_rows = max(n - 1, 0)
+    n_shards = max(1, min(n_shards, n_rows))
+    total = _pairs_before(n, n_rows)
+    cumulative = _pairs_before(n, np.arange(n_rows + 1))
+    targets = total * np.arange(1, n_shards) / n_shards
+    bounds = np.concatenate([[0], np.searchsorted(cumulative, targets), [n_rows]])
+    bounds = np.unique(bounds)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+# per-process state for the shard workers, set up once by _init_shard_worker
+_worker_state = {}
+
+
+## Attach a shard worker to the shared (read-only) profile matrix and compile the rules once per process
+def _init_shard_worker(shm_name, shape, dtype, spec, profile_mask):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    profiles = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    profiles.flags.writeable = False
+    rules = spec.compile()
+    _worker_state['shm'] = shm
+    _worker_state['rules'] = rules
+    _worker_state['features'] = rules.pair_features(profiles)
+    _worker_state['profile_mask'] = profile_mask
+    _worker_state['factored'] = _CostFactoredPairs.build(profiles, rules, profile_mask)
+
+
+## Enumerate one shard in a worker - returns the valid pairs and the time taken
+def _run_shard(shard):
+    row_start, row_stop, block_size = shard
+    started = time.perf_counter()
+    left, right = _enumerate_rows(_worker_state['features'], _worker_state['rules'], _worker_state['profile_mask'],
+                                  row_start, row_stop, block_size, _worker_state['factored'])
+    return left, right, time.perf_counter() - started
+
+
+## Parallel version of enumerate_valid_pairs - same pairs in the same order
+# The i range is split into balanced shards (several per worker so fast workers pick up more) which run on a
+# process pool. The profile matrix is placed in shared memory once and every worker attaches to it read-only,
+# so it is never pickled per task. Shard results are merged in shard order, which keeps the ChoiceSetID order
+# of the serial run. Per-shard throughput is passed to report (print by default, None to disable).
+# spec is the DesignSpec (rules are compiled in each worker), profiles its valid level codes.
+def enumerate_valid_pairs_parallel(spec, profiles, profile_mask=None, n_workers=None, n_shards=None,
+                                   block_size=256, report=print):
+    n = profiles.shape[0]
+    n_workers = n_workers or os.cpu_count() or 1
+    n_shards = n_shards or 4 * n_workers
+    if profile_mask is None:
+        profile_mask = np.ones(n, dtype=bool)
+    profile_mask = np.asarray(profile_mask, dtype=bool)
+    shards = balanced_shards(n, n_shards)
+
+    profiles = np.ascontiguousarray(profiles)
+    shm = shared_memory.SharedMemory(create=True, size=max(profiles.nbytes, 1))
+    try:
+        np.ndarray(profiles.shape, dtype=profiles.dtype, buffer=shm.buf)[:] = profiles
+
+        started = time.perf_counter()
+        left_shards = []
+        right_shards = []
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_shard_worker,
+                                 initargs=(shm.name, profiles.shape, profiles.dtype, spec, profile_mask)) as pool:
+            tasks = [(row_start, row_stop, block_size) for row_start, row_stop in shards]
+            # map yields results in shard order regardless of which worker finishes first
+            for s, (left, right, seconds) in enumerate(pool.map(_run_shard, tasks)):
+                left_shards.append(left)
+                right_shards.append(right)
+                if report is not None:
+                    row_start, row_stop = shards[s]
+                    n_pairs = int(_pairs_before(n, row_stop) - _pairs_before(n, row_start))
+                    report(f"Shard {s + 1}/{len(shards)}: rows {row_start}-{row_stop - 1}, {n_pairs} pairs checked, "
+                           f"{len(left)} valid in {seconds:.2f}s ({n_pairs / max(seconds, 1e-9):,.0f} pairs/s)")
+        if report is not None:
+            n_total = int(_pairs_before(n, max(n - 1, 0)))
+            elapsed = time.perf_counter() - started
+            report(f"Checked {n_total} pairs on {n_workers} workers in {elapsed:.2f}s ({n_total / max(elapsed, 1e-9):,.0f} pairs/s)")
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if not left_shards:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(left_shards), np.concatenate(right_shards)
@@ -0,0 +1,103 @@
+## Lazy sampling of valid choice sets without enumerating them to disk
+# A PairSampler counts the valid partners j > i of every profile i once (one pass over the pairs, keeping only
+# the counts), so the valid pairs can be ranked in enumeration order: ChoiceSetID k is partner number
+# k - 1 - offsets[i] of the row i with offsets[i] < k <= offsets[i + 1]. Unranking a ChoiceSetID only checks the
+# rules for its own row against the other profiles, so sampling costs O(n_profiles) per sampled row and memory
+# is O(n_profiles) - design spaces with hundreds of millions of valid pairs never have to be materialised.
+#
+# ChoiceSetIDs are the same as in a candidate store written from the same spec, and the sampler has the same
+# read interface as CandidateStore (spec, len, profile_ids, codes, values, sample_ids, chunk), so it can be
+# passed to the modified Fedorov search in place of a store.
+import numpy as np
+
+from candidate_sinks import wide_table
+from pair_enumeration import ChoiceSetChunk, _CostFactoredPairs, _iter_row_blocks
+
+
+class PairSampler:
+    def __init__(self, spec, profiles=None, profile_mask=None, block_size=256):
+        self.spec = spec
+        self.rules = spec.compile()
+        self.profiles = spec.valid_profiles(self.rules) if profiles is None else np.asarray(profiles)
+        n = self.profiles.shape[0]
+        self.profile_mask = np.ones(n, dtype=bool) if profile_mask is None else np.asarray(profile_mask, dtype=bool)
+        self.block_size = block_size
+        self.features = self.rules.pair_features(self.profiles)
+
+        # valid partners j > i of every profile, and the ChoiceSetID offset of each profile's first pair
+        self.partner_counts = np.zeros(n, dtype=np.int64)
+        factored = _CostFactoredPairs.build(self.profiles, self.rules, self.profile_mask)
+        for left, _ in _iter_row_blocks(self.features, self.rules, self.profile_mask, 0, max(n - 1, 0), block_size,
+                                        factored):
+            self.partner_counts += np.bincount(left, minlength=n)
+        self.offsets = np.concatenate([[0], np.cumsum(self.partner_counts)])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def n_choice_sets(self):
+        return len(self)
+
+    ## Boolean mask (len(rows), n_profiles) of the valid partners j > i of each row i
+    def _partner_mask(self, rows):
+        n = self.profiles.shape[0]
+        cols = np.arange(n)
+        mask = cols[None, :] > rows[:, None]
+        mask &= self.profile_mask[rows][:, None]
+        mask &= self.profile_mask[None, :]
+        for rule, features in zip(self.rules.pair_rules, self.features):
+            mask &= rule.mask(features[rows][:, None, :], features[None, :, :])
+        return mask
+
+    # profile ids (rows of self.profiles) of alternative 1 and 2 for the given ChoiceSetIDs (1-based)
+    def profile_ids(self, choice_set_ids):
+        index = np.asarray(choice_set_ids, dtype=np.int64).ravel() - 1
+        if index.size and (index.min() < 0 or index.max() >= len(self)):
+            raise IndexError(f"ChoiceSetIDs must be between 1 and {len(self)}")
+        rows = np.searchsorted(self.offsets, index, side='right') - 1
+        ranks = index - self.offsets[rows]
+        partners = np.empty(len(index), dtype=np.int64)
+
+        # unrank one block of distinct rows at a time: nonzero lists each row's partners in order, so the
+        # partner of rank r in the b-th row of the block is at position (partners of earlier rows) + r
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        for start in range(0, len(unique_rows), self.block_size):
+            block = unique_rows[start:start + self.block_size]
+            _, cols = np.nonzero(self._partner_mask(block))
+            block_offsets = np.concatenate([[0], np.cumsum(self.partner_counts[block])])
+            selected = (inverse >= start) & (inverse < start + len(block))
+            partners[selected] = cols[block_offsets[inverse[selected] - start] + ranks[selected]]
+        return np.stack([rows, partners], axis=1).reshape(np.shape(choice_set_ids) + (2,))
+
+    # level codes, shape (n, 2, n_attributes)
+    def codes(self, choice_set_ids):
+        return self.profiles[self.profile_ids(choice_set_ids)]
+
+    # level values, shape (n, 2, n_attributes)
+    def values(self, choice_set_ids):
+        ids = self.profile_ids(choice_set_ids)
+        return self.spec.decode(self.profiles[ids.ravel()]).reshape(ids.shape + (-1,))
+
+    # profile table with level values (df_design in the full factorial scripts)
+    def profile_table(self):
+        return self.spec.profile_table(self.profiles)
+
+    # uniformly sample n distinct ChoiceSetIDs (sorted) - the same ids as CandidateStore.sample_ids for the same rng
+    def sample_ids(self, n, rng=None):
+        rng = np.random.default_rng(rng)
+        if n > len(self):
+            raise ValueError(f"cannot sample {n} choice sets from {len(self)}")
+        return np.sort(rng.choice(len(self), size=n, replace=False)) + 1
+
+    # ChoiceSetChunk for consecutive ChoiceSetIDs, for the sinks in candidate_sinks.py
+    def chunk(self, start_id, n):
+        ids = self.profile_ids(np.arange(start_id, start_id + n))
+        return ChoiceSetChunk(start_id, ids[:, 0], ids[:, 1])
+
+    ## Wide table of n uniformly sampled choice sets, sorted by id - the Ngene candidate sample without
+    # enumerating every pair (NgeneSampleSink gives the same kind of sample from a full enumeration)
+    def sample_table(self, n, rng=None, id_column='choice situation'):
+        ids = self.sample_ids(min(n, len(self)), rng)
+        pairs = self.profile_ids(ids)
+        return wide_table(self.profile_table(), ids, pairs[:, 0], pairs[:, 1], id_column)
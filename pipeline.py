@@ -0,0 +1,259 @@
+## Command-line pipeline driven by a design-spec file, with every stage's output cached under a hash of its inputs
+#   python pipeline.py additional_cost_constraints                 a spec from design_specs.py
+#   python pipeline.py my_design.json --stages candidates ngene    a design-spec file, only some stages
+#   python pipeline.py base --dump-spec my_design.json             write a spec as a file to edit
+#
+# A design-spec file is json:
+#   {"design": DesignSpec.to_dict(),             attributes, profile rules, pair rules, cost attribute
+#    "coding": DesignCoding.to_dict(),           design columns of the search (default MODFEDEROV_CODING without
+#                                                the columns the profiles make collinear; must be full rank)
+#    "priors": PriorSpec.to_dict(),              priors by design column (default MODFEDEROV_PRIORS)
+#    "ngene": {"max_sets": ..., "seed": ...,     the Ngene candidate sample, stratified by overlap pattern and
+#              "stratified": ...},               cost pair if set (candidate_sinks.overlap_cost_strata)
+#    "search": {"n_draws": ..., ...}}            prior draws and multi_start_search settings, see DEFAULT_SETTINGS
+#
+# Stages and what each one's cache key covers (a stage's key includes the inputs of the stages it is built from):
+#   profiles    attributes, profile rules              profiles.npy (level codes), profiles.csv (level values)
+#   candidates  + pair rules                           candidate store (candidate_store.py)
+#   long        candidates                             long.csv - idefix candidates for modfederov.R
+#   ngene       candidates + ngene settings            ngene.csv - Ngene candidate sample
+#   design      candidates + coding, priors, search    best_design.csv and the search checkpoints (search.py)
+# so editing a pair rule reuses the cached profiles and editing the priors reuses the candidate store. Stages are
+# built in <cache_dir>/<stage>/<key>.partial and renamed to <key> when complete; an interrupted design search
+# resumes from its checkpoints the next time. Each stage keeps its telemetry (telemetry.py) as telemetry.jsonl.
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from candidate_sinks import LongCsvSink, NgeneSampleSink, overlap_cost_strata, write_choice_sets
+from candidate_store import CandidateStore, CandidateStoreWriter
+from coding import DesignCoding
+from constraints import DesignSpec
+from design_specs import SPECS
+from modfed import MODFEDEROV_CODING, MODFEDEROV_PRIORS
+from pair_enumeration import iter_valid_pair_chunks
+from priors import PriorSpec
+from search import multi_start_search
+from telemetry import Telemetry
+
+STAGES = ('profiles', 'candidates', 'long', 'ngene', 'design')
+
+# stages each stage is built from
+UPSTREAM = {'profiles': (), 'candidates': ('profiles',), 'long': ('candidates',), 'ngene': ('candidates',),
+            'design': ('candidates',)}
+
+# files a stage produces, copied (hard-linked where possible) to the output directory
+STAGE_FILES = {'profiles': ['profiles.csv'], 'candidates': [], 'long': ['long.csv'], 'ngene': ['ngene.csv'],
+               'design': ['best_design.csv']}
+
+DEFAULT_SETTINGS = {
+    'ngene': {'max_sets': 500000, 'seed': 0, 'stratified': False},
+    'search': {
+        'n_draws': 25,
+        'draw_method': 'halton',
+        'draw_seed': 0,
+        'n_chains': 8,
+        'n_workers': None,
+        'time_budget_seconds': 3600,
+        'n_sets': 48,
+        'seed': 0,
+        'candidates_per_iteration': 1,
+        'max_iterations_without_improvement': None,
+        'max_seconds_without_improvement': 600,
+        'max_imbalance': None,
+        'cache_mb': 64,
+    },
+}
+
+# bump when a stage's output changes for the same inputs, so old cache entries are not reused
+CACHE_VERSION = 1
+META_FILE = 'stage.json'
+
+
+## Design-spec config from a json file or the name of a spec in design_specs.py, with defaults filled in
+# Every part is normalised through its from_dict / to_dict, so equivalent files give the same cache keys. A coding
+# whose columns are linearly dependent over the spec's profiles (every information matrix singular) is rejected.
+def load_config(spec):
+    if spec in SPECS:
+        config = {'design': SPECS[spec].to_dict()}
+    else:
+        with open(spec) as f:
+            config = json.load(f)
+    if 'design' not in config:
+        raise ValueError(f"{spec} has no 'design' section")
+    unknown = set(config) - {'design', 'coding', 'priors', *DEFAULT_SETTINGS}
+    if unknown:
+        raise ValueError(f"unknown sections {sorted(unknown)} in {spec}")
+    design = DesignSpec.from_dict(config['design'])
+    profiles = design.valid_profiles()
+    if 'coding' in config:
+        coding = DesignCoding.from_dict(config['coding'])
+        coding.check_full_rank(design, profiles)
+    else:
+        coding = MODFEDEROV_CODING.full_rank(design, profiles)
+    normalised = {
+        'design': design.to_dict(),
+        'coding': coding.to_dict(),
+        'priors': PriorSpec.from_dict(config['priors']).to_dict() if 'priors' in config
+        else MODFEDEROV_PRIORS.to_dict(),
+    }
+    for section, defaults in DEFAULT_SETTINGS.items():
+        settings = config.get(section, {})
+        unknown = set(settings) - set(defaults)
+        if unknown:
+            raise ValueError(f"unknown {section} settings {sorted(unknown)} - use {list(defaults)}")
+        normalised[section] = {**defaults, **settings}
+    return normalised
+
+
+## The inputs each stage depends on
+def stage_inputs(config):
+    design = config['design']
+    profiles = {'attributes': design['attributes'], 'profile_rules': design['profile_rules']}
+    candidates = {'profiles': profiles, 'pair_rules': design['pair_rules'], 'cost_attribute': design['cost_attribute']}
+    # the number of workers and the cache size do not change the design found
+    search = {key: value for key, value in config['search'].items() if key not in ('n_workers', 'cache_mb')}
+    return {
+        'profiles': profiles,
+        'candidates': candidates,
+        'long': {'candidates': candidates},
+        'ngene': {'candidates': candidates, 'ngene': config['ngene']},
+        'design': {'candidates': candidates, 'coding': config['coding'], 'priors': config['priors'], 'search': search},
+    }
+
+
+def stage_key(stage, inputs):
+    text = json.dumps({'stage': stage, 'version': CACHE_VERSION, 'inputs': inputs})
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+## Build functions - build(config, paths, out, telemetry) writes the stage's output to the directory out,
+# paths holds the cache directories of the stages it is built from
+def _build_profiles(config, paths, out, telemetry):
+    spec = DesignSpec.from_dict(config['design'])
+    profiles = spec.valid_profiles(spec.compile(), telemetry)
+    np.save(os.path.join(out, 'profiles.npy'), profiles)
+    spec.profile_table(profiles).to_csv(os.path.join(out, 'profiles.csv'), index=False)
+    telemetry.emit_counters('profiles.')
+
+
+def _build_candidates(config, paths, out, telemetry):
+    spec = DesignSpec.from_dict(config['design'])
+    profiles = np.load(os.path.join(paths['profiles'], 'profiles.npy'))
+    chunks = iter_valid_pair_chunks(profiles, spec.compile(), chunk_size=100000, telemetry=telemetry)
+    write_choice_sets(chunks, [CandidateStoreWriter(out, spec, profiles)])
+    telemetry.emit_counters('pairs.')
+
+
+def _build_long(config, paths, out, telemetry):
+    store = CandidateStore(paths['candidates'])
+    write_choice_sets(store.iter_chunks(), [LongCsvSink(os.path.join(out, 'long.csv'), store.profile_table())])
+
+
+def _build_ngene(config, paths, out, telemetry):
+    store = CandidateStore(paths['candidates'])
+    settings = config['ngene']
+    strata = None
+    if settings['stratified']:
+        strata = overlap_cost_strata(DesignSpec.from_dict(config['design']), store.profiles)
+    sink = NgeneSampleSink(os.path.join(out, 'ngene.csv'), store.profile_table(), settings['max_sets'],
+                           settings['seed'], strata=strata)
+    write_choice_sets(store.iter_chunks(), [sink])
+
+
+def _build_design(config, paths, out, telemetry):
+    settings = dict(config['search'])
+    coding = DesignCoding.from_dict(config['coding'])
+    draws = PriorSpec.from_dict(config['priors']).draws(settings.pop('n_draws'), settings.pop('draw_method'),
+                                                        settings.pop('draw_seed'), columns=coding.names)
+    multi_start_search(paths['candidates'], out, draws, coding=coding, report=telemetry.report, **settings)
+
+
+BUILDERS = {'profiles': _build_profiles, 'candidates': _build_candidates, 'long': _build_long,
+            'ngene': _build_ngene, 'design': _build_design}
+
+
+## Run the stages (and the stages they are built from), reusing cached outputs - returns {stage: cache directory}
+# force lists stages to rebuild even if cached. With output_dir the files each requested stage produces are
+# copied there as <name>_<file>.
+def run_pipeline(config, stages=STAGES, cache_dir='cache', output_dir=None, name='design', force=(), report=print,
+                 progress_every_seconds=10, profile=False):
+    inputs = stage_inputs(config)
+    paths = {}
+
+    def run(stage):
+        if stage in paths:
+            return
+        for upstream in UPSTREAM[stage]:
+            run(upstream)
+        key = stage_key(stage, inputs[stage])
+        path = os.path.join(cache_dir, stage, key)
+        if stage in force and os.path.exists(path):
+            shutil.rmtree(path)
+        if os.path.exists(os.path.join(path, META_FILE)):
+            if report is not None:
+                report(f"{stage}: cached in {path}")
+            paths[stage] = path
+            return
+
+        partial = path + '.partial'
+        if stage in force and os.path.exists(partial):
+            shutil.rmtree(partial)
+        os.makedirs(partial, exist_ok=True)
+        if report is not None:
+            report(f"{stage}: building in {partial}")
+        started = time.perf_counter()
+        with Telemetry(os.path.join(partial, 'telemetry.jsonl'), every_seconds=progress_every_seconds, report=report,
+                       profile_dir=partial if profile else None) as telemetry:
+            with telemetry.stage(stage):
+                BUILDERS[stage](config, paths, partial, telemetry)
+        with open(os.path.join(partial, META_FILE), 'w') as f:
+            json.dump({'stage': stage, 'key': key, 'inputs': inputs[stage],
+                       'seconds': time.perf_counter() - started}, f, indent=1)
+        os.replace(partial, path)
+        paths[stage] = path
+
+    for stage in stages:
+        run(stage)
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        for stage in stages:
+            for file_name in STAGE_FILES[stage]:
+                target = os.path.join(output_dir, f'{name}_{file_name}')
+                if os.path.exists(target):
+                    os.remove(target)
+                try:
+                    os.link(os.path.join(paths[stage], file_name), target)
+                except OSError:
+                    shutil.copyfile(os.path.join(paths[stage], file_name), target)
+                if report is not None:
+                    report(f"{stage}: {target}")
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build candidate sets and designs from a design-spec file")
+    parser.add_argument('spec', help=f"design-spec json file, or one of {list(SPECS)}")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help="stages to run (with the stages they need)")
+    parser.add_argument('--cache-dir', default='cache')
+    parser.add_argument('--output-dir', help="copy the stage outputs here as <name>_<file>")
+    parser.add_argument('--name', help="output file prefix (default: the spec name)")
+    parser.add_argument('--force', nargs='+', choices=STAGES, default=[], help="rebuild these stages")
+    parser.add_argument('--profile', action='store_true', help="save a cProfile of every stage built")
+    parser.add_argument('--dump-spec', metavar='PATH', help="write the spec with its defaults as json and exit")
+    args = parser.parse_args()
+
+    config = load_config(args.spec)
+    if args.dump_spec:
+        with open(args.dump_spec, 'w') as f:
+            json.dump(config, f, indent=2)
+        raise SystemExit(0)
+    name = args.name or os.path.splitext(os.path.basename(args.spec))[0]
+    run_pipeline(config, args.stages, args.cache_dir, args.output_dir, name, args.force, profile=args.profile)
@@ -0,0 +1,178 @@
+## Prior distributions and prior draws for Bayesian design evaluation
+# A PriorSpec declares one distribution per design column. Draws are generated by mapping points of the unit cube
+# through each distribution's inverse CDF, either from plain pseudo-random numbers (as runif / rnorm in
+# modfederov.R), a scrambled Halton sequence, or a scrambled Sobol sequence (needs scipy). Quasi-random points
+# cover the prior far more evenly, so the DB-error converges with many fewer draws.
+#
+# Every draw is evaluated in one batched pass (efficiency.py), and adaptive_draws doubles the number of draws
+# only until the DB-error estimate of a design stops moving.
+from statistics import NormalDist
+
+import numpy as np
+
+from efficiency import d_errors
+
+
+## Prior distributions - transform(u) maps uniform (0, 1) points to draws, mean is the distribution's mean
+class Uniform:
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    @property
+    def mean(self):
+        return (self.low + self.high) / 2
+
+    # json-compatible description (see prior_from_dict)
+    def to_dict(self):
+        return {'type': 'Uniform', 'low': self.low, 'high': self.high}
+
+    def transform(self, u):
+        return self.low + (self.high - self.low) * u
+
+
+class Normal:
+    def __init__(self, mean=0.0, sd=1.0):
+        self.mean = mean
+        self.sd = sd
+
+    def to_dict(self):
+        return {'type': 'Normal', 'mean': self.mean, 'sd': self.sd}
+
+    def transform(self, u):
+        # NormalDist.inv_cdf is exact to double precision; there are only as many calls as draws
+        inv_cdf = np.vectorize(NormalDist(self.mean, self.sd).inv_cdf, otypes=[np.float64])
+        tiny = np.finfo(np.float64).tiny
+        return inv_cdf(np.clip(u, tiny, 1 - np.finfo(np.float64).epsneg))
+
+
+class Fixed:
+    def __init__(self, value):
+        self.value = value
+
+    @property
+    def mean(self):
+        return self.value
+
+    def to_dict(self):
+        return {'type': 'Fixed', 'value': self.value}
+
+    def transform(self, u):
+        return np.full(np.shape(u), self.value, dtype=np.float64)
+
+
+DISTRIBUTIONS = {distribution.__name__: distribution for distribution in (Uniform, Normal, Fixed)}
+
+
+## Distribution from its to_dict() description, e.g. {'type': 'Uniform', 'low': -1, 'high': 0}
+def prior_from_dict(data):
+    data = dict(data)
+    distribution = data.pop('type')
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"unknown prior distribution {distribution!r} - use one of {list(DISTRIBUTIONS)}")
+    return DISTRIBUTIONS[distribution](**data)
+
+
+def _primes(n):
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+## First n points (n, dim) of a scrambled Halton sequence
+# each dimension uses the next prime base, and every digit position gets its own random permutation of the digits
+# (random digit scrambling), which removes the correlation between the higher dimensions of the plain sequence.
+# Points do not depend on n, so the first n points of a longer sequence with the same rng are the same.
+def scrambled_halton(n, dim, rng=None):
+    rng = np.random.default_rng(rng)
+    points = np.empty((n, dim))
+    for d, base in enumerate(_primes(dim)):
+        n_digits = int(np.ceil(53 * np.log(2) / np.log(base)))
+        permutations = np.array([rng.permutation(base) for _ in range(n_digits)])
+        index = np.arange(1, n + 1)
+        u = np.zeros(n)
+        scale = 1.0 / base
+        for digit in range(n_digits):
+            u += permutations[digit, index % base] * scale
+            index //= base
+            scale /= base
+        points[:, d] = u
+    return points
+
+
+## First n points (n, dim) of a scrambled Sobol sequence (scipy is an optional dependency)
+def scrambled_sobol(n, dim, rng=None):
+    try:
+        from scipy.stats import qmc
+    except ImportError as e:
+        raise ImportError("Sobol draws need scipy - install it or use method='halton'") from e
+    sampler = qmc.Sobol(dim, scramble=True, seed=np.random.default_rng(rng))
+    # Sobol points are balanced in blocks of powers of two - take the next block and keep the first n
+    return sampler.random_base2(max(int(np.ceil(np.log2(max(n, 1)))), 0))[:n]
+
+
+UNIT_CUBE_SAMPLERS = {
+    'pseudo': lambda n, dim, rng=None: np.random.default_rng(rng).random((n, dim)),
+    'halton': scrambled_halton,
+    'sobol': scrambled_sobol,
+}
+
+
+## Declarative prior - one distribution per design column, in design column order
+class PriorSpec:
+    def __init__(self, priors):
+        self.priors = dict(priors)
+
+    @property
+    def names(self):
+        return list(self.priors)
+
+    ## json-compatible description, by design column (see pipeline.py)
+    def to_dict(self):
+        return {name: prior.to_dict() for name, prior in self.priors.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({name: prior_from_dict(prior) for name, prior in data.items()})
+
+    ## Draws (n_draws, K) by method 'pseudo', 'halton' or 'sobol'
+    # columns selects (and orders) the design columns to draw for, e.g. when a coding drops columns
+    def draws(self, n_draws, method='halton', rng=None, columns=None):
+        if method not in UNIT_CUBE_SAMPLERS:
+            raise ValueError(f"unknown draw method {method!r} - use one of {list(UNIT_CUBE_SAMPLERS)}")
+        columns = self._columns(columns)
+        u = UNIT_CUBE_SAMPLERS[method](n_draws, len(columns), rng)
+        return np.column_stack([self.priors[c].transform(u[:, k]) for k, c in enumerate(columns)])
+
+    ## Prior means (K,) of the design columns
+    def means(self, columns=None):
+        return np.array([self.priors[c].mean for c in self._columns(columns)], dtype=np.float64)
+
+    def _columns(self, columns):
+        columns = self.names if columns is None else list(columns)
+        missing = [c for c in columns if c not in self.priors]
+        if missing:
+            raise KeyError(f"no prior for design columns {missing}")
+        return columns
+
+
+## Draws for a design chosen adaptively: start with min_draws and double until the DB-error estimate changes by
+# less than rtol (relative) between doublings, or max_draws is reached
+# Halton and Sobol draws are nested, so each doubling only evaluates the new draws.
+# Returns (draws, db_error) - the draws can be passed on to the exchange searches.
+def adaptive_draws(design, priors, rtol=0.005, min_draws=16, max_draws=4096, method='halton', rng=None, columns=None):
+    all_draws = priors.draws(max_draws, method, rng, columns)
+    errors = np.empty(0)
+    n_draws = min(min_draws, max_draws)
+    previous = np.nan
+    while True:
+        errors = np.concatenate([errors, d_errors(design, all_draws[len(errors):n_draws])])
+        estimate = np.nan if np.isnan(errors).all() else float(np.nanmean(errors))
+        if abs(estimate - previous) <= rtol * abs(estimate) or n_draws >= max_draws:
+            return all_draws[:n_draws], estimate
+        previous = estimate
+        n_draws = min(2 * n_draws, max_draws)
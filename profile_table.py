@@ -0,0 +1,64 @@
+## Per-profile lookup tables shared by the design searches
+# Every candidate choice set is a pair of profiles from the same table of valid profiles plus the no choice
+# alternative, so the coded profile vectors x_p and the utilities x_p . beta_r under every prior draw can be computed
+# once for all profiles. Design matrices, MNL probabilities and the per-set information factors (exchange.py) of
+# any candidate set are then gathered from the tables by profile id - scoring a candidate no longer codes its
+# attributes or multiplies its design matrix by the draws.
+# Utilities are held as float32 by default (profiles x draws, ~2 MB for 18,000 profiles and 25 draws); the
+# probabilities and factors built from them are float64.
+import numpy as np
+
+from efficiency import mnl_from_utilities
+from exchange import information_factors
+
+
+class ProfileTable:
+    def __init__(self, coding, spec, profiles, draws, dtype=np.float32):
+        self.coding = coding
+        self.draws = np.atleast_2d(np.asarray(draws, dtype=np.float64))
+        # coded profiles (n_profiles, K) - level values and dummies, exact in float32 too
+        self.coded = coding.code_profiles(spec, profiles).astype(dtype)
+        # rows of every alternative that do not depend on the profiles (the ASCs, the no choice row) - (n_alts, K)
+        self.constant_rows = coding.stack(np.zeros((1, self.coded.shape[1])),
+                                          np.zeros((1, coding.n_profile_alts), dtype=np.int64))[0]
+        # utilities of every profile (n_draws, n_profiles) and of the constant rows (n_draws, n_alts)
+        self.utilities = (self.draws.astype(dtype) @ self.coded.T).astype(dtype)
+        self.constant_utilities = self.draws @ self.constant_rows.T
+
+    @property
+    def n_profiles(self):
+        return self.coded.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.coded.nbytes + self.utilities.nbytes
+
+    ## Design matrices (n_sets, n_alts, K) of choice sets given as (n_sets, n_profile_alts) profile ids
+    def design(self, profile_ids):
+        return self.coding.stack(self.coded, profile_ids)
+
+    ## Utilities (n_draws, n_sets, n_alts) of choice sets given as profile ids
+    def set_utilities(self, profile_ids):
+        profile_ids = np.asarray(profile_ids)
+        n_profile_alts = profile_ids.shape[1]
+        utility = np.empty((len(self.draws), profile_ids.shape[0], self.constant_rows.shape[0]))
+        utility[:, :, :n_profile_alts] = self.utilities[:, profile_ids]
+        utility[:, :, n_profile_alts:] = 0.0
+        utility += self.constant_utilities[:, None, :]
+        return utility
+
+    ## MNL choice probabilities (n_draws, n_sets, n_alts), as efficiency.mnl_probabilities
+    def probabilities(self, profile_ids):
+        return mnl_from_utilities(self.set_utilities(profile_ids))
+
+    ## Information factors (n_draws, n_sets, K, J), as exchange.information_factors
+    # design: the sets' design matrices if they have already been gathered
+    def factors(self, profile_ids, design=None):
+        if design is None:
+            design = self.design(profile_ids)
+        return information_factors(design, self.draws, self.probabilities(profile_ids))
+
+    ## Per-set information contributions (n_draws, n_sets, K, K), as efficiency.set_information
+    def set_information(self, profile_ids, design=None):
+        g = self.factors(profile_ids, design)
+        return np.einsum('rski,rsli->rskl', g, g)
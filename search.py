@@ -0,0 +1,249 @@
+## Parallel multi-start modified Fedorov search with checkpoint and resume
+# Runs many independent FedorovChains (modfed.py) from random starts on a process pool. Every worker opens the
+# candidate store once (memory-mapped, so the pages are shared read-only between processes) and each chain
+# periodically writes its design, random generator state and efficiency trace to checkpoint_dir. Running the
+# search again with the same checkpoint_dir resumes every unfinished chain exactly where it left off, so a
+# preempted job loses at most checkpoint_every_seconds of work per chain.
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from candidate_store import CandidateStore
+from information_cache import InformationCache
+from modfed import FedorovChain, design_frame, random_start, search_coding
+from telemetry import Telemetry
+
+SEARCH_FILE = 'search.json'
+DRAWS_FILE = 'draws.npy'
+
+
+def _checkpoint_path(checkpoint_dir, chain_id):
+    return os.path.join(checkpoint_dir, f'chain_{chain_id:03d}.json')
+
+
+def _progress_path(checkpoint_dir, chain_id):
+    return os.path.join(checkpoint_dir, f'chain_{chain_id:03d}.progress.jsonl')
+
+
+## Write json atomically - a preempted write never leaves a half-written checkpoint behind
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+## Run (or resume) one chain until it stops improving or the wall-clock deadline (time.time()) passes
+# A chain is finished when it has gone max_iterations_without_improvement iterations or
+# max_seconds_without_improvement seconds without an accepted swap; a chain stopped by the deadline is left
+# resumable. The chain's exchange state is refreshed at every checkpoint so the running chain and one rebuilt
+# from the checkpoint continue identically, and the recorded DB-error is the design's efficiency.db_error.
+# Returns the last checkpoint record.
+# With telemetry the chain's counters and periodic progress records (iterations per second, DB-error) are kept.
+# cache is an optional InformationCache shared with the other chains on this store. Every checkpoint carries the
+# design's diagnostics (level counts, overlap, dominated sets, imbalance - see diagnostics.py).
+def run_chain(store, draws, chain_id, seed, checkpoint_dir, deadline, n_sets=48, candidates_per_iteration=1,
+              max_iterations_without_improvement=None, max_seconds_without_improvement=None,
+              checkpoint_every_seconds=60, coding=None, telemetry=None, cache=None, max_imbalance=None):
+    path = _checkpoint_path(checkpoint_dir, chain_id)
+    if os.path.exists(path):
+        record = _read_json(path)
+        if record['done']:
+            return record
+        rng = np.random.default_rng()
+        rng.bit_generator.state = record['rng_state']
+        chain = FedorovChain(store, draws, record['ids'], rng, candidates_per_iteration, coding, cache, max_imbalance)
+        chain.iteration = record['iteration']
+    else:
+        rng = np.random.default_rng(seed)
+        ids = random_start(store, n_sets, draws, rng, coding=coding)
+        chain = FedorovChain(store, draws, ids, rng, candidates_per_iteration, coding, cache, max_imbalance)
+        record = {
+            'chain_id': chain_id,
+            'trace': [[0, 0.0, chain.db_error]],
+            'iterations_since_improvement': 0,
+            'seconds_since_improvement': 0.0,
+            'elapsed_seconds': 0.0,
+        }
+
+    started = time.perf_counter() - record['elapsed_seconds']
+    last_improvement = time.perf_counter() - record['seconds_since_improvement']
+    improved_at = chain.iteration - record['iterations_since_improvement']
+    last_checkpoint = time.perf_counter()
+    stage = f'chain_{chain_id:03d}'
+
+    def save(done, stop_reason=None):
+        chain.state.refresh()
+        chain.db_error = chain.state.db_error
+        now = time.perf_counter()
+        record.update({
+            'iteration': chain.iteration,
+            'ids': chain.ids.tolist(),
+            'db_error': chain.db_error,
+            'rng_state': chain.rng.bit_generator.state,
+            'iterations_since_improvement': chain.iteration - improved_at,
+            'seconds_since_improvement': now - last_improvement,
+            'elapsed_seconds': now - started,
+            'done': done,
+            'stop_reason': stop_reason,
+            'diagnostics': chain.diagnostics.report(),
+        })
+        _write_json(path, record)
+        if telemetry is not None:
+            telemetry.progress(stage, chain.iteration, force=True, db_error=chain.db_error, stop_reason=stop_reason)
+            if stop_reason is not None:
+                telemetry.emit_counters('search.')
+
+    while True:
+        if max_iterations_without_improvement is not None and chain.iteration - improved_at >= max_iterations_without_improvement:
+            save(True, 'no improvement (iterations)')
+            return record
+        if max_seconds_without_improvement is not None and time.perf_counter() - last_improvement >= max_seconds_without_improvement:
+            save(True, 'no improvement (seconds)')
+            return record
+        if time.time() >= deadline:
+            save(False, 'time budget')
+            return record
+
+        improved = chain.step(telemetry)
+        if telemetry is not None:
+            telemetry.progress(stage, chain.iteration, db_error=chain.db_error)
+        if improved:
+            last_improvement = time.perf_counter()
+            improved_at = chain.iteration
+            record['trace'].append([chain.iteration, last_improvement - started, chain.db_error])
+
+        if time.perf_counter() - last_checkpoint >= checkpoint_every_seconds:
+            save(False)
+            last_checkpoint = time.perf_counter()
+
+
+# per-process state for the chain workers, set up once by _init_chain_worker - the chains a worker runs share its
+# information cache
+_worker_state = {}
+
+
+def _init_chain_worker(store_path, draws, settings, coding, cache_mb):
+    _worker_state['store'] = CandidateStore(store_path)
+    _worker_state['draws'] = draws
+    _worker_state['settings'] = settings
+    _worker_state['coding'] = coding
+    _worker_state['cache'] = InformationCache(cache_mb * 2 ** 20) if cache_mb else None
+
+
+def _run_chain_task(task):
+    chain_id, seed, checkpoint_dir, deadline, turn_seconds, progress_every_seconds = task
+    deadline = min(deadline, time.time() + turn_seconds)
+    if progress_every_seconds is None:
+        return run_chain(_worker_state['store'], _worker_state['draws'], chain_id, seed, checkpoint_dir, deadline,
+                         coding=_worker_state['coding'], cache=_worker_state['cache'], **_worker_state['settings'])
+    with Telemetry(_progress_path(checkpoint_dir, chain_id), every_seconds=progress_every_seconds) as telemetry:
+        return run_chain(_worker_state['store'], _worker_state['draws'], chain_id, seed, checkpoint_dir, deadline,
+                         coding=_worker_state['coding'], telemetry=telemetry, cache=_worker_state['cache'],
+                         **_worker_state['settings'])
+
+
+## Run n_chains independent chains on n_workers processes for at most time_budget_seconds of wall-clock time
+# The first run in checkpoint_dir records the draws and search settings there; later runs with the same
+# checkpoint_dir resume from the checkpoints (draws may then be omitted, and must match if given).
+# coding is the design coding (by default MODFEDEROV_CODING without the columns the store's profiles make
+# collinear, see modfed.search_coding); its columns are recorded and must match on resume.
+# Chain seeds are spawned from seed, so every chain is reproducible. Chains run in turns on the pool: each turn
+# gives every unfinished chain an equal share of the time left, and a chain resumes from its checkpoint on its
+# next turn, so chains queued behind the first n_workers get their part of the budget too. Writes the best design
+# found so far to checkpoint_dir/best_design.csv and returns the chain records, best (lowest DB-error) first.
+# With progress_every_seconds every chain appends JSON-lines progress records and its counters to
+# checkpoint_dir/chain_<id>.progress.jsonl (see telemetry.py), so a long search can be followed while it runs.
+# Every worker process keeps an information cache of at most cache_mb MB (information_cache.py; 0 for none) for
+# the chains it runs; it does not change the results. max_imbalance limits the level imbalance of the designs
+# (see FedorovChain).
+def multi_start_search(store_path, checkpoint_dir, draws=None, n_chains=8, n_workers=None, time_budget_seconds=3600,
+                       n_sets=48, seed=0, candidates_per_iteration=1, max_iterations_without_improvement=None,
+                       max_seconds_without_improvement=None, checkpoint_every_seconds=60, report=print, coding=None,
+                       progress_every_seconds=None, cache_mb=64, max_imbalance=None):
+    if n_chains < 1:
+        raise ValueError(f"n_chains must be at least 1, got {n_chains}")
+    store = CandidateStore(store_path)
+    coding = search_coding(store, coding)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    search_path = os.path.join(checkpoint_dir, SEARCH_FILE)
+    draws_path = os.path.join(checkpoint_dir, DRAWS_FILE)
+
+    if os.path.exists(search_path):
+        saved_draws = np.load(draws_path)
+        if draws is not None and not np.array_equal(np.asarray(draws), saved_draws):
+            raise ValueError(f"draws differ from the ones saved in {checkpoint_dir} - use a new checkpoint_dir")
+        draws = saved_draws
+        search = _read_json(search_path)
+        if search['columns'] != coding.names:
+            raise ValueError(f"the search in {checkpoint_dir} uses design columns {search['columns']} - pass that coding")
+    else:
+        if draws is None:
+            raise ValueError("draws are required to start a new search")
+        draws = np.asarray(draws, dtype=np.float64)
+        np.save(draws_path, draws)
+        search = {
+            'n_chains': n_chains,
+            'seed': seed,
+            'columns': coding.names,
+            'settings': {
+                'n_sets': n_sets,
+                'candidates_per_iteration': candidates_per_iteration,
+                'max_iterations_without_improvement': max_iterations_without_improvement,
+                'max_seconds_without_improvement': max_seconds_without_improvement,
+                'checkpoint_every_seconds': checkpoint_every_seconds,
+                'max_imbalance': max_imbalance,
+            },
+        }
+        _write_json(search_path, search)
+
+    seeds = np.random.SeedSequence(search['seed']).spawn(search['n_chains'])
+    deadline = time.time() + time_budget_seconds
+    n_workers = n_workers or os.cpu_count() or 1
+    records = {}
+    pending = list(range(search['n_chains']))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_chain_worker,
+                             initargs=(store_path, draws, search['settings'], coding, cache_mb)) as pool:
+        while pending:
+            turn_seconds = max(deadline - time.time(), 0) * min(n_workers, len(pending)) / len(pending)
+            tasks = [(chain_id, seeds[chain_id], checkpoint_dir, deadline, turn_seconds, progress_every_seconds)
+                     for chain_id in pending]
+            for record in pool.map(_run_chain_task, tasks):
+                records[record['chain_id']] = record
+            pending = [chain_id for chain_id in pending if not records[chain_id]['done']]
+            if time.time() >= deadline:
+                break
+
+    if not records:
+        raise RuntimeError(f"no chain of the search in {checkpoint_dir} returned a result - nothing to write")
+    records = list(records.values())
+    records.sort(key=lambda r: np.inf if not np.isfinite(r['db_error']) else r['db_error'])
+    if report is not None:
+        for record in records:
+            report(f"Chain {record['chain_id']}: DB-error {record['db_error']:.6g} after {record['iteration']} "
+                   f"iterations ({'done, ' + record['stop_reason'] if record['done'] else 'resumable'})")
+
+    best = records[0]
+    design_frame(coding.store_design(store, best['ids']), coding).to_csv(
+        os.path.join(checkpoint_dir, 'best_design.csv'), index=False)
+    return records
+
+
+if __name__ == '__main__':
+    from modfed import prior_draws
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    store_path = os.path.join(here, 'data', 'candidate_store_additional_conditions_met')
+    coding = search_coding(CandidateStore(store_path))
+    records = multi_start_search(store_path, os.path.join(here, 'data', 'search_additional_conditions_met'),
+                                 draws=prior_draws(25, 0, coding=coding), n_chains=8, time_budget_seconds=60 * 1200,
+                                 max_seconds_without_improvement=60 * 60, coding=coding)
+    print(f"Best DB-error {records[0]['db_error']:.6g} (chain {records[0]['chain_id']})")
@@ -0,0 +1,205 @@
+## Parameter-recovery tests of a design with synthetic respondents
+# Before a design is fielded, simulate_choices lets synthetic respondents answer every choice set (two alternatives
+# and no choice) under known coefficients, and fit_mnl refits the MNL model to their choices. Repeating this many
+# times shows whether the design recovers the coefficients - the bias of the estimates, and how often the 95%
+# confidence interval covers the true value (coverage; about 0.95 when the design identifies a coefficient well).
+#   MNL         every respondent has the same coefficients (the prior means by default)
+#   mixed logit every respondent's coefficients are drawn from the priors (MODFEDEROV_PRIORS in modfederov.R),
+#               and the MNL estimates are compared with the prior means
+# Choices of all respondents are simulated in one batched pass per replication, and the MNL is fitted to a whole
+# batch of replications at once: the log-likelihood of a design only depends on how often each alternative of
+# each set was chosen, so a Newton-Raphson step for every replication is one batched solve. Batches run on a
+# process pool.
+#
+#   python simulation.py latest_design.csv --respondents 500 --replications 1000
+#   python simulation.py latest_design.csv --mixed --output recovery.csv
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from converters import FORMATS, read_design
+from design_specs import SPECS
+from efficiency import mnl_from_utilities
+from modfed import MODFEDEROV_CODING, MODFEDEROV_PRIORS
+
+
+## Chosen alternative of every respondent in every set - shape (n_respondents, n_sets)
+# betas is (K,) for MNL or (n_respondents, K) for respondent-specific coefficients (mixed logit)
+def simulate_choices(design, betas, n_respondents, rng):
+    betas = np.asarray(betas, dtype=np.float64)
+    if betas.ndim == 1:
+        p = mnl_from_utilities(design @ betas)[None]
+    else:
+        p = mnl_from_utilities(np.einsum('sjk,nk->nsj', design, betas))
+    u = rng.random((n_respondents, design.shape[0], 1))
+    return np.minimum((u > np.cumsum(p, axis=-1)).sum(axis=-1), design.shape[1] - 1)
+
+
+## How often each alternative of each set was chosen - shape (n_sets, n_alts)
+def choice_counts(choices, n_alts):
+    n_sets = choices.shape[1]
+    cells = (np.arange(n_sets) * n_alts + choices).ravel()
+    return np.bincount(cells, minlength=n_sets * n_alts).reshape(n_sets, n_alts)
+
+
+# log-likelihood of every data set (n_data,) for coefficients (n_data, K)
+def _log_likelihood(design, counts, beta):
+    utility = np.einsum('sjk,rk->rsj', design, beta)
+    utility -= utility.max(axis=-1, keepdims=True)
+    log_p = utility - np.log(np.exp(utility).sum(axis=-1, keepdims=True))
+    return (counts * log_p).sum(axis=(1, 2))
+
+
+# gradient (n_data, K) and Fisher information (n_data, K, K) of the MNL log-likelihood
+def _score_information(design, counts, beta):
+    p = mnl_from_utilities(np.einsum('sjk,rk->rsj', design, beta))
+    totals = counts.sum(axis=-1)
+    gradient = np.einsum('sjk,rsj->rk', design, counts - totals[..., None] * p)
+    centred = design[None] - np.matmul(p[:, :, None, :], design[None])
+    centred *= np.sqrt(totals[..., None] * p)[..., None]
+    return gradient, np.einsum('rsjk,rsjl->rkl', centred, centred)
+
+
+## MNL maximum likelihood for many data sets on the same design at once
+# counts: (n_data, n_sets, n_alts) choice counts. Newton-Raphson with step halving from zero, until the Newton
+# decrement is below tol. Returns the estimates and standard errors (n_data, K) and converged (n_data,).
+# Data sets without a finite maximum do not converge: when the coefficients separate the choices (every respondent
+# picks the alternative of highest utility, as with the cost range and prior means of modfederov.R) the
+# log-likelihood only approaches its supremum, and the information matrix at the last step is singular - its
+# condition number, scaled to unit diagonal, is above max_condition.
+def fit_mnl(design, counts, max_iterations=100, tol=1e-8, max_halvings=30, max_condition=1e10):
+    design = np.asarray(design, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    n_data, k = counts.shape[0], design.shape[-1]
+    beta = np.zeros((n_data, k))
+    log_likelihood = _log_likelihood(design, counts, beta)
+    converged = np.zeros(n_data, dtype=bool)
+    failed = np.zeros(n_data, dtype=bool)
+
+    for _ in range(max_iterations):
+        active = np.flatnonzero(~converged & ~failed)
+        if not len(active):
+            break
+        gradient, information = _score_information(design, counts[active], beta[active])
+        try:
+            step = np.linalg.solve(information, gradient[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(m, g, rcond=None)[0] for m, g in zip(information, gradient)])
+        decrement = np.einsum('rk,rk->r', gradient, step)
+
+        # halve the steps that lower the log-likelihood
+        scale = np.ones(len(active))
+        trial = beta[active] + step
+        trial_ll = _log_likelihood(design, counts[active], trial)
+        for _ in range(max_halvings):
+            worse = ~(trial_ll >= log_likelihood[active] - 1e-10 * np.abs(log_likelihood[active]))
+            if not worse.any():
+                break
+            scale[worse] /= 2
+            trial[worse] = beta[active[worse]] + scale[worse, None] * step[worse]
+            trial_ll[worse] = _log_likelihood(design, counts[active[worse]], trial[worse])
+        beta[active] = trial
+        log_likelihood[active] = trial_ll
+        converged[active] = decrement < tol
+        failed[active] = ~np.isfinite(decrement) | ~np.isfinite(trial_ll)
+
+    _, information = _score_information(design, counts, beta)
+    scale = np.sqrt(np.maximum(np.einsum('rkk->rk', information), np.finfo(np.float64).tiny))
+    converged &= np.linalg.cond(information / scale[:, :, None] / scale[:, None, :]) < max_condition
+    variances = np.full((n_data, k), np.nan)
+    for r in np.flatnonzero(converged):
+        try:
+            variances[r] = np.diagonal(np.linalg.inv(information[r]))
+        except np.linalg.LinAlgError:
+            converged[r] = False
+    with np.errstate(invalid='ignore'):
+        standard_errors = np.sqrt(variances)
+    converged &= (np.isfinite(standard_errors) & (variances > 0)).all(axis=1)
+    return beta, standard_errors, converged
+
+
+# one batch of replications - simulated and fitted in a worker process
+def _recovery_batch(task):
+    design, beta, priors, columns, n_respondents, n_replications, seed = task
+    rng = np.random.default_rng(seed)
+    counts = np.empty((n_replications,) + design.shape[:2])
+    for r in range(n_replications):
+        betas = beta if priors is None else priors.draws(n_respondents, 'pseudo', rng, columns)
+        counts[r] = choice_counts(simulate_choices(design, betas, n_respondents, rng), design.shape[1])
+    return fit_mnl(design, counts)
+
+
+## Parameter recovery of a design (n_sets, n_alts, K) with design columns names
+# beta: true coefficients for MNL (the prior means by default); with mixed, every respondent's coefficients are
+# drawn from priors instead and the true values are the prior means. Replications run in batches of batch_size on
+# n_workers processes; batches get seeds spawned from seed, so the result does not depend on n_workers.
+# Returns a table with a row per coefficient: true value, mean estimate, bias, relative bias, RMSE, mean standard
+# error, standard deviation of the estimates and coverage of the z-interval, over the converged replications
+# (their number is in .attrs['n_converged']).
+def parameter_recovery(design, names, beta=None, priors=None, n_respondents=500, n_replications=1000, mixed=False,
+                       n_workers=None, batch_size=50, seed=0, z=1.96):
+    design = np.asarray(design, dtype=np.float64)
+    names = list(names)
+    priors = priors or MODFEDEROV_PRIORS
+    true = priors.means(names) if beta is None or mixed else np.asarray(beta, dtype=np.float64)
+
+    sizes = [min(batch_size, n_replications - start) for start in range(0, n_replications, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(design, true, priors if mixed else None, names, n_respondents, size, batch_seed)
+             for size, batch_seed in zip(sizes, seeds)]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        results = list(pool.map(_recovery_batch, tasks))
+    estimates = np.concatenate([r[0] for r in results])[np.concatenate([r[2] for r in results])]
+    standard_errors = np.concatenate([r[1] for r in results])[np.concatenate([r[2] for r in results])]
+
+    # no converged replications leave every statistic undefined
+    if not len(estimates):
+        estimates = standard_errors = np.full((1, len(names)), np.nan)
+    error = estimates - true
+    table = pd.DataFrame({
+        'parameter': names,
+        'true': true,
+        'mean_estimate': estimates.mean(axis=0),
+        'bias': error.mean(axis=0),
+        'relative_bias': error.mean(axis=0) / np.where(true != 0, np.abs(true), np.nan),
+        'rmse': np.sqrt((error ** 2).mean(axis=0)),
+        'mean_se': standard_errors.mean(axis=0),
+        'sd_estimate': estimates.std(axis=0, ddof=1) if len(estimates) > 1 else np.nan,
+        'coverage': np.where(np.isnan(error), np.nan, np.abs(error) <= z * standard_errors).mean(axis=0),
+    })
+    table.attrs['n_converged'] = int(np.isfinite(estimates[:, 0]).sum())
+    table.attrs['n_replications'] = n_replications
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parameter recovery of a design with synthetic respondents")
+    parser.add_argument('design', help="design file, e.g. latest_design.csv")
+    parser.add_argument('--format', default='coded', choices=FORMATS, help="design file format (see converters.py)")
+    parser.add_argument('--spec', default='additional_cost_constraints', choices=list(SPECS))
+    parser.add_argument('--respondents', type=int, default=500)
+    parser.add_argument('--replications', type=int, default=1000)
+    parser.add_argument('--mixed', action='store_true', help="draw every respondent's coefficients from the priors")
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the table as csv")
+    args = parser.parse_args()
+
+    # the MNL only identifies the columns that are not linear combinations of others for the spec's profiles
+    spec = SPECS[args.spec]
+    codes = np.concatenate([chunk.codes for chunk in read_design(args.design, spec, args.format)])
+    coding = MODFEDEROV_CODING.full_rank(spec, spec.valid_profiles())
+    started = time.perf_counter()
+    table = parameter_recovery(coding.design(spec, codes), coding.names, n_respondents=args.respondents,
+                               n_replications=args.replications, mixed=args.mixed, n_workers=args.workers,
+                               seed=args.seed)
+    print(f"{len(codes)} choice sets, {args.respondents} respondents, {table.attrs['n_converged']} of "
+          f"{args.replications} replications converged in {time.perf_counter() - started:.1f} s")
+    if not table.attrs['n_converged']:
+        print("no replication has a finite MNL estimate - the coefficients decide every choice (see fit_mnl)")
+    print(table.to_string(index=False, float_format=lambda v: f'{v:.4g}'))
+    if args.output:
+        table.to_csv(args.output, index=False)
@@ -0,0 +1,120 @@
+## Instrumentation for candidate generation and design search
+# A Telemetry object collects named counters (e.g. how many profiles or pairs each rule rejects), tracks the
+# rolling throughput and ETA of long-running stages, and writes structured progress records as JSON lines -
+# one json object per line with 'time' (seconds since the Telemetry was created) and 'event':
+#   {"time": 12.0, "event": "progress", "stage": "pair_enumeration", "done": ..., "total": ..., "per_second": ...,
+#    "eta_seconds": ..., ...}
+#   {"time": 30.5, "event": "stage", "stage": "pair_enumeration", "seconds": 30.5}
+#   {"time": 30.5, "event": "counters", "counters": {"pairs.checked": ..., "pairs.rejected.GroupOverlap": ...}}
+# Progress records are written at most every every_seconds, so reporting costs nothing per pair or iteration.
+# With profile_dir every stage() also runs under cProfile and saves <profile_dir>/<stage>.prof.
+#
+# Instrumented functions take telemetry=None and skip all bookkeeping when it is None, so the uninstrumented
+# path has no overhead beyond one comparison per block of work.
+import cProfile
+import json
+import os
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+
+class Telemetry:
+    def __init__(self, path=None, every_seconds=10.0, window_seconds=60.0, report=None, profile_dir=None):
+        self.path = path
+        self.every_seconds = every_seconds
+        self.window_seconds = window_seconds
+        self.report = report
+        self.profile_dir = profile_dir
+        self.counters = Counter()
+        self.started = time.perf_counter()
+        self._file = open(path, 'a') if path is not None else None
+        self._windows = {}
+        self._last_progress = {}
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ## Add n to a counter; names are dotted, e.g. 'pairs.rejected.Dominance'
+    def count(self, name, n=1):
+        self.counters[name] += int(n)
+
+    ## Write one record as a json line (and pass a one-line summary to report)
+    def emit(self, event, **fields):
+        record = {'time': round(time.perf_counter() - self.started, 3), 'event': event, **fields}
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+        if self.report is not None:
+            self.report(_summary(record))
+        return record
+
+    ## Record that done (of total, if known) units of a stage are complete
+    # The rate is measured over the last window_seconds, so the ETA follows the current speed rather than the
+    # average since the start. A record is written at most every every_seconds unless force is set; extra
+    # fields (e.g. the current DB-error) are added to the record. Returns the record, or None if none was written.
+    def progress(self, stage, done, total=None, force=False, **fields):
+        now = time.perf_counter()
+        window = self._windows.setdefault(stage, deque())
+        window.append((now, done))
+        while len(window) > 2 and now - window[1][0] >= self.window_seconds:
+            window.popleft()
+        if not force and now - self._last_progress.get(stage, self.started) < self.every_seconds:
+            return None
+        self._last_progress[stage] = now
+
+        (t0, done0), (t1, done1) = window[0], window[-1]
+        per_second = (done1 - done0) / (t1 - t0) if t1 > t0 else None
+        eta = None
+        if total is not None and per_second:
+            eta = max(total - done, 0) / per_second
+        return self.emit('progress', stage=stage, done=done, total=total, per_second=per_second, eta_seconds=eta,
+                         **fields)
+
+    ## Write the counters (all, or those starting with prefix)
+    def emit_counters(self, prefix=''):
+        return self.emit('counters', counters={k: v for k, v in sorted(self.counters.items()) if k.startswith(prefix)})
+
+    ## Time a pipeline stage (and profile it with cProfile when profile_dir is set)
+    @contextmanager
+    def stage(self, name):
+        profiler = None
+        if self.profile_dir is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+            self.emit('stage', stage=name, seconds=seconds)
+
+
+# one line for the console
+def _summary(record):
+    event = record['event']
+    if event == 'progress':
+        total = '' if record['total'] is None else f"/{record['total']:,}"
+        rate = '' if record['per_second'] is None else f", {record['per_second']:,.0f}/s"
+        eta = '' if record['eta_seconds'] is None else f", ETA {record['eta_seconds']:.0f} s"
+        extra = ''.join(f', {k} {v:.6g}' if isinstance(v, float) else f', {k} {v}'
+                        for k, v in record.items() if k not in ('time', 'event', 'stage', 'done', 'total',
+                                                                 'per_second', 'eta_seconds'))
+        return f"[{record['time']:.0f} s] {record['stage']}: {record['done']:,}{total}{rate}{eta}{extra}"
+    if event == 'stage':
+        return f"[{record['time']:.0f} s] {record['stage']} finished in {record['seconds']:.2f} s"
+    if event == 'counters':
+        return '\n'.join(f"  {name}: {value:,}" for name, value in record['counters'].items())
+    return json.dumps(record)
@@ -0,0 +1,54 @@
+## Shared fixtures - a small candidate store of real choice sets and the modfederov.R priors
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from candidate_store import CandidateStore, CandidateStoreWriter  # noqa: E402
+from design_specs import SPECS  # noqa: E402
+from modfed import MODFEDEROV_CODING, prior_draws  # noqa: E402
+from pair_enumeration import ChoiceSetChunk  # noqa: E402
+from pair_sampler import PairSampler  # noqa: E402
+
+
+# candidate store of 3000 valid choice sets sampled from the additional cost constraints design space
+@pytest.fixture(scope='session')
+def store_path(tmp_path_factory):
+    spec = SPECS['additional_cost_constraints']
+    sampler = PairSampler(spec)
+    pairs = sampler.profile_ids(sampler.sample_ids(3000, 0))
+    path = str(tmp_path_factory.mktemp('store'))
+    writer = CandidateStoreWriter(path, spec, sampler.profiles)
+    writer.write(ChoiceSetChunk(1, pairs[:, 0], pairs[:, 1]))
+    writer.close()
+    return path
+
+
+@pytest.fixture(scope='session')
+def store(store_path):
+    return CandidateStore(store_path)
+
+
+@pytest.fixture(scope='session')
+def coding(store):
+    return MODFEDEROV_CODING.full_rank(store.spec, store.profiles)
+
+
+# draws from MODFEDEROV_PRIORS - most of them make the information matrix of a design close to singular
+@pytest.fixture(scope='session')
+def draws(coding):
+    return prior_draws(25, 0, coding=coding)
+
+
+# draws on a hundredth of the prior scale, under which designs are well conditioned
+@pytest.fixture(scope='session')
+def mild_draws(draws):
+    return draws / 100
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
@@ -0,0 +1,162 @@
+## Candidate sinks - every sink reads back the whole chunked stream
+import numpy as np
+import pandas as pd
+import pytest
+
+from candidate_sinks import (LongCsvSink, NgeneSampleSink, ParquetSink, PickleSink, WideCsvSink, balanced_allocation,
+                             overlap_cost_strata, reservoir_slots, wide_table, write_choice_sets)
+from design_specs import SPECS
+from pair_enumeration import ChoiceSetChunk
+
+
+# the store's choice sets in chunks of 700, so every sink sees several chunks and a short last one
+def _chunks(store):
+    return store.iter_chunks(chunk_size=700)
+
+
+def test_pickle_round_trip_over_chunks(store, tmp_path):
+    df_design = store.profile_table()
+    path = str(tmp_path / 'sets.pkl')
+    write_choice_sets(_chunks(store), [PickleSink(path, df_design)])
+
+    wide = pd.read_pickle(path)
+    left, right = store.choice_sets[:, 0], store.choice_sets[:, 1]
+    expected = wide_table(df_design, np.arange(1, len(left) + 1), left, right)
+    pd.testing.assert_frame_equal(wide, expected)
+    assert not (tmp_path / 'sets.pkl.chunks').exists()
+
+
+def test_parquet_round_trip_over_chunks(store, tmp_path):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    df_design = store.profile_table()
+    path = str(tmp_path / 'sets.parquet')
+    write_choice_sets(_chunks(store), [ParquetSink(path, df_design)])
+
+    left, right = store.choice_sets[:, 0], store.choice_sets[:, 1]
+    expected = wide_table(df_design, np.arange(1, len(left) + 1), left, right)
+    pd.testing.assert_frame_equal(pd.read_parquet(path), expected)
+    # one row group per chunk, so the file can be read back a chunk at a time
+    assert pyarrow_parquet.ParquetFile(path).num_row_groups == -(-len(store) // 700)
+
+
+def test_csv_sinks_round_trip_over_chunks(store, tmp_path):
+    df_design = store.profile_table()
+    wide_path, long_path = str(tmp_path / 'wide.csv'), str(tmp_path / 'long.csv')
+    write_choice_sets(_chunks(store), [WideCsvSink(wide_path, df_design), LongCsvSink(long_path, df_design)])
+
+    wide = pd.read_csv(wide_path)
+    assert len(wide) == len(store)
+    assert (wide['ChoiceSetID'] == np.arange(1, len(store) + 1)).all()
+    long = pd.read_csv(long_path)
+    assert len(long) == 3 * len(store)
+    assert (long.iloc[2::3] == 0).all().all()
+
+
+def test_empty_stream_writes_headers(store, tmp_path):
+    df_design = store.profile_table()
+    paths = [str(tmp_path / name) for name in ('wide.csv', 'long.csv', 'sets.pkl')]
+    write_choice_sets(iter(()), [WideCsvSink(paths[0], df_design), LongCsvSink(paths[1], df_design),
+                                 PickleSink(paths[2], df_design)])
+    assert list(pd.read_csv(paths[0]).columns)[0] == 'ChoiceSetID'
+    assert list(pd.read_csv(paths[1]).columns) == list(df_design.columns)
+    assert len(pd.read_pickle(paths[2])) == 0
+
+
+# ids of the sets a sink holds after a stream of n_items sets in chunks of chunk_size (the profile positions are
+# the ids, so no profile table is needed)
+def _sampled_ids(sink, n_items, chunk_size):
+    for start in range(0, n_items, chunk_size):
+        positions = np.arange(start, min(start + chunk_size, n_items))
+        sink.write(ChoiceSetChunk(start + 1, positions, positions))
+    return np.sort(sink.ids[:min(sink.n_seen, sink.max_choices)] if sink.strata is None else sink.ids)
+
+
+def test_reservoir_slots_fill_then_replace():
+    rng = np.random.default_rng(0)
+    slots, items = reservoir_slots(rng, 0, 10, 6)
+    np.testing.assert_array_equal(slots, np.arange(6))
+    np.testing.assert_array_equal(items, np.arange(6))
+    slots, items = reservoir_slots(rng, 6, 10, 50)
+    assert len(np.unique(slots)) == len(slots) and slots.max() < 10
+    # the free slots are filled (possibly by a later item of the chunk, the last one to hit a slot wins)
+    assert set(range(6, 10)) <= set(slots)
+    assert all(items[slots == slot][0] >= slot - 6 for slot in range(6, 10))
+    assert len(reservoir_slots(rng, 10, 10, 0)[0]) == 0
+
+
+# one random number per item after the reservoir is full, in stream order, so the sample does not depend on how
+# the stream is chunked
+def test_sample_is_seeded_and_independent_of_chunking():
+    samples = [_sampled_ids(NgeneSampleSink(None, None, max_choices=40, seed=3), 1000, chunk_size)
+               for chunk_size in (1, 7, 1000)]
+    for sample in samples[1:]:
+        np.testing.assert_array_equal(sample, samples[0])
+    assert len(samples[0]) == 40 and len(np.unique(samples[0])) == 40
+    assert not np.array_equal(samples[0], _sampled_ids(NgeneSampleSink(None, None, max_choices=40, seed=4), 1000, 7))
+    np.testing.assert_array_equal(_sampled_ids(NgeneSampleSink(None, None, max_choices=40, seed=3), 30, 7),
+                                  np.arange(1, 31))
+
+
+def test_reservoir_sample_is_uniform():
+    counts = np.zeros(50)
+    n_repeats = 2000
+    for seed in range(n_repeats):
+        counts[_sampled_ids(NgeneSampleSink(None, None, max_choices=10, seed=seed), 50, 7) - 1] += 1
+    # every set is kept with probability 10 / 50 (standard error about 0.009)
+    np.testing.assert_allclose(counts / n_repeats, 0.2, atol=0.04)
+
+
+@pytest.mark.parametrize('counts, total, expected', [
+    ([30, 20, 3], 16, [7, 6, 3]),
+    ([30, 20, 3], 100, [30, 20, 3]),
+    ([5, 5, 5], 15, [5, 5, 5]),
+    ([10, 10, 10], 10, [4, 3, 3]),
+    ([1, 100, 2, 100], 50, [1, 24, 2, 23]),
+    ([4, 4], 0, [0, 0]),
+])
+def test_balanced_allocation_water_fills(counts, total, expected):
+    allocation = balanced_allocation(counts, total)
+    np.testing.assert_array_equal(allocation, expected)
+    assert allocation.sum() == min(total, sum(counts))
+    assert (allocation <= counts).all()
+
+
+# strata of 30, 20 and 3 sets with room for 16: the small stratum is taken whole and the others share the rest
+def _three_strata(chunk):
+    return np.where(chunk.left < 30, 0, np.where(chunk.left < 50, 1, 2))
+
+
+def test_stratified_sample_is_seeded_and_balanced():
+    samples = [_sampled_ids(NgeneSampleSink(None, None, max_choices=16, seed=3, strata=_three_strata), 53, size)
+               for size in (1, 7, 53)]
+    for sample in samples[1:]:
+        np.testing.assert_array_equal(sample, samples[0])
+    stratum = _three_strata(ChoiceSetChunk(1, samples[0] - 1, samples[0] - 1))
+    np.testing.assert_array_equal(np.bincount(stratum, minlength=3), [7, 6, 3])
+
+
+def test_stratified_sample_is_uniform_within_strata():
+    counts = np.zeros(53)
+    n_repeats = 2000
+    for seed in range(n_repeats):
+        sink = NgeneSampleSink(None, None, max_choices=16, seed=seed, strata=_three_strata)
+        counts[_sampled_ids(sink, 53, 7) - 1] += 1
+    frequency = counts / n_repeats
+    np.testing.assert_allclose(frequency[:30], 7 / 30, atol=0.04)
+    np.testing.assert_allclose(frequency[30:50], 6 / 20, atol=0.04)
+    np.testing.assert_array_equal(frequency[50:], 1)
+
+
+# the csv holds the sampled sets' rows of the wide table, by id
+def test_ngene_sample_csv(store, tmp_path):
+    df_design = store.profile_table()
+    path = str(tmp_path / 'ngene.csv')
+    strata = overlap_cost_strata(SPECS['additional_cost_constraints'], store.profiles)
+    write_choice_sets(_chunks(store), [NgeneSampleSink(path, df_design, max_choices=500, seed=0, strata=strata)])
+    sample = pd.read_csv(path)
+    assert len(sample) == 500
+    ids = sample['choice situation'].to_numpy()
+    assert (np.diff(ids) > 0).all()
+    expected = wide_table(df_design, ids, store.choice_sets[ids - 1, 0], store.choice_sets[ids - 1, 1],
+                          'choice situation')
+    pd.testing.assert_frame_equal(sample, expected)
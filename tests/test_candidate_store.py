@@ -0,0 +1,55 @@
+## Candidate store - header, dtypes and ids survive a round trip, and a failed run leaves no store behind
+import json
+import os
+
+import numpy as np
+import pytest
+
+from candidate_sinks import write_choice_sets
+from candidate_store import CHOICE_SETS_FILE, HEADER_FILE, CandidateStore, CandidateStoreWriter
+
+
+def test_store_round_trip_over_chunks(store, tmp_path):
+    path = str(tmp_path / 'copy')
+    n_sets = write_choice_sets(store.iter_chunks(chunk_size=700),
+                               [CandidateStoreWriter(path, store.spec, store.profiles)])
+    assert n_sets == len(store)
+
+    copy = CandidateStore(path)
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        header = json.load(f)
+    assert header == {
+        'attributes': store.spec.attributes,
+        'cost_attribute': store.spec.cost_attribute,
+        'n_profiles': len(store.profiles),
+        'n_choice_sets': len(store),
+        'profile_dtype': 'uint8',
+        'choice_set_dtype': 'int32',
+    }
+    assert copy.profiles.dtype == np.uint8 and copy.choice_sets.dtype == np.int32
+    np.testing.assert_array_equal(copy.profiles, store.profiles)
+    ids = np.array([1, 2, 701, len(store)])
+    np.testing.assert_array_equal(copy.profile_ids(ids), store.profile_ids(ids))
+    np.testing.assert_array_equal(copy.codes(ids), store.profiles[store.choice_sets[ids - 1]])
+    np.testing.assert_array_equal(np.asarray(copy.choice_sets), np.asarray(store.choice_sets))
+    with pytest.raises(IndexError):
+        copy.profile_ids([0])
+    with pytest.raises(IndexError):
+        copy.profile_ids([len(store) + 1])
+
+
+# the stream fails part way, into a directory that already held a complete store
+def test_failed_run_writes_no_header(store, tmp_path):
+    path = str(tmp_path / 'store')
+    write_choice_sets(store.iter_chunks(chunk_size=700), [CandidateStoreWriter(path, store.spec, store.profiles)])
+
+    def failing_chunks():
+        yield from store.iter_chunks(chunk_size=700)
+        raise RuntimeError("enumeration failed")
+    with pytest.raises(RuntimeError, match='enumeration failed'):
+        write_choice_sets(failing_chunks(), [CandidateStoreWriter(path, store.spec, store.profiles)])
+
+    assert os.path.exists(os.path.join(path, CHOICE_SETS_FILE))
+    assert not os.path.exists(os.path.join(path, HEADER_FILE))
+    with pytest.raises(FileNotFoundError):
+        CandidateStore(path)
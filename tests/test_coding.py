@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from efficiency import information_matrices
+from modfed import MODFEDEROV_CODING, FedorovChain, prior_draws, random_start
+
+
+def test_modfederov_coding_is_rank_deficient(store):
+    with pytest.raises(ValueError, match='linear combinations'):
+        MODFEDEROV_CODING.check_full_rank(store.spec, store.profiles)
+    MODFEDEROV_CODING.full_rank(store.spec, store.profiles).check_full_rank(store.spec, store.profiles)
+
+
+# smallest / largest eigenvalue of the unit-diagonal scaled information matrices of the design
+def _relative_eigenvalue(design, draws):
+    information = information_matrices(design, draws)
+    scale = np.sqrt(np.einsum('rkk->rk', information))
+    eigenvalues = np.linalg.eigvalsh(information / scale[:, :, None] / scale[:, None, :])
+    return eigenvalues[:, 0] / eigenvalues[:, -1]
+
+
+def test_full_rank_coding_identifies_every_column(store, coding, mild_draws, rng):
+    ids = random_start(store, 48, mild_draws, rng, coding=coding)
+    assert (_relative_eigenvalue(coding.store_design(store, ids), mild_draws) > 1e-8).all()
+    singular = MODFEDEROV_CODING.store_design(store, ids)
+    assert (_relative_eigenvalue(singular, prior_draws(25, 0) / 100) < 1e-12).all()
+
+
+def test_search_defaults_to_full_rank_coding(store, coding, draws, rng):
+    chain = FedorovChain(store, draws, random_start(store, 48, draws, rng), rng)
+    assert chain.coding.names == coding.names
+    with pytest.raises(ValueError, match='linear combinations'):
+        FedorovChain(store, prior_draws(25, 0), chain.ids, rng, coding=MODFEDEROV_CODING)
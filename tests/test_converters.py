@@ -0,0 +1,39 @@
+## Design format conversions
+import os
+
+import numpy as np
+import pandas as pd
+
+from convert_des_to_ngene_format import convert_des_to_ngene_format
+from converters import convert, read_design
+from design_specs import SPECS
+from search import multi_start_search
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_ngene_conversion_returns_the_written_frame(tmp_path):
+    save_path = str(tmp_path / 'ngene.csv')
+    ngene_format = convert_des_to_ngene_format(os.path.join(HERE, 'latest_design.csv'), save_path)
+    design = pd.read_csv(os.path.join(HERE, 'latest_design.csv'))
+
+    pd.testing.assert_frame_equal(ngene_format, pd.read_csv(save_path))
+    assert len(ngene_format) == len(design) // 3
+    assert list(ngene_format['choice situation']) == list(range(1, len(design) // 3 + 1))
+    assert not any('no.choice' in column for column in ngene_format.columns)
+
+
+# the search writes its design in the full-rank coding, without the smcc / sncc columns: their levels are told apart
+# through the profile rules when the coded design is read back
+def test_search_output_converts_to_ngene(store_path, store, coding, draws, tmp_path):
+    spec = SPECS['additional_cost_constraints']
+    assert 'smcc' not in coding.names and 'sncc' not in coding.names
+    records = multi_start_search(store_path, str(tmp_path), draws, n_chains=1, n_workers=1, time_budget_seconds=2,
+                                 coding=coding, report=None, cache_mb=0)
+    coded_path, ngene_path = str(tmp_path / 'best_design.csv'), str(tmp_path / 'ngene.csv')
+    assert convert(coded_path, ngene_path, spec, 'coded', 'ngene', coding=coding) == len(records[0]['ids'])
+
+    chunks = list(read_design(ngene_path, spec, 'ngene', coding=coding))
+    codes = np.concatenate([chunk.codes for chunk in chunks])
+    np.testing.assert_array_equal(codes, store.codes(records[0]['ids']))
+    assert list(np.concatenate([chunk.ids for chunk in chunks])) == list(range(1, len(codes) + 1))
@@ -0,0 +1,72 @@
+import copy
+
+import numpy as np
+import pytest
+
+import coordinate_exchange as coordinate_exchange_module
+from coordinate_exchange import CoordinateExchange, coordinate_exchange, design_coding, random_choice_sets
+from design_specs import SPECS
+from efficiency import d_errors, db_error
+from modfed import MODFEDEROV_CODING, prior_draws
+
+SPEC = SPECS['additional_cost_constraints']
+
+
+def test_default_coding_is_full_rank(coding, draws):
+    assert design_coding(SPEC).names == coding.names
+    with pytest.raises(ValueError, match='linear combinations'):
+        coordinate_exchange(SPEC, prior_draws(25, 0), n_sets=12, coding=MODFEDEROV_CODING, report=None)
+
+
+# the coding comes from sampled profiles, once per search - the profile space is never enumerated
+def test_coding_does_not_enumerate_the_profiles(coding, draws, monkeypatch):
+    spec = copy.deepcopy(SPEC)
+    calls = []
+
+    def enumerate_profiles(*args, **kwargs):
+        raise AssertionError("the profile space was enumerated")
+    monkeypatch.setattr(spec, 'valid_profiles', enumerate_profiles)
+    monkeypatch.setattr(spec, 'full_factorial', enumerate_profiles)
+    monkeypatch.setattr(coordinate_exchange_module, 'design_coding',
+                        lambda *args, **kwargs: calls.append(args) or design_coding(*args, **kwargs))
+    result = coordinate_exchange_module.coordinate_exchange(spec, draws, n_sets=12, rng=0, max_sweeps=1, report=None)
+    assert len(calls) == 1
+    assert result['design'].shape[-1] == len(coding.names)
+
+
+# under MODFEDEROV_PRIORS, where the exchange scores are only approximate for most draws
+def test_moves_keep_state_consistent(coding, draws, rng):
+    spec = SPEC
+    search = CoordinateExchange(spec, draws, random_choice_sets(spec, 12, rng), coding)
+    n_accepted = 0
+    for position in range(len(search.codes)):
+        current = search.db_error
+        undefined = np.isnan(search.state.d_errors).sum()
+        direct = ~search.state.low_rank
+        if search.improve(position):
+            n_accepted += 1
+            now_undefined = np.isnan(search.state.d_errors).sum()
+            assert now_undefined < undefined or (now_undefined == undefined and search.db_error < current)
+        np.testing.assert_array_equal(search.design, coding.design(spec, search.codes))
+        # directly scored draws are recomputed from the design, the others follow the low-rank updates
+        exact = d_errors(search.design, draws)
+        np.testing.assert_array_equal(search.state.d_errors[direct & ~search.state.low_rank],
+                                      exact[direct & ~search.state.low_rank])
+        assert search.db_error == search.state.db_error
+    assert n_accepted
+    search.sweep()
+    assert search.db_error == db_error(search.design, draws)
+
+
+def test_search_result_is_exact_and_valid(coding, draws):
+    spec = SPEC
+    result = coordinate_exchange(spec, draws, n_sets=12, rng=0, max_sweeps=2, report=None)
+    codes = result['codes']
+    np.testing.assert_array_equal(result['design'], coding.design(spec, codes))
+    assert result['db_error'] == db_error(result['design'], draws)
+    assert result['db_error'] == min(error for _, error in result['trace'])
+
+    rules = spec.compile()
+    assert rules.profile_mask(codes.reshape(-1, codes.shape[-1])).all()
+    assert rules.pair_mask(rules.pair_features(codes[:, 0]), rules.pair_features(codes[:, 1])).all()
+    assert len(np.unique(codes.reshape(len(codes), -1), axis=0)) == len(codes)
@@ -0,0 +1,56 @@
+import numpy as np
+
+from diagnostics import DesignDiagnostics
+
+
+# random level codes (n, 2, n_attributes) from the full factorial, so some sets are dominated
+def _codes(spec, n, rng):
+    n_levels = np.array([len(levels) for levels in spec.attributes.values()])
+    return (rng.random((n, 2, len(n_levels))) * n_levels).astype(np.uint8)
+
+
+def _assert_same(diagnostics, fresh):
+    np.testing.assert_array_equal(diagnostics.level_counts, fresh.level_counts)
+    np.testing.assert_array_equal(diagnostics.overlap_counts, fresh.overlap_counts)
+    np.testing.assert_array_equal(diagnostics.dominated, fresh.dominated)
+    assert diagnostics.n_dominated == fresh.n_dominated
+    assert diagnostics.report() == fresh.report()
+
+
+def test_swaps_equal_a_full_recomputation(store, rng):
+    spec = store.spec
+    diagnostics = DesignDiagnostics(spec, _codes(spec, 48, rng))
+    for position, new_codes in zip(rng.integers(0, 48, 200), _codes(spec, 200, rng)):
+        diagnostics.swap(position, new_codes)
+    _assert_same(diagnostics, DesignDiagnostics(spec, diagnostics.codes))
+    assert 0 < diagnostics.n_dominated < 48
+
+    codes = diagnostics.codes
+    for a, levels in enumerate(spec.attributes.values()):
+        counts = np.bincount(codes[:, :, a].ravel(), minlength=len(levels))
+        np.testing.assert_array_equal(diagnostics.level_counts[a, :len(levels)], counts)
+    np.testing.assert_array_equal(diagnostics.overlap_counts, (codes[:, 0] == codes[:, 1]).sum(axis=0))
+
+
+def test_swap_imbalance_equals_the_swapped_design(store, rng):
+    spec = store.spec
+    diagnostics = DesignDiagnostics(spec, _codes(spec, 48, rng))
+    candidates = _codes(spec, 5, rng)
+    positions = [0, 17, 47]
+    imbalance = diagnostics.swap_imbalance(candidates, positions)
+    assert imbalance.shape == (5, 3)
+    for c, candidate in enumerate(candidates):
+        for p, position in enumerate(positions):
+            codes = diagnostics.codes.copy()
+            codes[position] = candidate
+            assert np.isclose(imbalance[c, p], DesignDiagnostics(spec, codes).imbalance(), rtol=1e-12, atol=0)
+    np.testing.assert_array_equal(diagnostics.swap_imbalance(candidates)[:, positions], imbalance)
+
+
+def test_balanced_design_has_no_imbalance(store):
+    spec = store.spec
+    n_levels = np.array([len(levels) for levels in spec.attributes.values()])
+    # every level of every attribute equally often: alternatives cycle through the levels
+    n_sets = int(np.lcm.reduce(n_levels))
+    codes = (np.arange(2 * n_sets).reshape(n_sets, 2)[:, :, None] % n_levels).astype(np.uint8)
+    assert DesignDiagnostics(spec, codes).imbalance() == 0
@@ -0,0 +1,55 @@
+## Bayesian D-error - a pinned reference for latest_design.csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from converters import read_design
+from design_specs import SPECS
+from efficiency import d_errors, db_error
+from modfed import MODFEDEROV_CODING, prior_draws
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPEC = SPECS['additional_cost_constraints']
+LATEST_DESIGN = os.path.join(HERE, 'latest_design.csv')
+
+# DB-error of latest_design.csv in the full-rank coding over the first 25 Halton prior draws (seed 0) scaled to a
+# hundredth, where every information matrix is well conditioned (under the full priors most are so close to
+# singular that the D-errors are mostly rounding)
+REFERENCE_DB_ERROR = 0.014684819560612978
+
+
+def _full_rank_design():
+    codes = np.concatenate([chunk.codes for chunk in read_design(LATEST_DESIGN, SPEC, 'coded')])
+    coding = MODFEDEROV_CODING.full_rank(SPEC, SPEC.valid_profiles())
+    return coding.design(SPEC, codes), coding
+
+
+# det(X'(diag(p) - p p')X)^(-1/K) summed set by set, as in idefix
+def _reference_d_error(design, beta):
+    information = np.zeros((design.shape[-1], design.shape[-1]))
+    for x in design:
+        utility = x @ beta
+        p = np.exp(utility - utility.max())
+        p /= p.sum()
+        information += x.T @ (np.diag(p) - np.outer(p, p)) @ x
+    return np.linalg.det(information) ** (-1 / design.shape[-1])
+
+
+def test_latest_design_reference_db_error():
+    design, coding = _full_rank_design()
+    assert 'smcc' not in coding.names and 'sncc' not in coding.names
+    draws = prior_draws(25, 0, coding=coding) / 100
+    np.testing.assert_allclose(d_errors(design, draws), [_reference_d_error(design, beta) for beta in draws],
+                               rtol=1e-10)
+    np.testing.assert_allclose(db_error(design, draws), REFERENCE_DB_ERROR, rtol=1e-10)
+
+
+# the 14 columns of the file are linearly dependent, so its own coding has no meaningful DB-error
+def test_latest_design_full_coding_is_not_identified():
+    coded = pd.read_csv(LATEST_DESIGN)
+    assert list(coded.columns) == MODFEDEROV_CODING.names
+    assert np.linalg.matrix_rank(coded.to_numpy(dtype=np.float64)) == 12
+    design, coding = _full_rank_design()
+    np.testing.assert_array_equal(design.reshape(len(coded), -1), coded[coding.names].to_numpy(dtype=np.float64))
+    assert np.linalg.matrix_rank(design.reshape(len(coded), -1)) == len(coding.names)
@@ -0,0 +1,123 @@
+import numpy as np
+
+import exchange
+from efficiency import d_errors, db_error, information_matrices
+from exchange import ExchangeState
+from modfed import random_start
+
+
+# condition number of unit-diagonal scaled information matrices (n_draws, K, K)
+def _condition(information):
+    scale = np.sqrt(np.einsum('rkk->rk', information))
+    return np.linalg.cond(information / scale[:, :, None] / scale[:, None, :])
+
+
+def _state(store, coding, draws, rng):
+    ids = random_start(store, 48, draws, rng, coding=coding)
+    return ExchangeState(coding.store_design(store, ids), draws)
+
+
+def test_refresh_matches_efficiency(store, coding, draws, rng):
+    state = _state(store, coding, draws, rng)
+    np.testing.assert_array_equal(state.d_errors, d_errors(state.design, draws))
+    assert np.isclose(state.db_error, db_error(state.design, draws), rtol=1e-12)
+
+
+def test_swap_scores_match_recomputed_d_errors(store, coding, mild_draws, rng):
+    state = _state(store, coding, mild_draws, rng)
+    assert state.low_rank.all()
+    candidates = coding.store_design(store, store.sample_ids(4, rng))
+    scores = state.swap_d_errors(candidates)
+    for c in range(len(candidates)):
+        for position in range(0, 48, 5):
+            exact = state.exact_swap_d_errors(position, candidates[c])
+            np.testing.assert_allclose(scores[c, position], exact, rtol=1e-6)
+
+
+# under the modfederov.R priors and the full-rank coding a share of the draws is well conditioned and scored with
+# the low-rank updates; the others are recomputed directly on commit, never for every draw
+def test_low_rank_path_is_used_under_priors(store, coding, draws, rng, monkeypatch):
+    n_low_rank = [_state(store, coding, draws, rng).low_rank.sum() for _ in range(5)]
+    assert min(n_low_rank) >= 1 and sum(n_low_rank) >= 10
+
+    state = _state(store, coding, draws, rng)
+    recomputed = []
+
+    def information_matrices_spy(design, some_draws):
+        recomputed.append(len(some_draws))
+        return information_matrices(design, some_draws)
+    monkeypatch.setattr(exchange, 'information_matrices', information_matrices_spy)
+    for _ in range(5):
+        n_direct = (~state.low_rank).sum()
+        state.commit(rng.integers(48), coding.store_design(store, store.sample_ids(1, rng))[0])
+        assert recomputed.pop() == n_direct or state.n_updates == 0
+
+
+# the low-rank scores agree with the recomputed D-errors to about max_condition times the machine epsilon wherever
+# the swapped design is well conditioned too (elsewhere the D-error itself is rounding noise)
+def test_low_rank_scores_under_priors(store, coding, draws, rng):
+    checked = 0
+    for _ in range(10):
+        state = _state(store, coding, draws, rng)
+        candidates = coding.store_design(store, store.sample_ids(3, rng))
+        scores = state.swap_d_errors(candidates)
+        for c in range(len(candidates)):
+            for position in range(0, 48, 7):
+                design = state.design.copy()
+                design[position] = candidates[c]
+                good = state.low_rank & (_condition(information_matrices(design, draws)) < state.max_condition)
+                exact = state.exact_swap_d_errors(position, candidates[c])
+                np.testing.assert_allclose(scores[c, position, good], exact[good], rtol=1e-3)
+                checked += good.sum()
+    assert checked
+
+
+# direct-path draws are recomputed from the design, the low-rank ones follow the Woodbury updates until refresh
+def test_state_tracks_efficiency_through_commits(store, coding, draws, rng):
+    state = _state(store, coding, draws, rng)
+    for _ in range(60):
+        candidate = coding.store_design(store, store.sample_ids(1, rng))[0]
+        position = rng.integers(48)
+        expected = state.exact_swap_d_errors(position, candidate)
+        direct = ~state.low_rank
+        state.commit(position, candidate)
+        if state.n_updates == 0:
+            np.testing.assert_array_equal(state.d_errors, expected)
+            continue
+        np.testing.assert_array_equal(state.d_errors[direct], expected[direct])
+        good = state.low_rank & (_condition(information_matrices(state.design, draws)) < state.max_condition)
+        np.testing.assert_allclose(state.d_errors[good], expected[good], rtol=1e-3)
+    state.refresh()
+    assert state.db_error == db_error(state.design, draws)
+
+
+def test_commits_keep_inverses_accurate(store, coding, mild_draws, rng):
+    state = _state(store, coding, mild_draws, rng)
+    state.refresh_every = 1000
+    for _ in range(30):
+        candidate = coding.store_design(store, store.sample_ids(1, rng))[0]
+        state.commit(rng.integers(48), candidate)
+        assert state.low_rank.all()
+        np.testing.assert_allclose(state.d_errors, d_errors(state.design, mild_draws), rtol=1e-8)
+        inverse = np.linalg.inv(information_matrices(state.design, mild_draws))
+        scale = state.scale
+        np.testing.assert_allclose(state.inverse, inverse * scale[:, :, None] * scale[:, None, :], rtol=1e-6,
+                                   atol=1e-8)
+
+
+def test_rejected_commit_leaves_the_state_unchanged(store, coding, draws, rng):
+    state = _state(store, coding, draws, rng)
+    before = {name: np.copy(getattr(state, name)) for name in ('design', 'factors', 'inverse', 'logdet', 'd_errors')}
+    candidate = coding.store_design(store, store.sample_ids(1, rng))[0]
+    seen = []
+    assert not state.commit(5, candidate, accept=lambda d_errors: seen.append(d_errors) or False)
+    for name, value in before.items():
+        np.testing.assert_array_equal(getattr(state, name), value)
+    assert state.n_updates == 0
+
+    # the D-errors offered to accept are the ones the swap leaves - recomputed for the direct-path draws
+    direct = ~state.low_rank
+    assert state.commit(5, candidate, accept=lambda d_errors: True)
+    np.testing.assert_array_equal(seen[0][direct], d_errors(state.design, draws)[direct])
+    if state.n_updates:
+        np.testing.assert_array_equal(seen[0], state.d_errors)
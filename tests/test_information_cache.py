@@ -0,0 +1,69 @@
+import numpy as np
+
+from information_cache import InformationCache, draws_version
+from modfed import FedorovChain, random_start
+from profile_table import ProfileTable
+
+
+def _compute(store, table, calls):
+    def compute(ids):
+        calls.append(len(ids))
+        return table.factors(store.profile_ids(ids))
+    return compute
+
+
+def test_hits_equal_a_fresh_computation(store, coding, draws, rng):
+    table = ProfileTable(coding, store.spec, store.profiles, draws)
+    version = draws_version(draws, coding.names)
+    cache = InformationCache()
+    calls = []
+    first = store.sample_ids(50, rng)
+    cache.factors(first, version, _compute(store, table, calls))
+
+    # half of these are cached - the result is the same array, bit for bit, as computing all of them
+    ids = np.concatenate([first[:25], store.sample_ids(25, rng)])
+    factors = cache.factors(ids, version, _compute(store, table, calls))
+    fresh = table.factors(store.profile_ids(ids))
+    np.testing.assert_array_equal(factors, fresh)
+    assert factors.shape == fresh.shape
+    assert calls[0] == 50 and calls[1] == len(np.setdiff1d(ids, first))
+    assert cache.hits == 50 - calls[1] and cache.misses == 50 + calls[1]
+
+
+def test_other_draws_are_not_shared(store, coding, draws, rng):
+    table = ProfileTable(coding, store.spec, store.profiles, draws)
+    cache = InformationCache()
+    calls = []
+    ids = store.sample_ids(10, rng)
+    cache.factors(ids, draws_version(draws, coding.names), _compute(store, table, calls))
+    cache.factors(ids, draws_version(draws / 2, coding.names), _compute(store, table, calls))
+    assert calls == [10, 10] and cache.hits == 0
+
+
+def test_least_recently_used_sets_are_evicted(store, coding, draws, rng):
+    table = ProfileTable(coding, store.spec, store.profiles, draws)
+    version = draws_version(draws, coding.names)
+    one_set = table.factors(store.profile_ids(store.sample_ids(1, rng))).nbytes
+    cache = InformationCache(max_bytes=3 * one_set)
+    calls = []
+    for i in (1, 2, 3, 1, 4):
+        cache.factors([i], version, _compute(store, table, calls))
+    # 2 was the least recently used when 4 came in
+    assert cache.evictions == 1 and len(cache) == 3 and cache.nbytes == 3 * one_set
+    assert {key[0] for key in cache._entries} == {1, 3, 4}
+    assert cache.hits == 1 and cache.hit_rate == 1 / 5
+
+
+# a chain scores swaps exactly as without a cache, so it follows the same path
+def test_chain_with_cache_follows_the_same_path(store, draws):
+    ids = random_start(store, 48, draws, np.random.default_rng(1))
+    plain = FedorovChain(store, draws, ids, np.random.default_rng(2), candidates_per_iteration=10)
+    cached = FedorovChain(store, draws, ids, np.random.default_rng(2), candidates_per_iteration=10,
+                          cache=InformationCache())
+    # half of the store is cached before the chain starts
+    cached.candidate_factors(np.arange(1, len(store) + 1, 2))
+    for _ in range(10):
+        assert plain.step() == cached.step()
+    np.testing.assert_array_equal(plain.ids, cached.ids)
+    assert plain.db_error == cached.db_error
+    assert cached.cache.hits > 0
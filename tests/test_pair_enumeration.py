@@ -0,0 +1,202 @@
+## Pair enumeration - every path gives the pairs of the original valid_choice double loop, in the same order
+import itertools
+import json
+
+import numpy as np
+import pytest
+
+from constraints import AllOrNone, CompiledPairRule, CompiledRules, DesignSpec, Dominance, GroupEqual, GroupOverlap
+from pair_enumeration import (_CostFactoredPairs, _pairs_before, balanced_shards, enumerate_valid_pairs,
+                              enumerate_valid_pairs_parallel, iter_valid_pair_chunks)
+from telemetry import Telemetry
+
+GROUPS = {'weather': ['W_A'], 'climate': ['C_A'], 'soil_moisture': ['SM_A', 'SM_F'], 'soil_nutrition': ['SN_A']}
+
+# small enough for the reference loop, with every kind of pair rule
+SPEC = DesignSpec(
+    attributes={
+        'W_A': [10, 30, 50],
+        'C_A': [10, 30],
+        'SM_A': [0, 10, 30],
+        'SM_F': [0, 1, 2],
+        'SN_A': [0, 10],
+        'C': [50, 250, 1250],
+    },
+    profile_rules=[AllOrNone({'SM_A': 0, 'SM_F': 0})],
+    pair_rules=[
+        GroupOverlap(GROUPS, n_equal=2),
+        GroupEqual(['C_A', 'SN_A'], equal=False),
+        Dominance('C'),
+    ],
+)
+
+
+# the original double loop's check, written out on level values
+def valid_choice(a, b):
+    a, b = dict(zip(SPEC.attribute_names, a)), dict(zip(SPEC.attribute_names, b))
+    n_same = sum(all(a[att] == b[att] for att in atts) for atts in GROUPS.values())
+    if n_same != 2:
+        return False
+    if a['C_A'] == b['C_A'] and a['SN_A'] == b['SN_A']:
+        return False
+    info = [att for att in SPEC.attribute_names if att != 'C']
+    if all(a[att] >= b[att] for att in info) and not a['C'] > b['C']:
+        return False
+    if all(a[att] <= b[att] for att in info) and not a['C'] < b['C']:
+        return False
+    return True
+
+
+def reference_pairs(profiles, profile_mask=None):
+    values = SPEC.decode(profiles)
+    keep = np.ones(len(profiles), dtype=bool) if profile_mask is None else profile_mask
+    pairs = [(i, j) for i, j in itertools.combinations(range(len(profiles)), 2)
+             if keep[i] and keep[j] and valid_choice(values[i], values[j])]
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+
+# the compiled rules with the GroupOverlap index and / or the cost factoring switched off
+def rules_without(rules, index=True, factoring=True):
+    pair_rules = [CompiledPairRule(rule.features, rule.mask, None if index else rule.join) for rule in rules.pair_rules]
+    return CompiledRules(rules.profile_masks, pair_rules, None if factoring else rules.base_rules,
+                         rules.profile_labels, rules.pair_labels)
+
+
+@pytest.fixture(scope='module')
+def profiles():
+    return SPEC.valid_profiles()
+
+
+@pytest.fixture(scope='module')
+def reference(profiles):
+    pairs = reference_pairs(profiles)
+    assert 0 < len(pairs) < len(profiles) * (len(profiles) - 1) // 2
+    return pairs
+
+
+# block sizes that do and do not divide the number of rows
+@pytest.mark.parametrize('block_size', [1, 7, 256])
+def test_vectorised_pairs_match_the_loop(profiles, reference, block_size):
+    rules = rules_without(SPEC.compile())
+    left, right = enumerate_valid_pairs(profiles, rules, block_size=block_size)
+    np.testing.assert_array_equal(np.stack([left, right], axis=1), reference)
+
+
+def test_profile_mask_matches_the_loop(profiles):
+    mask = np.random.default_rng(0).random(len(profiles)) < 0.7
+    left, right = enumerate_valid_pairs(profiles, rules_without(SPEC.compile()), profile_mask=mask, block_size=7)
+    np.testing.assert_array_equal(np.stack([left, right], axis=1), reference_pairs(profiles, mask))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 10 ** 6])
+def test_chunks_match_the_loop(profiles, reference, chunk_size):
+    chunks = list(iter_valid_pair_chunks(profiles, rules_without(SPEC.compile()), chunk_size=chunk_size,
+                                         block_size=7))
+    assert [chunk.start_id for chunk in chunks] == list(range(1, len(reference) + 1, chunk_size))
+    assert all(len(chunk.left) == chunk_size for chunk in chunks[:-1])
+    pairs = np.concatenate([np.stack([chunk.left, chunk.right], axis=1) for chunk in chunks])
+    np.testing.assert_array_equal(pairs, reference)
+
+
+# GroupOverlap's index lists the candidate pairs, wherever the rule is in the list
+@pytest.mark.parametrize('reverse', [False, True])
+def test_join_index_pairs_match_the_loop(profiles, reference, reverse):
+    rules = rules_without(SPEC.compile(), index=False)
+    assert rules.pair_rules[0].join is not None
+    if reverse:
+        rules = CompiledRules(rules.profile_masks, rules.pair_rules[::-1], None, rules.profile_labels,
+                              rules.pair_labels[::-1])
+    left, right = enumerate_valid_pairs(profiles, rules, block_size=7)
+    np.testing.assert_array_equal(np.stack([left, right], axis=1), reference)
+    mask = np.random.default_rng(0).random(len(profiles)) < 0.7
+    left, right = enumerate_valid_pairs(profiles, rules, profile_mask=mask, block_size=7)
+    np.testing.assert_array_equal(np.stack([left, right], axis=1), reference_pairs(profiles, mask))
+
+
+# with cost only in Dominance, pairs of non-cost profiles are expanded by cost level (with the index underneath)
+@pytest.mark.parametrize('block_size', [1, 7, 256])
+def test_cost_factored_pairs_match_the_loop(profiles, reference, block_size):
+    rules = SPEC.compile()
+    assert _CostFactoredPairs.build(profiles, rules, np.ones(len(profiles), dtype=bool)) is not None
+    left, right = enumerate_valid_pairs(profiles, rules, block_size=block_size)
+    np.testing.assert_array_equal(np.stack([left, right], axis=1), reference)
+    mask = np.random.default_rng(0).random(len(profiles)) < 0.7
+    left, right = enumerate_valid_pairs(profiles, rules, profile_mask=mask, block_size=block_size)
+    np.testing.assert_array_equal(np.stack([left, right], axis=1), reference_pairs(profiles, mask))
+    chunks = list(iter_valid_pair_chunks(profiles, rules, chunk_size=100, block_size=block_size))
+    pairs = np.concatenate([np.stack([chunk.left, chunk.right], axis=1) for chunk in chunks])
+    np.testing.assert_array_equal(pairs, reference)
+
+
+# profiles out of (non-cost part, cost) order cannot be factored and are checked pair by pair
+def test_unordered_profiles_are_not_factored(profiles):
+    shuffled = profiles[np.random.default_rng(0).permutation(len(profiles))]
+    rules = SPEC.compile()
+    assert _CostFactoredPairs.build(shuffled, rules, np.ones(len(shuffled), dtype=bool)) is None
+    left, right = enumerate_valid_pairs(shuffled, rules, block_size=7)
+    np.testing.assert_array_equal(np.stack([left, right], axis=1), reference_pairs(shuffled))
+
+
+@pytest.mark.parametrize('n, n_shards', [(0, 4), (1, 4), (2, 4), (5, 10), (100, 1), (100, 7), (6000, 32)])
+def test_balanced_shards_cover_the_rows_once(n, n_shards):
+    shards = balanced_shards(n, n_shards)
+    n_rows = max(n - 1, 0)
+    if n_rows == 0:
+        assert shards == []
+        return
+    assert len(shards) == min(n_shards, n_rows)
+    # consecutive, non-empty and covering [0, n - 1) with no gaps or overlaps
+    assert shards[0][0] == 0 and shards[-1][1] == n_rows
+    assert all(stop == start for (_, stop), (start, _) in zip(shards, shards[1:]))
+    assert all(start < stop for start, stop in shards)
+    # every bound is at most one row past its target, so every shard is within one row's pairs of an equal share
+    sizes = np.array([_pairs_before(n, stop) - _pairs_before(n, start) for start, stop in shards])
+    assert sizes.sum() == n * (n - 1) // 2
+    assert (np.abs(sizes - sizes.sum() / len(shards)) <= n - 1).all()
+
+
+@pytest.mark.parametrize('n_shards', [1, 3, 17])
+def test_parallel_pairs_match_the_serial_order(profiles, reference, n_shards):
+    mask = np.random.default_rng(0).random(len(profiles)) < 0.7
+    for profile_mask, expected in [(None, reference), (mask, reference_pairs(profiles, mask))]:
+        left, right = enumerate_valid_pairs_parallel(SPEC, profiles, profile_mask, n_workers=2, n_shards=n_shards,
+                                                     block_size=7, report=None)
+        np.testing.assert_array_equal(np.stack([left, right], axis=1), expected)
+        serial = enumerate_valid_pairs(profiles, SPEC.compile(), profile_mask, block_size=7)
+        np.testing.assert_array_equal(left, serial[0])
+        np.testing.assert_array_equal(right, serial[1])
+
+
+def test_profile_counters_sum_to_the_valid_profiles():
+    telemetry = Telemetry()
+    profiles = SPEC.valid_profiles(telemetry=telemetry)
+    counters = telemetry.counters
+    assert counters['profiles.checked'] == len(SPEC.full_factorial())
+    assert counters['profiles.valid'] == len(profiles)
+    rejected = sum(n for name, n in counters.items() if name.startswith('profiles.rejected.'))
+    assert counters['profiles.checked'] - counters['profiles.valid'] == rejected > 0
+
+
+# every pair of unmasked profiles is counted once, as valid or as rejected by exactly one rule, on every path
+@pytest.mark.parametrize('index, factoring', [(True, True), (False, True), (False, False)],
+                         ids=['vectorised', 'join-index', 'cost-factored'])
+def test_pair_counters_sum_to_the_enumerated_pairs(profiles, index, factoring, tmp_path):
+    mask = np.random.default_rng(0).random(len(profiles)) < 0.7
+    path = str(tmp_path / 'telemetry.jsonl')
+    with Telemetry(path, every_seconds=0) as telemetry:
+        chunks = list(iter_valid_pair_chunks(profiles, rules_without(SPEC.compile(), index, factoring), mask,
+                                             chunk_size=100, block_size=7, telemetry=telemetry))
+    n_written = sum(len(chunk.left) for chunk in chunks)
+    n_unmasked = int(mask.sum())
+    counters = telemetry.counters
+    assert counters['pairs.checked'] == n_unmasked * (n_unmasked - 1) // 2
+    assert counters['pairs.valid'] == n_written == len(reference_pairs(profiles, mask))
+    rejected = {name: n for name, n in counters.items() if name.startswith('pairs.rejected.')}
+    assert all(n >= 0 for n in rejected.values())
+    assert counters['pairs.checked'] - counters['pairs.valid'] == sum(rejected.values())
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert records[-1]['event'] == 'progress'
+    assert records[-1]['done'] == records[-1]['total'] == counters['pairs.checked']
+    assert records[-1]['valid'] == n_written
@@ -0,0 +1,39 @@
+## Pair sampler - unranking a ChoiceSetID gives the pair the enumeration numbers with it
+import numpy as np
+import pytest
+
+from design_specs import SPECS
+from pair_enumeration import enumerate_valid_pairs
+from pair_sampler import PairSampler
+
+SPEC = SPECS['additional_cost_constraints']
+
+
+# every tenth valid profile (still in enumeration order), with and without a profile mask
+@pytest.fixture(scope='module', params=[False, True], ids=['all', 'masked'])
+def sampler(request):
+    profiles = SPEC.valid_profiles()[::10]
+    mask = np.random.default_rng(0).random(len(profiles)) < 0.8 if request.param else None
+    return PairSampler(SPEC, profiles, mask, block_size=64)
+
+
+def test_profile_ids_are_the_enumerated_pairs(sampler):
+    left, right = enumerate_valid_pairs(sampler.profiles, sampler.rules, sampler.profile_mask)
+    assert len(sampler) == len(left) > 0
+    np.testing.assert_array_equal(sampler.profile_ids(np.arange(1, len(sampler) + 1)), np.stack([left, right], axis=1))
+
+    # any order, repeats and shape
+    ids = np.random.default_rng(1).integers(1, len(sampler) + 1, size=(50, 3))
+    np.testing.assert_array_equal(sampler.profile_ids(ids), np.stack([left, right], axis=1)[ids - 1])
+    chunk = sampler.chunk(11, 100)
+    np.testing.assert_array_equal(chunk.left, left[10:110])
+    np.testing.assert_array_equal(chunk.right, right[10:110])
+
+
+def test_out_of_range_ids_raise(sampler):
+    for ids in ([0], [len(sampler) + 1], [1, -3]):
+        with pytest.raises(IndexError, match='between 1 and'):
+            sampler.profile_ids(ids)
+    assert sampler.profile_ids(np.empty(0, dtype=np.int64)).shape == (0, 2)
+    with pytest.raises(ValueError):
+        sampler.sample_ids(len(sampler) + 1, 0)
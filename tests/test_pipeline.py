@@ -0,0 +1,64 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import synthetic_spec
+from coding import ASC, Continuous, DesignCoding
+from efficiency import db_error
+from modfed import MODFEDEROV_CODING
+from pipeline import load_config, run_pipeline, stage_inputs, stage_key
+from priors import Normal, PriorSpec
+
+
+def test_default_coding_is_full_rank():
+    config = load_config('additional_cost_constraints')
+    names = DesignCoding.from_dict(config['coding']).names
+    assert set(names) < set(MODFEDEROV_CODING.names)
+    assert set(MODFEDEROV_CODING.names) - set(names) == {'smcc', 'sncc'}
+
+
+def test_singular_coding_is_rejected(tmp_path):
+    path = tmp_path / 'spec.json'
+    config = load_config('additional_cost_constraints')
+    config['coding'] = MODFEDEROV_CODING.to_dict()
+    path.write_text(json.dumps(config))
+    with pytest.raises(ValueError, match='linear combinations'):
+        load_config(str(path))
+
+
+def test_search_settings_outside_the_key():
+    config = load_config('base')
+    key = stage_key('design', stage_inputs(config)['design'])
+    config['search'].update(n_workers=3, cache_mb=0)
+    assert stage_key('design', stage_inputs(config)['design']) == key
+    config['search']['n_sets'] = 24
+    assert stage_key('design', stage_inputs(config)['design']) != key
+
+
+# the whole pipeline on a small synthetic spec - the design it writes has the DB-error its search recorded, and
+# a second run only reads the cache
+def test_pipeline_design_stage(tmp_path):
+    spec = synthetic_spec(1, 1, 3)
+    coding = DesignCoding([ASC('asc', alternative=2)] + [Continuous(att, att.lower()) for att in spec.attribute_names])
+    priors = PriorSpec({name: Normal(0.0, 0.5) for name in coding.names})
+    path = tmp_path / 'small.json'
+    path.write_text(json.dumps({'design': spec.to_dict(), 'coding': coding.to_dict(), 'priors': priors.to_dict(),
+                                'search': {'n_draws': 10, 'n_chains': 2, 'n_workers': 1, 'time_budget_seconds': 4,
+                                           'n_sets': 8, 'cache_mb': 0}}))
+    config = load_config(str(path))
+    messages = []
+    paths = run_pipeline(config, ['design'], cache_dir=str(tmp_path / 'cache'), report=messages.append)
+
+    design = pd.read_csv(os.path.join(paths['design'], 'best_design.csv')).to_numpy().reshape(8, 3, -1)
+    draws = priors.draws(10, 'halton', 0, coding.names)
+    records = [json.load(open(os.path.join(paths['design'], name))) for name in os.listdir(paths['design'])
+               if name.startswith('chain_') and name.endswith('.json')]
+    best = min(record['db_error'] for record in records)
+    assert np.isclose(db_error(design, draws), best, rtol=1e-12)
+
+    messages.clear()
+    run_pipeline(config, ['design'], cache_dir=str(tmp_path / 'cache'), report=messages.append)
+    assert any('cached' in message for message in messages)
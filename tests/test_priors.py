@@ -0,0 +1,74 @@
+## Prior draws - scrambled Halton points and the adaptive number of draws
+import numpy as np
+import pytest
+
+import priors
+from efficiency import db_error
+from modfed import MODFEDEROV_PRIORS
+from priors import Fixed, PriorSpec, Uniform, adaptive_draws, scrambled_halton
+
+
+def test_halton_is_seeded_and_nested():
+    points = scrambled_halton(200, 5, rng=7)
+    np.testing.assert_array_equal(points, scrambled_halton(200, 5, rng=7))
+    np.testing.assert_array_equal(points[:50], scrambled_halton(50, 5, rng=7))
+    assert not np.array_equal(points, scrambled_halton(200, 5, rng=8))
+    assert ((points > 0) & (points < 1)).all()
+    np.testing.assert_array_equal(MODFEDEROV_PRIORS.draws(64, 'halton', 3), MODFEDEROV_PRIORS.draws(64, 'halton', 3))
+
+
+# digit scrambling keeps the stratification of the sequence: the first base ** k points fall one in each interval
+# of width base ** -k in every dimension
+@pytest.mark.parametrize('dim, n', [(0, 64), (1, 81), (2, 125), (4, 121)])
+def test_halton_points_are_stratified(dim, n):
+    points = scrambled_halton(n, 5, rng=0)[:, dim]
+    np.testing.assert_array_equal(np.sort(np.floor(points * n).astype(int)), np.arange(n))
+
+
+# d_errors replaced by the first draw column, so the estimate is the mean of the draws evaluated so far
+@pytest.fixture
+def evaluated(monkeypatch):
+    sizes = []
+
+    def d_errors(design, draws):
+        sizes.append(len(draws))
+        return draws[:, 0].copy()
+    monkeypatch.setattr(priors, 'd_errors', d_errors)
+    return sizes
+
+
+def test_adaptive_draws_stop_once_the_estimate_settles(evaluated):
+    spec = PriorSpec({'a': Fixed(2.0)})
+    draws, estimate = adaptive_draws(None, spec, min_draws=16, max_draws=4096)
+    # the estimate cannot move, so one doubling confirms it
+    assert evaluated == [16, 16] and len(draws) == 32 and estimate == 2.0
+
+
+def test_adaptive_draws_double_up_to_max_draws(evaluated):
+    spec = PriorSpec({'a': Uniform(0, 1), 'b': Uniform(0, 1)})
+    draws, estimate = adaptive_draws(None, spec, rtol=0, min_draws=16, max_draws=100, rng=0)
+    # only the new draws are evaluated at each doubling, and the last step stops at max_draws
+    assert evaluated == [16, 16, 32, 36]
+    np.testing.assert_array_equal(draws, spec.draws(100, 'halton', 0))
+    assert estimate == pytest.approx(draws[:, 0].mean())
+
+
+def test_adaptive_draws_stopping_rule(evaluated):
+    spec = PriorSpec({'a': Uniform(0, 1)})
+    rtol = 0.01
+    draws, estimate = adaptive_draws(None, spec, rtol=rtol, min_draws=4, max_draws=4096, rng=0)
+    n = len(draws)
+    assert 4 < n < 4096 and estimate == pytest.approx(draws[:, 0].mean())
+    # the last doubling moved the estimate by at most rtol, every earlier one by more
+    all_draws = spec.draws(4096, 'halton', 0)[:, 0]
+    means = [all_draws[:k].mean() for k in 4 * 2 ** np.arange(int(np.log2(n // 4)) + 1)]
+    changes = np.abs(np.diff(means)) / np.abs(means[1:])
+    assert changes[-1] <= rtol and (changes[:-1] > rtol).all()
+
+
+def test_adaptive_estimate_is_the_db_error_of_the_draws(store, coding):
+    design = coding.store_design(store, np.arange(1, 25))
+    draws, estimate = adaptive_draws(design, MODFEDEROV_PRIORS, rtol=0.05, min_draws=8, max_draws=128, rng=0,
+                                     columns=coding.names)
+    assert draws.shape[1] == len(coding.names)
+    assert estimate == pytest.approx(db_error(design, draws), rel=1e-12)
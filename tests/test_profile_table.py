@@ -0,0 +1,38 @@
+import numpy as np
+
+from efficiency import mnl_probabilities, set_information
+from exchange import information_factors
+from profile_table import ProfileTable
+
+
+def _sets(store, rng, n=200):
+    return store.profile_ids(store.sample_ids(n, rng))
+
+
+def test_design_matches_coding(store, coding, draws, rng):
+    table = ProfileTable(coding, store.spec, store.profiles, draws)
+    profile_ids = _sets(store, rng)
+    np.testing.assert_array_equal(table.design(profile_ids), coding.design(store.spec, store.profiles[profile_ids]))
+
+
+# in float64 the tables give the probabilities and factors of the design matrices, under the full priors too
+def test_float64_tables_match_efficiency(store, coding, draws, rng):
+    table = ProfileTable(coding, store.spec, store.profiles, draws, dtype=np.float64)
+    profile_ids = _sets(store, rng)
+    design = table.design(profile_ids)
+    np.testing.assert_allclose(table.probabilities(profile_ids), mnl_probabilities(design, draws),
+                               rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(table.factors(profile_ids), information_factors(design, draws), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(table.set_information(profile_ids), set_information(design, draws),
+                               rtol=1e-9, atol=1e-9)
+
+
+# float32 utilities carry about 7 significant digits
+def test_float32_tables_match_within_float32_tolerance(store, coding, mild_draws, rng):
+    table = ProfileTable(coding, store.spec, store.profiles, mild_draws)
+    profile_ids = _sets(store, rng)
+    design = table.design(profile_ids)
+    np.testing.assert_allclose(table.probabilities(profile_ids), mnl_probabilities(design, mild_draws),
+                               rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(table.factors(profile_ids), information_factors(design, mild_draws),
+                               rtol=1e-5, atol=1e-4)
@@ -0,0 +1,58 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from efficiency import db_error
+from search import DRAWS_FILE, SEARCH_FILE, _checkpoint_path, multi_start_search, run_chain
+
+
+def _recorded_db_error_is_exact(record, store, coding, draws):
+    design = coding.store_design(store, record['ids'])
+    assert np.isclose(record['db_error'], db_error(design, draws), rtol=1e-12)
+
+
+def test_checkpoint_db_error_is_exact(store, coding, draws, tmp_path):
+    record = run_chain(store, draws, 0, 0, str(tmp_path), time.time() + 3, coding=coding,
+                       checkpoint_every_seconds=1)
+    assert record['iteration'] > 0 and len(record['trace']) > 1
+    with open(_checkpoint_path(str(tmp_path), 0)) as f:
+        saved = json.load(f)
+    _recorded_db_error_is_exact(saved, store, coding, draws)
+
+
+def test_resumed_chain_keeps_db_error(store, coding, draws, tmp_path):
+    first = run_chain(store, draws, 0, 0, str(tmp_path), time.time() + 1, coding=coding)
+    resumed = run_chain(store, draws, 0, 0, str(tmp_path), time.time(), coding=coding)
+    assert resumed['iteration'] == first['iteration']
+    assert resumed['ids'] == first['ids']
+    assert resumed['db_error'] == first['db_error']
+
+
+# with more chains than workers every chain still gets its share of the budget, and the chains are ranked by
+# their exact DB-errors
+def test_multi_start_search_runs_every_chain(store_path, store, coding, draws, tmp_path):
+    records = multi_start_search(store_path, str(tmp_path), draws, n_chains=3, n_workers=1, time_budget_seconds=6,
+                                 coding=coding, report=None, cache_mb=0)
+    assert sorted(r['chain_id'] for r in records) == [0, 1, 2]
+    assert all(r['iteration'] > 0 for r in records)
+    for record in records:
+        _recorded_db_error_is_exact(record, store, coding, draws)
+    assert [r['db_error'] for r in records] == sorted(r['db_error'] for r in records)
+    assert os.path.exists(os.path.join(str(tmp_path), 'best_design.csv'))
+
+
+def test_multi_start_search_needs_a_chain(store_path, coding, draws, tmp_path):
+    with pytest.raises(ValueError, match='n_chains must be at least 1'):
+        multi_start_search(store_path, str(tmp_path / 'none'), draws, n_chains=0, coding=coding, report=None)
+    assert not (tmp_path / 'none').exists()
+
+    # a saved search without chains (e.g. edited by hand) has no result to write
+    np.save(str(tmp_path / DRAWS_FILE), draws)
+    with open(str(tmp_path / SEARCH_FILE), 'w') as f:
+        json.dump({'n_chains': 0, 'seed': 0, 'columns': coding.names, 'settings': {}}, f)
+    with pytest.raises(RuntimeError, match='no chain'):
+        multi_start_search(store_path, str(tmp_path), coding=coding, report=None, cache_mb=0)
+    assert not (tmp_path / 'best_design.csv').exists()
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from converters import read_design
+from design_specs import SPECS
+from modfed import MODFEDEROV_CODING, MODFEDEROV_PRIORS
+from simulation import choice_counts, fit_mnl, parameter_recovery, simulate_choices
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPEC = SPECS['additional_cost_constraints']
+
+
+# latest_design.csv in the full-rank coding, as python simulation.py codes it
+def _design():
+    codes = np.concatenate([chunk.codes for chunk in read_design(os.path.join(HERE, 'latest_design.csv'), SPEC,
+                                                                 'coded')])
+    coding = MODFEDEROV_CODING.full_rank(SPEC, SPEC.valid_profiles())
+    return coding.design(SPEC, codes), coding.names
+
+
+def test_simulated_choices_follow_the_probabilities(rng):
+    design, names = _design()
+    beta = MODFEDEROV_PRIORS.means(names) / 100
+    counts = choice_counts(simulate_choices(design, beta, 20000, rng), design.shape[1])
+    utility = design @ beta
+    p = np.exp(utility - utility.max(axis=1, keepdims=True))
+    p /= p.sum(axis=1, keepdims=True)
+    assert (counts.sum(axis=1) == 20000).all()
+    np.testing.assert_allclose(counts / 20000, p, atol=0.015)
+
+
+# prior means on a hundredth of their scale leave every choice uncertain, and the MNL recovers them
+def test_moderate_coefficients_are_recovered():
+    design, names = _design()
+    beta = MODFEDEROV_PRIORS.means(names) / 100
+    table = parameter_recovery(design, names, beta=beta, n_respondents=500, n_replications=200, n_workers=1)
+    assert table.attrs['n_converged'] == 200
+    np.testing.assert_array_equal(table['true'], beta)
+    assert (np.abs(table['bias']) < 0.25 * table['sd_estimate']).all()
+    assert (np.abs(table['mean_se'] / table['sd_estimate'] - 1) < 0.2).all()
+    assert table['coverage'].between(0.88, 0.99).all()
+    assert abs(table['coverage'].mean() - 0.95) < 0.02
+
+
+def test_recovery_does_not_depend_on_the_workers():
+    design, names = _design()
+    beta = MODFEDEROV_PRIORS.means(names) / 100
+    tables = [parameter_recovery(design, names, beta=beta, n_respondents=200, n_replications=40, n_workers=n,
+                                 batch_size=10) for n in (1, 2)]
+    pd.testing.assert_frame_equal(*tables)
+
+
+# with the prior means every respondent picks the alternative of highest utility - no finite estimate exists
+def test_separated_choices_do_not_converge(rng):
+    design, names = _design()
+    beta = MODFEDEROV_PRIORS.means(names)
+    counts = np.stack([choice_counts(simulate_choices(design, beta, 500, rng), design.shape[1]) for _ in range(5)])
+    estimates, standard_errors, converged = fit_mnl(design, counts)
+    assert not converged.any()
+    assert np.isnan(standard_errors).all()